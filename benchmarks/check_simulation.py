@@ -0,0 +1,113 @@
+from typing import List, Dict, Any
+import argparse
+import random
+
+import numpy as np
+
+from src.rules import GameState, StartTurn, GiveCode, Guess, apply
+from src.simulation import evaluate_guesses, board_groups, TURN_GUESSES_USED
+from src.words import WORDS
+
+
+def random_turns(n_turns: int, layout: tuple[int, int, int], max_guesses: int, seed: int) -> Dict[str, Any]:
+    """
+    Random team turns, each on a board with some words already revealed, as the single game
+    'GameState' and 'rules.apply' take them and as the arrays 'simulation.evaluate_guesses' takes.
+    Boards already won, or whose black word was revealed, are skipped.
+    """
+    rng = random.Random(seed)
+    words = list(dict.fromkeys(w.lower() for w in WORDS))
+    board_size = sum(layout) + 1
+    states, guesses = [], []
+    while len(states) < n_turns:
+        board = rng.sample(words, board_size)
+        team_order = rng.sample(["red", "blue"], 2)
+        revealed = rng.sample(range(board_size - 1), rng.randint(0, board_size - 1))
+        state = GameState.initial(
+            board, layout, team_order, revealed=[board[p] for p in revealed], team=rng.randint(0, 1)
+        )
+        if min(state.left[team_order[0]], state.left[team_order[1]]) == 0:
+            continue
+        hidden = [p for p in range(board_size) if not state.revealed[p]]
+        states.append(state)
+        guesses.append(rng.sample(hidden, min(len(hidden), rng.randint(0, max_guesses))))
+    return {"states": states, "guesses": guesses}
+
+
+def check_simulation(n_turns: int = 20_000, max_guesses: int = 6, seed: int = 0) -> List[str]:
+    """
+    This method plays the same random turns with 'rules.apply', one game at a time, and with
+    'simulation.evaluate_guesses', all at once, and compares the words revealed, the words left
+    of each group, the winner and whether the turn goes on.
+
+    Args:
+        n_turns (int): Turns compared.
+        max_guesses (int): Maximum words said in a turn.
+        seed (int): Seed of the random turns.
+    Return:
+        (List[str]) A description of every turn where they differ.
+    """
+    layout = (9, 8, 7)
+    turns = random_turns(n_turns, layout, max_guesses, seed)
+    states = turns["states"]
+    groups = board_groups(n_turns, layout)
+    revealed = np.array([state.revealed for state in states], dtype=bool)
+    left = np.array(
+        [[state.left[state.team_order[0]], state.left[state.team_order[1]], state.left["neutral"], 1]
+         for state in states]
+    )
+    team = np.array([state.team for state in states])
+    guesses = np.full((n_turns, max_guesses), -1)
+    for n, turn_guesses in enumerate(turns["guesses"]):
+        guesses[n, :len(turn_guesses)] = turn_guesses
+    simulated = evaluate_guesses(groups, revealed, left, team, guesses)
+
+    mismatches = []
+    for n, (state, turn_guesses) in enumerate(zip(states, turns["guesses"])):
+        state, _ = apply(state, StartTurn())
+        state, _ = apply(state, GiveCode("clue", len(turn_guesses)))
+        said = 0
+        for position in turn_guesses:
+            if state.phase != "guess":
+                break
+            state, _ = apply(state, Guess(state.words[position]))
+            said += 1
+        expected = {
+            "n_revealed": said,
+            "winner": -1 if state.winner is None else state.team_order.index(state.winner),
+            "goes_on": state.phase == "guess",
+            "revealed": list(state.revealed),
+            "left": [state.left[state.team_order[0]], state.left[state.team_order[1]], state.left["neutral"],
+                     state.left["black"]]
+        }
+        actual = {
+            "n_revealed": int(simulated["n_revealed"][n]),
+            "winner": int(simulated["winner"][n]),
+            "goes_on": bool(simulated["outcome"][n] == TURN_GUESSES_USED),
+            "revealed": revealed[n].tolist(),
+            "left": left[n].tolist()
+        }
+        if expected != actual:
+            differences = [key for key in expected if expected[key] != actual[key]]
+            mismatches.append(f"turn {n} (guesses {turn_guesses}): {', '.join(differences)} differ")
+    return mismatches
+
+
+def main(argv: List[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Check that the batched simulation follows the game rules")
+    parser.add_argument("--turns", type=int, default=20_000, help="Random turns compared.")
+    parser.add_argument("--max-guesses", type=int, default=6, help="Maximum words said in a turn.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    mismatches = check_simulation(args.turns, args.max_guesses, args.seed)
+    for mismatch in mismatches[:10]:
+        print(mismatch)
+    if mismatches:
+        raise SystemExit(f"The simulation differs from the rules in {len(mismatches)} of {args.turns} turns")
+    print(f"The simulation follows the rules in all {args.turns} turns")
+    return
+
+
+if __name__ == "__main__":
+    main()
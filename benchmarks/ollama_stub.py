@@ -0,0 +1,336 @@
+from typing import List, Dict, Any
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import argparse
+import ast
+import json
+import random
+import re
+import threading
+import time
+
+from src.history import count_tokens
+
+
+BOARD_PATTERN = re.compile(r"Current words in the board to be guessed yet:\n(\[.*?\])", re.S)
+REVEALED_PATTERN = re.compile(r"Words revealed since your last turn[^\n]*\n(\[.*?\])", re.S)
+PIECE_PATTERN = re.compile(r"\s*(?:\w+|[^\w\s])")
+
+
+class StubConfig:
+    """
+    Simulated costs of the stand-in server. Every call takes 'latency' seconds plus the time to
+    process the prompt and generate 'completion_tokens' at the configured rates. The first call
+    to each model also pays 'load_time', unless the model was already loaded. Like Ollama's
+    OLLAMA_NUM_PARALLEL, at most 'num_parallel' requests are processed at once (0: no limit), the
+    others wait for a free slot.
+    """
+
+    def __init__(
+            self,
+            latency: float = 0.0,
+            load_time: float = 0.0,
+            prompt_rate: float = 0.0,
+            generation_rate: float = 0.0,
+            completion_tokens: int = 30,
+            max_loaded_models: int = 1,
+            num_parallel: int = 0
+        ):
+        self.latency: float = latency
+        self.load_time: float = load_time
+        self.prompt_rate: float = prompt_rate
+        self.generation_rate: float = generation_rate
+        self.completion_tokens: int = completion_tokens
+        self.max_loaded_models: int = max_loaded_models
+        self.num_parallel: int = num_parallel
+
+
+class StubState:
+
+    def __init__(self, config: StubConfig, seed: int | None = None):
+        self.config: StubConfig = config
+        self.lock: threading.Lock = threading.Lock()
+        self.loaded_models: List[str] = []
+        self.requests: int = 0
+        self.loads: int = 0
+        # Streams closed by the client before the end
+        self.aborted: int = 0
+        self.rng: random.Random = random.Random(seed)
+        self.slots: threading.Semaphore | None = (
+            threading.Semaphore(config.num_parallel) if config.num_parallel > 0 else None
+        )
+
+    def load(self, model: str) -> float:
+        """
+        Marks the model as loaded and returns the load time to simulate.
+        """
+        with self.lock:
+            self.requests += 1
+            if model in self.loaded_models:
+                self.loaded_models.remove(model)
+                self.loaded_models.append(model)
+                return 0.0
+            self.loads += 1
+            self.loaded_models.append(model)
+            del self.loaded_models[:-self.config.max_loaded_models]
+            return self.config.load_time
+
+
+def _board_words(messages: List[Dict[str, Any]]) -> List[str]:
+    words: List[str] = []
+    revealed: set = set()
+    for message in messages:
+        if message.get("role") != "user":
+            continue
+        content = message.get("content") or ""
+        board = BOARD_PATTERN.search(content)
+        if board:
+            words = ast.literal_eval(board.group(1))
+            revealed = set()
+        for match in REVEALED_PATTERN.finditer(content):
+            revealed.update(ast.literal_eval(match.group(1)))
+    return [w for w in words if w not in revealed]
+
+
+def fake_arguments(tool_name: str, messages: List[Dict[str, Any]], rng: random.Random) -> Dict[str, Any]:
+    if tool_name == "indicate_secret_code":
+        return {"word": "clue", "number": 1, "justification": "", "words_related": []}
+    words = _board_words(messages)
+    return {"words": rng.sample(words, min(2, len(words))), "justification": ""}
+
+
+def fake_json(schema: Dict[str, Any], rng: random.Random) -> Any:
+    """
+    Minimal value that follows a JSON schema, as a model constrained by Ollama's 'format' would
+    generate. Arrays of enums get up to two distinct values.
+    """
+    if "enum" in schema:
+        return rng.choice(schema["enum"])
+    if schema.get("type") == "object":
+        return {name: fake_json(prop, rng) for name, prop in schema.get("properties", {}).items()}
+    if schema.get("type") == "array":
+        items = schema.get("items", {})
+        size = max(schema.get("minItems", 0), min(2, schema.get("maxItems", 2)))
+        if "enum" in items:
+            return rng.sample(items["enum"], min(size, len(items["enum"])))
+        return [fake_json(items, rng) for _ in range(size)]
+    if schema.get("type") == "integer":
+        return schema.get("minimum", 1)
+    if schema.get("type") == "string":
+        # Strings with a maximum length (justifications) are generated up to it
+        if "maxLength" in schema:
+            return ("because " * schema["maxLength"])[:schema["maxLength"]]
+        return "clue"
+    return None
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    server_version = "OllamaStub/0.1"
+    state: StubState
+
+    def log_message(self, format: str, *args: Any) -> None:
+        return
+
+    def _send_json(self, payload: Dict[str, Any]) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return
+
+    def do_GET(self) -> None:
+        if self.path == "/api/version":
+            self._send_json({"version": "0.0.0-stub"})
+        elif self.path == "/api/ps":
+            self._send_json({"models": [{"model": m, "name": m} for m in self.state.loaded_models]})
+        elif self.path == "/api/tags":
+            self._send_json({"models": []})
+        else:
+            self.send_error(404)
+        return
+
+    def do_HEAD(self) -> None:
+        self.send_response(200)
+        self.end_headers()
+        return
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if self.path not in ("/api/chat", "/api/generate"):
+            self.send_error(404)
+            return
+        slots = self.state.slots
+        if slots is not None:
+            slots.acquire()
+        try:
+            if self.path == "/api/chat":
+                self._chat(request)
+            else:
+                self._generate(request)
+        finally:
+            if slots is not None:
+                slots.release()
+        return
+
+    def _simulate(
+            self,
+            model: str,
+            prompt_tokens: int,
+            completion_tokens: int | None = None,
+            sleep_eval: bool = True
+        ) -> Dict[str, int]:
+        config = self.state.config
+        completion_tokens = config.completion_tokens if completion_tokens is None else completion_tokens
+        load_time = self.state.load(model)
+        prompt_time = prompt_tokens / config.prompt_rate if config.prompt_rate > 0 else 0.0
+        eval_time = completion_tokens / config.generation_rate if config.generation_rate > 0 else 0.0
+        total = config.latency + load_time + prompt_time + eval_time
+        wait = total if sleep_eval else total - eval_time
+        if wait > 0:
+            time.sleep(wait)
+        return {
+            "total_duration": int(total * 1e9),
+            "load_duration": int(load_time * 1e9),
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": int(prompt_time * 1e9),
+            "eval_count": completion_tokens,
+            "eval_duration": int(eval_time * 1e9)
+        }
+
+    def _generate(self, request: Dict[str, Any]) -> None:
+        stats = self._simulate(request.get("model", ""), count_tokens(request.get("prompt") or ""))
+        self._send_json({
+            "model": request.get("model"),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "response": "",
+            "done": True,
+            "done_reason": "load" if not request.get("prompt") else "stop",
+            **stats
+        })
+        return
+
+    def _chat(self, request: Dict[str, Any]) -> None:
+        model = request.get("model", "")
+        messages = request.get("messages", [])
+        prompt_tokens = sum(count_tokens(m.get("content") or "") for m in messages)
+        stream = request.get("stream", True)
+
+        message: Dict[str, Any] = {"role": "assistant", "content": ""}
+        pieces: List[str] = []
+        tools = request.get("tools") or []
+        if isinstance(request.get("format"), dict):
+            with self.state.lock:
+                message["content"] = json.dumps(fake_json(request["format"], self.state.rng))
+            # Structured outputs are generated (and streamed) one token at a time
+            pieces = PIECE_PATTERN.findall(message["content"])
+        elif tools:
+            tool_name = tools[0]["function"]["name"]
+            with self.state.lock:
+                arguments = fake_arguments(tool_name, messages, self.state.rng)
+            message["tool_calls"] = [{"function": {"name": tool_name, "arguments": arguments}}]
+
+        streamed = stream and len(pieces) > 0
+        stats = self._simulate(model, prompt_tokens, len(pieces) or None, sleep_eval=not streamed)
+        final = {
+            "model": model,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "message": message,
+            "done": True,
+            "done_reason": "stop",
+            **stats
+        }
+        if not stream:
+            self._send_json(final)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        if streamed:
+            if not self._stream_pieces(model, pieces, stats["eval_duration"] / 1e9 / len(pieces)):
+                return
+            final["message"] = {"role": "assistant", "content": ""}
+        try:
+            self.wfile.write((json.dumps(final) + "\n").encode("utf-8"))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        return
+
+    def _stream_pieces(self, model: str, pieces: List[str], piece_time: float) -> bool:
+        """
+        Sends the content one piece at a time. Returns False if the client closed the stream.
+        """
+        for piece in pieces:
+            if piece_time > 0:
+                time.sleep(piece_time)
+            chunk = {
+                "model": model,
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "message": {"role": "assistant", "content": piece},
+                "done": False
+            }
+            try:
+                self.wfile.write((json.dumps(chunk) + "\n").encode("utf-8"))
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                with self.state.lock:
+                    self.state.aborted += 1
+                return False
+        return True
+
+
+class StubServer(ThreadingHTTPServer):
+    # The default backlog (5) resets the connections of bursts of concurrent clients
+    request_queue_size: int = 1024
+
+
+def serve(
+        host: str = "127.0.0.1",
+        port: int = 0,
+        config: StubConfig | None = None,
+        seed: int | None = None
+    ) -> StubServer:
+    """
+    Starts a stand-in for the Ollama API in a background thread. Use port 0 to get a free port
+    ('server.server_address'); call 'server.shutdown()' to stop it.
+    """
+    handler = type("Handler", (StubHandler,), {"state": StubState(config or StubConfig(), seed)})
+    server = StubServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv: List[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Stand-in Ollama server for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every call.")
+    parser.add_argument("--load-time", type=float, default=0.0, help="Seconds to load a model.")
+    parser.add_argument("--prompt-rate", type=float, default=0.0, help="Prompt tokens per second (0: instant).")
+    parser.add_argument("--generation-rate", type=float, default=0.0, help="Generated tokens per second (0: instant).")
+    parser.add_argument("--completion-tokens", type=int, default=30)
+    parser.add_argument("--max-loaded-models", type=int, default=1)
+    parser.add_argument("--num-parallel", type=int, default=0, help="Requests processed at once (0: no limit).")
+    args = parser.parse_args(argv)
+    server = serve(args.host, args.port, StubConfig(
+        latency=args.latency,
+        load_time=args.load_time,
+        prompt_rate=args.prompt_rate,
+        generation_rate=args.generation_rate,
+        completion_tokens=args.completion_tokens,
+        max_loaded_models=args.max_loaded_models,
+        num_parallel=args.num_parallel
+    ))
+    print(f"Ollama stub listening on http://{server.server_address[0]}:{server.server_address[1]}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+    return
+
+
+if __name__ == "__main__":
+    main()
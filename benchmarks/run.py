@@ -0,0 +1,166 @@
+from typing import List, Dict, Callable
+import argparse
+import json
+import os
+import random
+import time
+
+from benchmarks.ollama_stub import serve, StubConfig
+from benchmarks.scripted import ScriptedLLMModel
+from src.game import Board, Captain, Guesser, Team, SecretCodeGame
+from src.history import GameHistory
+from src.llm_wrapper import ChatOllamaLLMModel
+from src.schemas import RoundStartEvent, CodeGivenEvent, WordRevealedEvent
+from src.tools import indicate_secret_code, choose_words
+
+
+BASELINES_PATH = os.path.join(os.path.dirname(__file__), "baselines.json")
+
+
+def rate(function: Callable[[int], None], min_time: float = 1.0) -> float:
+    """
+    Calls 'function(i)' repeatedly for at least 'min_time' seconds and returns the calls per second.
+    """
+    calls = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < min_time:
+        function(calls)
+        calls += 1
+    return calls / (time.perf_counter() - start)
+
+
+def scripted_game(seed: int, threaded: bool = False) -> SecretCodeGame:
+    board = Board(rng=random.Random(seed))
+    teams = {}
+    for color in ["red", "blue"]:
+        teams[color] = Team(color=color, players=[
+            Captain(
+                name=f"{color}_captain",
+                model=ScriptedLLMModel("scripted", "captain", board, seed=seed),
+                threaded=threaded
+            ),
+            Guesser(
+                name=f"{color}_guesser",
+                model=ScriptedLLMModel("scripted", "guesser", board, seed=seed),
+                threaded=threaded
+            )
+        ])
+    return SecretCodeGame(team_blue=teams["blue"], team_red=teams["red"], board=board)
+
+
+def bench_board_setup(i: int) -> None:
+    Board(rng=random.Random(i))
+
+
+def bench_game(i: int) -> None:
+    scripted_game(i).play()
+
+
+def bench_threaded_game(i: int) -> None:
+    scripted_game(i, threaded=True).play()
+
+
+def bench_history(i: int) -> None:
+    # A long game: 12 rounds, each with two codes and two reveals, rendered for both roles every turn
+    history = GameHistory()
+    for round_number in range(12):
+        history.append(RoundStartEvent(round=round_number))
+        for team in ["red", "blue"]:
+            history.render("captain")
+            history.append(CodeGivenEvent(team=team, word="clue", number=2))
+            history.render("guesser")
+            history.append(WordRevealedEvent(team=team, word="word", group=team))
+            history.append(WordRevealedEvent(team=team, word="other", group="neutral"))
+
+
+def engine_benchmarks(min_time: float) -> Dict[str, float]:
+    game = scripted_game(0)
+    game.play()
+    rounds_info = game.results.rounds_info
+    return {
+        "board_setup_per_sec": rate(bench_board_setup, min_time),
+        "scripted_games_per_sec": rate(bench_game, min_time),
+        "scripted_threaded_games_per_sec": rate(bench_threaded_game, min_time),
+        "history_renders_per_sec": rate(bench_history, min_time),
+        "results_build_per_sec": rate(lambda i: game.save_results(rounds_info), min_time)
+    }
+
+
+def end_to_end_benchmarks(min_time: float, config: StubConfig) -> Dict[str, float]:
+    """
+    Games per second of ChatOllamaLLMModel players talking to a local stand-in server.
+    """
+    server = serve(config=config, seed=0)
+    base_url = f"http://{server.server_address[0]}:{server.server_address[1]}"
+
+    def play(i: int) -> None:
+        teams = {}
+        for color in ["red", "blue"]:
+            teams[color] = Team(color=color, players=[
+                Captain(
+                    name=f"{color}_captain",
+                    model=ChatOllamaLLMModel("stub", tools=[indicate_secret_code], base_url=base_url)
+                ),
+                Guesser(
+                    name=f"{color}_guesser",
+                    model=ChatOllamaLLMModel("stub", tools=[choose_words], base_url=base_url)
+                )
+            ])
+        SecretCodeGame(
+            team_blue=teams["blue"], team_red=teams["red"], board=Board(rng=random.Random(i))
+        ).play()
+
+    try:
+        return {"ollama_stub_games_per_sec": rate(play, min_time)}
+    finally:
+        server.shutdown()
+
+
+def compare(results: Dict[str, float], baselines: Dict[str, float], tolerance: float) -> List[str]:
+    regressions = []
+    for name, value in results.items():
+        baseline = baselines.get(name)
+        status = ""
+        if baseline:
+            change = value / baseline - 1
+            status = f"({change:+.1%} vs baseline {baseline:,.1f})"
+            if change < -tolerance:
+                regressions.append(name)
+                status += " REGRESSION"
+        print(f"{name:36s} {value:14,.1f} {status}")
+    return regressions
+
+
+def main(argv: List[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Engine and end-to-end benchmarks")
+    parser.add_argument("--min-time", type=float, default=1.0, help="Seconds per benchmark.")
+    parser.add_argument("--skip-e2e", action="store_true", help="Skip the stand-in server benchmark.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Stand-in server latency per call.")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed slowdown before a benchmark is reported as a regression.")
+    parser.add_argument("--save-baselines", action="store_true", help="Record the results as the new baselines.")
+    parser.add_argument("--baselines", default=BASELINES_PATH)
+    args = parser.parse_args(argv)
+
+    results = engine_benchmarks(args.min_time)
+    if not args.skip_e2e:
+        results.update(end_to_end_benchmarks(args.min_time, StubConfig(latency=args.latency)))
+
+    baselines = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines) as f:
+            baselines = json.load(f)
+    regressions = compare(results, baselines, args.tolerance)
+
+    if args.save_baselines:
+        with open(args.baselines, "w") as f:
+            json.dump({name: round(value, 1) for name, value in results.items()}, f, indent=2)
+            f.write("\n")
+        print(f"Baselines saved to {args.baselines}")
+    elif regressions:
+        raise SystemExit(f"Slower than the baselines: {', '.join(regressions)}")
+    return
+
+
+if __name__ == "__main__":
+    main()
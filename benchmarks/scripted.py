@@ -0,0 +1,58 @@
+from typing import List, Dict, Any, Literal
+import random
+
+from src.game import Board
+from src.llm_wrapper import LLMModel
+from src.schemas import LLMMessage, ToolCall
+
+
+class ScriptedLLMModel(LLMModel):
+    """
+    Zero-latency model that answers instantly with valid tool calls, so that a game only costs
+    the engine's own work. The guesser picks random words that are still in the board.
+    """
+
+    def __init__(
+            self,
+            model_name: str,
+            role: Literal["captain", "guesser"],
+            board: Board,
+            temperature: float = 0.0,
+            tools: List = [],
+            seed: int | None = None,
+            max_words: int = 3
+        ):
+        self.role: Literal["captain", "guesser"] = role
+        self.board: Board = board
+        self.max_words: int = max_words
+        self._rng: random.Random = random.Random(seed)
+        super().__init__(model_name, temperature, tools, seed)
+
+    def build_model(self) -> Any:
+        return None
+
+    def chat(
+            self,
+            messages: List[Dict[str, str]]
+        ) -> LLMMessage:
+        if self.role == "captain":
+            tool_call = ToolCall(
+                tool_name="indicate_secret_code",
+                args={"word": "clue", "number": 1, "justification": "", "words_related": []}
+            )
+        else:
+            left_words = self.board.left_team_words["left_words"]
+            tool_call = ToolCall(
+                tool_name="choose_words",
+                args={
+                    "words": self._rng.sample(left_words, min(self.max_words, len(left_words))),
+                    "justification": ""
+                }
+            )
+        return LLMMessage(model_name=self.model_name, content=None, tool_call=tool_call)
+
+    async def achat(
+            self,
+            messages: List[Dict[str, str]]
+        ) -> LLMMessage:
+        return self.chat(messages)
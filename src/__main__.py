@@ -0,0 +1,172 @@
+from typing import List, Dict, Callable, Iterator
+import argparse
+import json
+import random
+import sys
+
+# Entry point of 'python -m src'. Only the standard library is imported here: each command
+# imports the modules it needs when it runs, so '--help' and argument errors are instant.
+
+
+def play(argv: List[str]) -> None:
+    from src.game import Board, SecretCodeGame
+    from src.llm_wrapper import ChatOllamaLLMModel
+    from src.results_sink import ResultsSink
+    from src.schemas import TeamData
+    from src.tournament import parse_player, build_team, build_model
+
+    parser = argparse.ArgumentParser(prog="python -m src play", description="Play a single game")
+    parser.add_argument("--red", required=True, type=parse_player,
+                        help="Red team spec 'model_name[,temperature[,seed]]', 'embedding:<fastembed model>' "
+                             "for the embedding baseline.")
+    parser.add_argument("--blue", required=True, type=parse_player,
+                        help="Blue team spec 'model_name[,temperature[,seed]]', 'embedding:<fastembed model>' "
+                             "for the embedding baseline.")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for the board.")
+    parser.add_argument("--base-url", default=None, help="Ollama server URL.")
+    parser.add_argument("--threaded", action="store_true",
+                        help="Players keep their conversation and only receive what changed each turn.")
+    parser.add_argument("--structured-output", action="store_true",
+                        help="Players answer with JSON restricted to the board words instead of tool calls.")
+    parser.add_argument("--stream-guesses", action="store_true",
+                        help="Guessers stream their answer and stop generating once the turn is decided.")
+    parser.add_argument("--samples", type=int, default=1,
+                        help="Answers sampled in parallel (one seed each) for every turn, played by their aggregate.")
+    parser.add_argument("--aggregation", choices=["borda", "majority"], default="borda",
+                        help="How the guessers' samples are aggregated.")
+    parser.add_argument("--log", default=None,
+                        help="JSON lines file where every round is written as soon as it is over.")
+    parser.add_argument("--output", default=None, help="JSON lines file to append the Results to.")
+    args = parser.parse_args(argv)
+
+    def get_model(player, tools):
+        return build_model(player, tools, ChatOllamaLLMModel, {"base_url": args.base_url})
+
+    teams = {
+        color: build_team(
+            color, TeamData(captain=spec, guesser=spec), get_model,
+            args.threaded, args.structured_output, args.stream_guesses, args.samples, args.aggregation
+        )
+        for color, spec in [("red", args.red), ("blue", args.blue)]
+    }
+    game = SecretCodeGame(
+        team_blue=teams["blue"],
+        team_red=teams["red"],
+        board=Board(rng=random.Random(args.seed)),
+        sink=ResultsSink(args.log) if args.log else None
+    )
+    game.play()
+    if args.output:
+        with open(args.output, "a") as f:
+            f.write(game.results.model_dump_json() + "\n")
+    print(f"Winner: {game.results.winner_team}, rounds: {game.results.num_rounds}")
+    return
+
+
+def _read_any_results(path: str) -> Iterator:
+    """
+    Yields the Results of a ResultsSink log or of a tournament '--output' file, compact or not.
+    """
+    from src.compact import read_compact_results
+    from src.results_sink import read_results
+    from src.schemas import Results
+
+    with open(path) as f:
+        first_line = f.readline()
+    if not first_line.strip():
+        return
+    if "type" in json.loads(first_line):
+        for _, results in read_results(path):
+            yield results
+        return
+    read_line = read_compact_results if "board" in json.loads(first_line) else Results.model_validate_json
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield read_line(line)
+    return
+
+
+def replay(argv: List[str]) -> None:
+    from src.game import SecretCodeGame, ReplayMismatch
+
+    parser = argparse.ArgumentParser(
+        prog="python -m src replay",
+        description="Re-execute saved games without calling any LLM and check their outcome"
+    )
+    parser.add_argument("paths", nargs="+", help="ResultsSink logs or tournament '--output' files.")
+    args = parser.parse_args(argv)
+
+    games, mismatches = 0, 0
+    for path in args.paths:
+        for results in _read_any_results(path):
+            games += 1
+            try:
+                SecretCodeGame.replay(results)
+            except ReplayMismatch as e:
+                mismatches += 1
+                print(f"{path} game {games}: {e}")
+    print(f"Replayed {games} games, {mismatches} mismatches")
+    if mismatches:
+        raise SystemExit(1)
+    return
+
+
+def tournament(argv: List[str]) -> None:
+    from src.tournament import main
+    main(argv)
+    return
+
+
+def boards(argv: List[str]) -> None:
+    from src.corpus import main
+    main(argv)
+    return
+
+
+def simulate(argv: List[str]) -> None:
+    from src.simulation import main
+    main(argv)
+    return
+
+
+def analyze(argv: List[str]) -> None:
+    from src.analytics import main
+    main(argv)
+    return
+
+
+def export(argv: List[str]) -> None:
+    from src.export import main
+    main(argv)
+    return
+
+
+COMMANDS: Dict[str, Callable[[List[str]], None]] = {
+    "play": play,
+    "tournament": tournament,
+    "replay": replay,
+    "analyze": analyze,
+    "boards": boards,
+    "simulate": simulate,
+    "export": export
+}
+
+
+def main(argv: List[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m src",
+        description="Secret Code: play games and tournaments between LLMs and analyze their results",
+        epilog="Run 'python -m src <command> --help' for the options of each command."
+    )
+    parser.add_argument("command", choices=list(COMMANDS))
+    parser.add_argument("args", nargs=argparse.REMAINDER, help=argparse.SUPPRESS)
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+    # The parsers of the commands take their program name from here
+    sys.argv[0] = f"{parser.prog} {args.command}"
+    COMMANDS[args.command](args.args)
+    return
+
+
+if __name__ == "__main__":
+    main()
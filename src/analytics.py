@@ -0,0 +1,265 @@
+from typing import List, Dict, Any, Iterable
+import argparse
+import json
+
+import numpy as np
+
+from src.export import guess_rows
+from src.results_sink import read_results
+from src.schemas import Results, PlayerData
+
+
+TEAM_CODES = {"red": 0, "blue": 1}
+
+GAME_COLUMNS = [
+    "red_captain", "red_guesser", "blue_captain", "blue_guesser", "winner", "num_rounds", "black_loser"
+]
+TURN_COLUMNS = ["game", "team", "captain", "guesser", "clue_number", "hits", "guesses", "first_pick_own"]
+
+
+def wilson_interval(successes: np.ndarray, trials: np.ndarray, z: float = 1.96) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorized Wilson score interval of a binomial proportion.
+    """
+    trials = np.asarray(trials, dtype=np.float64)
+    safe_trials = np.maximum(trials, 1)
+    p = np.asarray(successes, dtype=np.float64) / safe_trials
+    denominator = 1 + z**2 / safe_trials
+    center = (p + z**2 / (2 * safe_trials)) / denominator
+    half_width = z * np.sqrt(p * (1 - p) / safe_trials + z**2 / (4 * safe_trials**2)) / denominator
+    empty = trials == 0
+    return np.where(empty, 0.0, center - half_width), np.where(empty, 1.0, center + half_width)
+
+
+class ResultsTable:
+    """
+    Array-backed tables of many games: one row per game and one row per team turn, with the
+    models stored as integer ids. Games can be added at any time; they are buffered and appended
+    to the arrays the next time a metric is computed, and every metric is computed with vectorized
+    operations over the whole table. A model is a (model name, temperature, seed) configuration,
+    named by its model name alone unless the table has several configurations of that name.
+    """
+
+    players: List[PlayerData]
+
+    def __init__(self):
+        self.players: List[PlayerData] = []
+        self._model_ids: Dict[tuple[str, float, int | None], int] = {}
+        self._games: Dict[str, np.ndarray] = {c: np.zeros(0, dtype=np.int32) for c in GAME_COLUMNS}
+        self._turns: Dict[str, np.ndarray] = {c: np.zeros(0, dtype=np.int32) for c in TURN_COLUMNS}
+        self._pending_games: Dict[str, List[int]] = {c: [] for c in GAME_COLUMNS}
+        self._pending_turns: Dict[str, List[int]] = {c: [] for c in TURN_COLUMNS}
+        self._num_games: int = 0
+        return
+
+    @classmethod
+    def from_sink(cls, path: str) -> "ResultsTable":
+        table = cls()
+        table.extend(results for _, results in read_results(path))
+        return table
+
+    def __len__(self) -> int:
+        return self._num_games
+
+    def model_id(self, player: PlayerData) -> int:
+        key = (player.model_name, player.temperature, player.seed)
+        if key not in self._model_ids:
+            self._model_ids[key] = len(self.players)
+            self.players.append(player)
+        return self._model_ids[key]
+
+    @property
+    def model_names(self) -> List[str]:
+        configurations: Dict[str, int] = {}
+        for player in self.players:
+            configurations[player.model_name] = configurations.get(player.model_name, 0) + 1
+        return [
+            player.model_name if configurations[player.model_name] == 1
+            else f"{player.model_name} (temperature {player.temperature}, seed {player.seed})"
+            for player in self.players
+        ]
+
+    def add(self, results: Results) -> None:
+        game = self._num_games
+        players = {
+            color: (self.model_id(team.captain), self.model_id(team.guesser))
+            for color, team in [("red", results.teams.red), ("blue", results.teams.blue)]
+        }
+        turns: Dict[tuple[int, str], Dict[str, Any]] = {}
+        black_loser = -1
+        for row in guess_rows(str(game), results):
+            turn = turns.setdefault(
+                (row["round"], row["team"]),
+                {"clue_number": row["clue_number"], "hits": 0, "guesses": 0, "first_pick_own": -1}
+            )
+            if row["outcome"] in ("unplayed", "repeated"):
+                continue
+            if row["rank"] == 0:
+                turn["first_pick_own"] = int(row["outcome"] == "own")
+            turn["guesses"] += 1
+            turn["hits"] += int(row["outcome"] == "own")
+            if row["outcome"] == "black":
+                black_loser = TEAM_CODES[row["team"]]
+
+        game_row = {
+            "red_captain": players["red"][0],
+            "red_guesser": players["red"][1],
+            "blue_captain": players["blue"][0],
+            "blue_guesser": players["blue"][1],
+            "winner": TEAM_CODES[results.winner_team],
+            "num_rounds": results.num_rounds,
+            "black_loser": black_loser
+        }
+        for column, value in game_row.items():
+            self._pending_games[column].append(value)
+        for (_, color), turn in turns.items():
+            turn_row = {
+                "game": game,
+                "team": TEAM_CODES[color],
+                "captain": players[color][0],
+                "guesser": players[color][1],
+                **turn
+            }
+            for column in TURN_COLUMNS:
+                self._pending_turns[column].append(turn_row[column])
+        self._num_games += 1
+        return
+
+    def extend(self, results: Iterable[Results]) -> None:
+        for r in results:
+            self.add(r)
+        return
+
+    def _flush(self) -> None:
+        for arrays, pending in [(self._games, self._pending_games), (self._turns, self._pending_turns)]:
+            if pending and len(next(iter(pending.values()))) > 0:
+                for column, values in pending.items():
+                    arrays[column] = np.concatenate([arrays[column], np.asarray(values, dtype=np.int32)])
+                    values.clear()
+        return
+
+    @property
+    def games(self) -> Dict[str, np.ndarray]:
+        self._flush()
+        return self._games
+
+    @property
+    def turns(self) -> Dict[str, np.ndarray]:
+        self._flush()
+        return self._turns
+
+    def _team_ids(self) -> tuple[np.ndarray, np.ndarray]:
+        # A team is a (captain, guesser) pair of models
+        games = self.games
+        n = len(self.players)
+        return games["red_captain"] * n + games["red_guesser"], games["blue_captain"] * n + games["blue_guesser"]
+
+    def _team_name(self, team_id: int, model_names: List[str]) -> str:
+        captain, guesser = divmod(int(team_id), len(model_names))
+        if captain == guesser:
+            return model_names[captain]
+        return f"{model_names[captain]}/{model_names[guesser]}"
+
+    def matchups(self, z: float = 1.96) -> List[Dict[str, Any]]:
+        """
+        Win rate (with its Wilson confidence interval) and average rounds of every pair of teams,
+        from the point of view of 'team'.
+        """
+        red, blue = self._team_ids()
+        team = np.minimum(red, blue)
+        opponent = np.maximum(red, blue)
+        team_won = np.where(team == red, self.games["winner"] == 0, self.games["winner"] == 1)
+        model_names = self.model_names
+        n_teams = len(model_names) ** 2
+        keys, inverse = np.unique(team * n_teams + opponent, return_inverse=True)
+        games = np.bincount(inverse, minlength=len(keys))
+        wins = np.bincount(inverse, weights=team_won, minlength=len(keys))
+        rounds = np.bincount(inverse, weights=self.games["num_rounds"], minlength=len(keys))
+        low, high = wilson_interval(wins, games, z)
+        return [
+            {
+                "team": self._team_name(key // n_teams, model_names),
+                "opponent": self._team_name(key % n_teams, model_names),
+                "games": int(games[i]),
+                "wins": int(wins[i]),
+                "win_rate": float(wins[i] / games[i]),
+                "ci_low": float(low[i]),
+                "ci_high": float(high[i]),
+                "avg_rounds": float(rounds[i] / games[i])
+            }
+            for i, key in enumerate(keys)
+        ]
+
+    def _per_model(
+            self,
+            model: np.ndarray,
+            values: Dict[str, np.ndarray],
+            count_name: str = "turns"
+        ) -> Dict[str, Dict[str, float]]:
+        model_names = self.model_names
+        n = len(model_names)
+        counts = np.bincount(model, minlength=n)
+        sums = {name: np.bincount(model, weights=v, minlength=n) for name, v in values.items()}
+        return {
+            model_names[m]: {
+                count_name: int(counts[m]),
+                **{name: float(sums[name][m] / counts[m]) for name in values}
+            }
+            for m in range(n) if counts[m] > 0
+        }
+
+    def captain_stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        Per captain model: average clue number, average words actually hit and how often the
+        guesser hit fewer words than the clue number.
+        """
+        turns = self.turns
+        return self._per_model(turns["captain"], {
+            "avg_clue_number": turns["clue_number"],
+            "avg_hits": turns["hits"],
+            "under_hit_rate": turns["hits"] < turns["clue_number"]
+        })
+
+    def guesser_stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        Per guesser model: first-pick precision, average guesses per turn and black-word loss rate
+        (games lost by saying the black word over games played).
+        """
+        turns = self.turns
+        picked = turns["first_pick_own"] >= 0
+        stats = self._per_model(turns["guesser"][picked], {
+            "first_pick_precision": turns["first_pick_own"][picked],
+            "avg_guesses": turns["guesses"][picked]
+        })
+        games = self.games
+        guesser = np.concatenate([games["red_guesser"], games["blue_guesser"]])
+        black_loss = np.concatenate([games["black_loser"] == 0, games["black_loser"] == 1])
+        for model_name, values in self._per_model(guesser, {"black_loss_rate": black_loss}, "games").items():
+            stats.setdefault(model_name, {}).update(values)
+        return stats
+
+    def summary(self) -> Dict[str, Any]:
+        games = self.games
+        return {
+            "games": len(self),
+            "avg_rounds": float(games["num_rounds"].mean()) if len(self) > 0 else 0.0,
+            "black_loss_rate": float((games["black_loser"] >= 0).mean()) if len(self) > 0 else 0.0,
+            "matchups": self.matchups(),
+            "captains": self.captain_stats(),
+            "guessers": self.guesser_stats()
+        }
+
+
+def main(argv: List[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Summarize a results log")
+    parser.add_argument("paths", nargs="+", help="JSON lines files written by a ResultsSink.")
+    args = parser.parse_args(argv)
+    table = ResultsTable()
+    for path in args.paths:
+        table.extend(results for _, results in read_results(path))
+    print(json.dumps(table.summary(), indent=2))
+    return
+
+
+if __name__ == "__main__":
+    main()
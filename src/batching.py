@@ -0,0 +1,153 @@
+from typing import List, Dict, Any
+from collections import Counter
+from concurrent.futures import Future
+import asyncio
+import queue
+import threading
+import time
+
+from src.llm_wrapper import LLMModel, LLMModelWrapper
+from src.schemas import LLMMessage
+
+
+class BatchedLLMModel(LLMModelWrapper):
+    """
+    Collects the 'chat' calls made concurrently by many games and sends them to the wrapped
+    model in batches (see 'LLMModel.chat_batch'). A batch is sent when it reaches
+    'max_batch_size' requests or 'max_wait' seconds after its first request arrived,
+    whichever happens first. Each caller receives its own LLMMessage. A 'semaphore' shared by
+    the batchers of the same backend limits the batches in flight, and 'close' stops the
+    dispatcher threads once the requests already queued are sent.
+    """
+
+    max_batch_size: int
+    max_wait: float
+    num_dispatchers: int
+
+    def __init__(
+            self,
+            model: LLMModel,
+            max_batch_size: int = 8,
+            max_wait: float = 0.01,
+            num_dispatchers: int = 1,
+            semaphore: threading.Semaphore | None = None
+        ):
+        """
+        Args:
+            model (LLMModel): Model the batches are sent to.
+            max_batch_size (int): Maximum number of requests per batch.
+            max_wait (float): Maximum seconds a request waits for the batch to be filled.
+            num_dispatchers (int): Number of batches that can be in flight at the same time.
+            semaphore (threading.Semaphore | None): Limit of batches in flight, shared with the
+                other batchers of the backend.
+        """
+        super().__init__(model)
+        self.max_batch_size: int = max_batch_size
+        self.max_wait: float = max_wait
+        self.num_dispatchers: int = num_dispatchers
+        self.semaphore: threading.Semaphore | None = semaphore
+        self._closed: bool = False
+        self._queue: queue.Queue = queue.Queue()
+        self._lock: threading.Lock = threading.Lock()
+        self._dispatchers: List[threading.Thread] = []
+        self._requests: int = 0
+        self._batches: int = 0
+        self._batch_sizes: Counter = Counter()
+        self._max_queue_depth: int = 0
+
+    def _submit(self, messages: List[Dict[str, str]]) -> Future:
+        future: Future = Future()
+        with self._lock:
+            if self._closed:
+                raise Exception("The batcher is closed")
+            if not self._dispatchers:
+                for _ in range(self.num_dispatchers):
+                    dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+                    dispatcher.start()
+                    self._dispatchers.append(dispatcher)
+            self._requests += 1
+            self._queue.put((messages, future))
+            self._max_queue_depth = max(self._max_queue_depth, self._queue.qsize())
+        return future
+
+    def chat(
+            self,
+            messages: List[Dict[str, str]]
+        ) -> LLMMessage:
+        return self._submit(messages).result()
+
+    async def achat(
+            self,
+            messages: List[Dict[str, str]]
+        ) -> LLMMessage:
+        return await asyncio.wrap_future(self._submit(messages))
+
+    def close(self) -> None:
+        """
+        Stops the dispatcher threads after the requests already queued are sent.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            # One stop mark (None) per dispatcher, queued after the pending requests
+            for _ in self._dispatchers:
+                self._queue.put(None)
+        return
+
+    def _collect_batch(self) -> List[tuple[List[Dict[str, str]], Future]]:
+        # Empty once the batcher is closed
+        item = self._queue.get()
+        if item is None:
+            return []
+        batch = [item]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # The stop mark is left for the next collection of this dispatcher
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _send(self, batch: List[List[Dict[str, str]]]) -> List[LLMMessage]:
+        if self.semaphore is None:
+            return self.model.chat_batch(batch)
+        with self.semaphore:
+            return self.model.chat_batch(batch)
+
+    def _dispatch(self) -> None:
+        while batch := self._collect_batch():
+            with self._lock:
+                self._batches += 1
+                self._batch_sizes[len(batch)] += 1
+            try:
+                responses = self._send([messages for messages, _ in batch])
+                if len(responses) != len(batch):
+                    raise Exception(f"Expected {len(batch)} responses from the batch, got {len(responses)}")
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), response in zip(batch, responses):
+                future.set_result(response)
+        return
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            batched_requests = sum(size * count for size, count in self._batch_sizes.items())
+            return {
+                "requests": self._requests,
+                "batches": self._batches,
+                "mean_batch_size": batched_requests / self._batches if self._batches > 0 else 0.0,
+                "batch_sizes": dict(sorted(self._batch_sizes.items())),
+                "queue_depth": self._queue.qsize(),
+                "max_queue_depth": self._max_queue_depth
+            }
@@ -0,0 +1,341 @@
+from typing import List, Dict, Any, Iterator, AsyncIterator
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from src.llm_wrapper import LLMModel, LLMModelWrapper
+from src.schemas import LLMMessage, CallUsage, ResponseFormat
+from src.streaming import WordsStreamParser
+from src.tools import REQUIRED_ARGS
+
+
+class ResponseCache:
+    """
+    On-disk store of LLM responses backed by SQLite, so it can be shared by several worker
+    processes. Entries are evicted in least recently used order once 'max_entries' or
+    'max_bytes' is exceeded.
+    """
+
+    path: str
+    max_entries: int | None
+    max_bytes: int | None
+    hits: int
+    misses: int
+
+    def __init__(
+            self,
+            path: str,
+            max_entries: int | None = 100_000,
+            max_bytes: int | None = None,
+            timeout: float = 30.0
+        ):
+        self.path: str = path
+        self.max_entries: int | None = max_entries
+        self.max_bytes: int | None = max_bytes
+        self.timeout: float = timeout
+        self.hits: int = 0
+        self.misses: int = 0
+        self._connection: sqlite3.Connection | None = None
+        self._pid: int | None = None
+        return
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Connections can't be shared between processes, each one opens its own
+        state = self.__dict__.copy()
+        state["_connection"] = None
+        state["_pid"] = None
+        return state
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                """CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL
+                )"""
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)"
+            )
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    @staticmethod
+    def make_key(
+            model_name: str,
+            temperature: float,
+            seed: int | None,
+            tools: List,
+            messages: List[Dict[str, str]],
+            response_format: ResponseFormat | None = None,
+            stream: bool = False
+        ) -> str:
+        request = {
+            "model_name": model_name,
+            "temperature": temperature,
+            "seed": seed,
+            "tools": [getattr(t, "name", getattr(t, "__name__", repr(t))) for t in tools],
+            "messages": messages
+        }
+        if response_format is not None:
+            # Only added when present so the keys of tool calling responses don't change
+            request["response_format"] = response_format
+        if stream:
+            # Streams are stored as their text, apart from the parsed responses of the same request
+            request["stream"] = True
+        payload = json.dumps(
+            request,
+            sort_keys=True,
+            ensure_ascii=False,
+            default=str
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> LLMMessage | None:
+        row = self.connection.execute(
+            "SELECT value FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.connection.execute(
+            "UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key)
+        )
+        return LLMMessage.model_validate_json(row[0])
+
+    def set(self, key: str, message: LLMMessage) -> None:
+        value = message.model_dump_json()
+        self.connection.execute(
+            "INSERT OR REPLACE INTO responses (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+            (key, value, len(value), time.time())
+        )
+        self._evict()
+        return
+
+    def _evict(self) -> None:
+        if self.max_entries is not None:
+            self.connection.execute(
+                """DELETE FROM responses WHERE key IN (
+                    SELECT key FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                )""",
+                (self.max_entries,)
+            )
+        if self.max_bytes is not None:
+            self.connection.execute(
+                """DELETE FROM responses WHERE key IN (
+                    SELECT key FROM (
+                        SELECT key, SUM(size) OVER (ORDER BY last_access DESC) AS total_size
+                        FROM responses
+                    ) WHERE total_size > ?
+                )""",
+                (self.max_bytes,)
+            )
+        return
+
+    def clear(self) -> None:
+        self.connection.execute("DELETE FROM responses")
+        return
+
+    def stats(self) -> Dict[str, int | float]:
+        entries, total_size = self.connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests > 0 else 0.0,
+            "entries": entries,
+            "bytes": total_size
+        }
+
+
+class CachedLLMModel(LLMModelWrapper):
+    """
+    Serves repeated 'chat' calls from a ResponseCache. Calls are keyed on the model name,
+    temperature, seed, tools and messages, so with a fixed seed re-running an experiment
+    doesn't call the LLM again for the turns that didn't change. Cached responses are returned
+    without their usage, as answering them didn't use any tokens or time of the model. Answers
+    the players can't parse aren't cached, so that asking again calls the model again.
+
+    Structured streams are cached once their list of words is complete, even if the guesser
+    closes them right after it, without the rest of the answer: a cached stream yields the words
+    at once, with an empty usage as it is finished. Streams closed before the end of their list
+    (e.g. after a wrong word) aren't cached, as the rest of the words was never generated.
+    """
+
+    def __init__(self, model: LLMModel, cache: ResponseCache):
+        super().__init__(model)
+        self.cache: ResponseCache = cache
+
+    def _key(
+            self,
+            messages: List[Dict[str, str]],
+            response_format: ResponseFormat | None = None,
+            stream: bool = False
+        ) -> str:
+        return self.cache.make_key(
+            self.model_name, self.temperature, self.seed, self.tools, messages, response_format, stream
+        )
+
+    def _get(self, key: str) -> LLMMessage | None:
+        cached = self.cache.get(key)
+        if cached is None:
+            return None
+        return cached.model_copy(update={"usage": None})
+
+    def _set(self, key: str, response: LLMMessage, response_format: ResponseFormat | None = None) -> None:
+        # An answer that doesn't call a tool with its arguments (or whose JSON didn't parse) isn't
+        # cached: with a fixed seed, asking again would only get it back from the cache
+        if response_format is not None or self.tools:
+            tool_call = response.tool_call
+            if (
+                tool_call is None
+                or not isinstance(tool_call.args, dict)
+                or not all(arg in tool_call.args for arg in REQUIRED_ARGS.get(tool_call.tool_name, []))
+            ):
+                return
+        self.cache.set(key, response)
+        return
+
+    def chat(
+            self,
+            messages: List[Dict[str, str]]
+        ) -> LLMMessage:
+        key = self._key(messages)
+        cached = self._get(key)
+        if cached is not None:
+            return cached
+        response = self.model.chat(messages)
+        self._set(key, response)
+        return response
+
+    async def achat(
+            self,
+            messages: List[Dict[str, str]]
+        ) -> LLMMessage:
+        key = self._key(messages)
+        cached = self._get(key)
+        if cached is not None:
+            return cached
+        response = await self.model.achat(messages)
+        self._set(key, response)
+        return response
+
+    def chat_batch(
+            self,
+            batch: List[List[Dict[str, str]]]
+        ) -> List[LLMMessage]:
+        """
+        Answers the cached items of the batch and sends only the others to the wrapped model.
+        """
+        keys = [self._key(messages) for messages in batch]
+        responses: List[LLMMessage | None] = [self._get(key) for key in keys]
+        misses = [i for i, response in enumerate(responses) if response is None]
+        if misses:
+            answers = self.model.chat_batch([batch[i] for i in misses])
+            if len(answers) != len(misses):
+                raise Exception(f"Expected {len(misses)} responses from the batch, got {len(answers)}")
+            for i, answer in zip(misses, answers):
+                self._set(keys[i], answer)
+                responses[i] = answer
+        return responses
+
+    def chat_structured(
+            self,
+            messages: List[Dict[str, str]],
+            response_format: ResponseFormat
+        ) -> LLMMessage:
+        key = self._key(messages, response_format)
+        cached = self._get(key)
+        if cached is not None:
+            return cached
+        response = self.model.chat_structured(messages, response_format)
+        self._set(key, response, response_format)
+        return response
+
+    async def achat_structured(
+            self,
+            messages: List[Dict[str, str]],
+            response_format: ResponseFormat
+        ) -> LLMMessage:
+        key = self._key(messages, response_format)
+        cached = self._get(key)
+        if cached is not None:
+            return cached
+        response = await self.model.achat_structured(messages, response_format)
+        self._set(key, response, response_format)
+        return response
+
+    def _cached_stream(self, key: str) -> LLMMessage | None:
+        cached = self.cache.get(key)
+        if cached is None:
+            return None
+        return cached.model_copy(update={"usage": CallUsage()})
+
+    def _stream_end(self, key: str, parser: WordsStreamParser, finished: bool) -> None:
+        # A stream read to the end is stored whole, and one closed after its list only as the list
+        if finished:
+            content = parser.text
+        elif parser.complete:
+            content = json.dumps({"words": parser.words, "justification": ""})
+        else:
+            return
+        self.cache.set(key, LLMMessage(model_name=self.model_name, content=content, tool_call=None))
+        return
+
+    def stream_structured(
+            self,
+            messages: List[Dict[str, str]],
+            response_format: ResponseFormat
+        ) -> Iterator[LLMMessage]:
+        key = self._key(messages, response_format, stream=True)
+        cached = self._cached_stream(key)
+        if cached is not None:
+            yield cached
+            return
+        parser, finished = WordsStreamParser(), False
+        stream = self.model.stream_structured(messages, response_format)
+        try:
+            for delta in stream:
+                parser.feed(delta.content or "")
+                yield delta
+            finished = True
+        finally:
+            stream.close()
+            self._stream_end(key, parser, finished)
+        return
+
+    async def astream_structured(
+            self,
+            messages: List[Dict[str, str]],
+            response_format: ResponseFormat
+        ) -> AsyncIterator[LLMMessage]:
+        key = self._key(messages, response_format, stream=True)
+        cached = self._cached_stream(key)
+        if cached is not None:
+            yield cached
+            return
+        parser, finished = WordsStreamParser(), False
+        stream = self.model.astream_structured(messages, response_format)
+        try:
+            async for delta in stream:
+                parser.feed(delta.content or "")
+                yield delta
+            finished = True
+        finally:
+            await stream.aclose()
+            self._stream_end(key, parser, finished)
@@ -0,0 +1,313 @@
+from typing import List, Dict, Literal
+import base64
+import zlib
+
+from src.game import Board, SecretCodeGame
+from src.history import GameHistory, HistoryView
+from src.prompts import (
+    captain_round_message,
+    captain_thread_message,
+    guesser_round_message,
+    guesser_thread_message
+)
+from src.schemas import (
+    Results,
+    Round,
+    RoundTeamData,
+    Code,
+    Choice,
+    TeamWords,
+    HistoryEvent,
+    CodeGivenEvent,
+    WordRevealedEvent,
+    PromptRef,
+    CompactResults,
+    CompactRound,
+    CompactRoundTeamData
+)
+
+
+PromptsMode = Literal["refs", "zlib", "drop"]
+
+PROMPT_TEMPLATES: Dict[str, str] = {
+    "captain_round": captain_round_message,
+    "captain_thread": captain_thread_message,
+    "guesser_round": guesser_round_message,
+    "guesser_thread": guesser_thread_message
+}
+
+
+class PromptRenderer:
+    """
+    Renders the prompts received by the players of a game from the events of its history, the
+    same way the players build them (see Captain._build_messages and Guesser._build_messages):
+    the words of the board are the ones left after the events shown, and threaded prompts show
+    the events and the words revealed since the player's previous turn.
+    """
+
+    board: Board
+    events: List[HistoryEvent]
+
+    def __init__(self, board: Board, events: List[HistoryEvent]):
+        self.board: Board = board
+        self.events: List[HistoryEvent] = events
+        self._lines: Dict[HistoryView, List[str]] = {
+            view: [GameHistory.format_event(event, view) for event in events] for view in GameHistory.views
+        }
+        return
+
+    def _left_words(self, end: int) -> Dict[str, List[str]]:
+        revealed = {
+            Board.normalize(event.word) for event in self.events[:end] if isinstance(event, WordRevealedEvent)
+        }
+        left: Dict[str, List[str]] = {"red": [], "blue": [], "neutral": [], "black": [], "left_words": []}
+        for word in self.board.words:
+            if Board.normalize(word) not in revealed:
+                left[self.board.group_of(word)].append(word)
+                left["left_words"].append(word)
+        return left
+
+    @staticmethod
+    def _view_words(role: HistoryView, left: Dict[str, List[str]]) -> List[str]:
+        if role == "captain":
+            return left["red"] + left["blue"] + left["neutral"]
+        return left["left_words"]
+
+    def render(self, ref: PromptRef, team: str, secret_code: tuple[str, int]) -> str:
+        start, end = ref.history
+        role, kind = ref.template.split("_")
+        left = self._left_words(end)
+        template = PROMPT_TEMPLATES[ref.template]
+        if kind == "round":
+            game_history = "\n".join(self._lines[role][:end])
+            if role == "captain":
+                return template.format(
+                    team_color=team,
+                    game_history=game_history,
+                    red_words=left["red"],
+                    blue_words=left["blue"],
+                    neutral_words=left["neutral"],
+                    black_word=self.board.team_words["black"]
+                )
+            return template.format(
+                team_color=team,
+                game_history=game_history,
+                words=left["left_words"],
+                secret_code=secret_code
+            )
+        current_words = set(self._view_words(role, left))
+        revealed_words = [w for w in self._view_words(role, self._left_words(start)) if w not in current_words]
+        game_history = "\n".join(self._lines[role][start:end]).strip("\n")
+        if role == "captain":
+            return template.format(game_history=game_history, revealed_words=revealed_words)
+        return template.format(game_history=game_history, revealed_words=revealed_words, secret_code=secret_code)
+
+
+def _game_events(results: Results) -> List[HistoryEvent] | None:
+    """
+    History events of a game, re-executed from its rounds. None if the game can't be replayed.
+    """
+    try:
+        return SecretCodeGame.replay(results, strict=False).game_history.events
+    except Exception:
+        return None
+
+
+def _turns(results: Results) -> List[tuple[Round, str]]:
+    return [(round_info, color) for round_info in results.rounds_info for color in results.team_order]
+
+
+def _turn_ends(results: Results, events: List[HistoryEvent] | None) -> List[int] | None:
+    """
+    Per team turn, in the order they were played, the number of events before its secret code.
+    """
+    if events is None:
+        return None
+    ends = [i for i, event in enumerate(events) if isinstance(event, CodeGivenEvent)]
+    return ends if len(ends) == len(_turns(results)) else None
+
+
+def encode_prompt(text: str) -> str:
+    return base64.b64encode(zlib.compress(text.encode("utf-8"), 9)).decode("ascii")
+
+
+def decode_prompt(data: str) -> str:
+    return zlib.decompress(base64.b64decode(data)).decode("utf-8")
+
+
+def compact_results(results: Results, prompts: PromptsMode = "refs") -> CompactResults:
+    """
+    This method converts the Results of a game to its compact form.
+
+    Args:
+        results (Results): Results of the game.
+        prompts (PromptsMode): How the prompts are stored: "refs" as the template and the game
+            events each prompt shows, "zlib" as compressed text, or "drop" to leave them out.
+            A prompt that doesn't match any reference (e.g. produced by other templates) is
+            stored as text, so "refs" is always lossless.
+    Return:
+        (CompactResults) The compact results (see 'expand_results').
+    """
+    board = Board.from_team_words(results.words, results.team_order)
+    index = {word: i for i, word in enumerate(board.words)}
+    renderer, ends = None, None
+    if prompts == "refs":
+        events = _game_events(results)
+        ends = _turn_ends(results, events)
+        if ends is not None:
+            renderer = PromptRenderer(board, events)
+    previous_ends: Dict[tuple[str, str], int] = {}
+
+    def compact_prompt(
+            text: str | None,
+            role: str,
+            team: str,
+            end: int | None,
+            secret_code: tuple[str, int]
+        ) -> PromptRef | str | None:
+        if text is None or prompts == "drop":
+            return None
+        if prompts == "zlib":
+            return encode_prompt(text)
+        if renderer is None:
+            return text
+        previous_end = previous_ends.get((team, role))
+        previous_ends[(team, role)] = end
+        candidates = [PromptRef(template=f"{role}_round", history=[0, end])]
+        if previous_end is not None:
+            candidates.append(PromptRef(template=f"{role}_thread", history=[previous_end, end]))
+        for ref in candidates:
+            if renderer.render(ref, team, secret_code) == text:
+                return ref
+        return text
+
+    rounds: Dict[int, Dict[str, CompactRoundTeamData]] = {}
+    for turn, (round_info, color) in enumerate(_turns(results)):
+        data: RoundTeamData = getattr(round_info, f"{color}_team")
+        secret_code = (data.secret_code.word, data.secret_code.number)
+        end = ends[turn] if ends is not None else None
+        rounds.setdefault(turn // 2, {})[color] = CompactRoundTeamData(
+            code_word = data.secret_code.word,
+            code_number = data.secret_code.number,
+            code_justification = data.secret_code.justification,
+            words_related = [index.get(w, w) for w in data.secret_code.words_related],
+            guesses = [index.get(w, w) for w in data.guesser_choice.words],
+            guess_justification = data.guesser_choice.justification,
+            captain_prompt = compact_prompt(data.captain_prompt, "captain", color, end, secret_code),
+            # The guesser receives the same history as its captain, without the secret code
+            guesser_prompt = compact_prompt(data.guesser_prompt, "guesser", color, end, secret_code),
+            captain_usage = data.captain_usage,
+            guesser_usage = data.guesser_usage,
+            guesser_output = data.guesser_output,
+            guesser_stopped_early = data.guesser_stopped_early,
+            captain_samples = data.captain_samples,
+            guesser_samples = data.guesser_samples,
+            captain_agreement = data.captain_agreement,
+            guesser_agreement = data.guesser_agreement
+        )
+    return CompactResults(
+        board = board.words,
+        layout = list(board.layout),
+        team_order = list(results.team_order),
+        teams = results.teams,
+        num_rounds = results.num_rounds,
+        rounds = [
+            CompactRound(
+                round = round_info.round,
+                blue_team = rounds[i]["blue"],
+                red_team = rounds[i]["red"]
+            )
+            for i, round_info in enumerate(results.rounds_info)
+        ],
+        winner_team = results.winner_team,
+        prompts = prompts
+    )
+
+
+def expand_results(compact: CompactResults) -> Results:
+    """
+    Rebuilds the full Results of a game from its compact form, rendering the prompts stored as
+    references.
+    """
+    first_size, second_size, neutral_size = compact.layout
+    first_words = compact.board[:first_size]
+    second_words = compact.board[first_size:first_size + second_size]
+    first_color = compact.team_order[0]
+    words = TeamWords(
+        red = first_words if first_color == "red" else second_words,
+        blue = first_words if first_color == "blue" else second_words,
+        neutral = compact.board[first_size + second_size:first_size + second_size + neutral_size],
+        black = compact.board[-1]
+    )
+
+    def word(value: int | str) -> str:
+        return compact.board[value] if isinstance(value, int) else value
+
+    def prompt_text(prompt: PromptRef | str | None) -> str | None:
+        # References are rendered once the whole game is rebuilt
+        if not isinstance(prompt, str):
+            return None
+        return decode_prompt(prompt) if compact.prompts == "zlib" else prompt
+
+    def expand_turn(data: CompactRoundTeamData) -> RoundTeamData:
+        return RoundTeamData(
+            secret_code = Code(
+                word = data.code_word,
+                number = data.code_number,
+                justification = data.code_justification,
+                words_related = [word(w) for w in data.words_related]
+            ),
+            guesser_choice = Choice(
+                words = [word(w) for w in data.guesses],
+                justification = data.guess_justification
+            ),
+            captain_prompt = prompt_text(data.captain_prompt),
+            guesser_prompt = prompt_text(data.guesser_prompt),
+            captain_usage = data.captain_usage,
+            guesser_usage = data.guesser_usage,
+            guesser_output = data.guesser_output,
+            guesser_stopped_early = data.guesser_stopped_early,
+            captain_samples = data.captain_samples,
+            guesser_samples = data.guesser_samples,
+            captain_agreement = data.captain_agreement,
+            guesser_agreement = data.guesser_agreement
+        )
+
+    results = Results(
+        words = words,
+        team_order = list(compact.team_order),
+        teams = compact.teams,
+        num_rounds = compact.num_rounds,
+        rounds_info = [
+            Round(
+                round = round_info.round,
+                blue_team = expand_turn(round_info.blue_team),
+                red_team = expand_turn(round_info.red_team)
+            )
+            for round_info in compact.rounds
+        ],
+        winner_team = compact.winner_team
+    )
+    # The references are rendered from the events of the re-executed game
+    renderer = None
+    compact_turns = [
+        getattr(round_info, f"{color}_team") for round_info in compact.rounds for color in compact.team_order
+    ]
+    for (round_info, color), compact_data in zip(_turns(results), compact_turns):
+        data = getattr(round_info, f"{color}_team")
+        secret_code = (data.secret_code.word, data.secret_code.number)
+        for role in ["captain", "guesser"]:
+            ref = getattr(compact_data, f"{role}_prompt")
+            if not isinstance(ref, PromptRef):
+                continue
+            if renderer is None:
+                events = _game_events(results)
+                if _turn_ends(results, events) is None:
+                    raise Exception("The game can't be re-executed to render its prompts")
+                renderer = PromptRenderer(Board.from_team_words(words, compact.team_order), events)
+            setattr(data, f"{role}_prompt", renderer.render(ref, color, secret_code))
+    return results
+
+
+def read_compact_results(line: str) -> Results:
+    return expand_results(CompactResults.model_validate_json(line))
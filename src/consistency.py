@@ -0,0 +1,128 @@
+from typing import List, Dict, Literal, Tuple
+
+from src.rules import normalize
+from src.schemas import Code, Choice, CallUsage, PlayerData
+
+# Self-consistency: a player can answer each turn with several samples of its model, sent at the
+# same time with a different seed each, and the turn is played with their aggregate (see
+# Player.sample_models). Every sample is recorded with the turn, and the share of samples that
+# agree with the aggregate measures how sure the player was.
+
+
+Aggregation = Literal["majority", "borda"]
+
+
+def sample_players(player: PlayerData, samples: int) -> List[PlayerData]:
+    """
+    Specs of the models of each sample of a player. Sample i uses the seed of the player plus i,
+    so that every sample has its own seed, and so its own cache entries. The first sample of an
+    unseeded player stays unseeded, and its other samples use seed i.
+    """
+    return [
+        player if i == 0 else player.model_copy(update={"seed": (player.seed or 0) + i})
+        for i in range(samples)
+    ]
+
+
+def aggregate_codes(codes: List[Code]) -> Tuple[Code, float]:
+    """
+    This method chooses the secret code of a turn by majority vote: the most given code word,
+    with the number most given with it. Ties go to the earliest sample.
+
+    Args:
+        codes (List[Code]): Secret codes of the samples.
+    Return:
+        (Tuple[Code, float]) The first sample with the chosen word and number, and the share of
+        samples that gave that word.
+    """
+    votes: Dict[str, int] = {}
+    for code in codes:
+        word = normalize(code.word)
+        votes[word] = votes.get(word, 0) + 1
+    word = max(votes, key=votes.get)
+    voters = [code for code in codes if normalize(code.word) == word]
+    numbers = [code.number for code in voters]
+    number = max(dict.fromkeys(numbers), key=numbers.count)
+    code = next(code for code in voters if code.number == number)
+    return code, len(voters) / len(codes)
+
+
+def borda_scores(choices: List[Choice]) -> Dict[str, int]:
+    """
+    Borda count of the words of several choices: in a choice of the longest length L, the word
+    said first gets L points, the next one L - 1, and so on. Words are normalized, and kept in
+    the order they first appear.
+    """
+    depth = max(len(choice.words) for choice in choices)
+    scores: Dict[str, int] = {}
+    for choice in choices:
+        seen = set()
+        for position, word in enumerate(choice.words):
+            word = normalize(word)
+            if word not in seen:
+                seen.add(word)
+                scores[word] = scores.get(word, 0) + depth - position
+    return scores
+
+
+def aggregate_choices(choices: List[Choice], aggregation: Aggregation = "borda") -> Tuple[Choice, float]:
+    """
+    This method chooses the words said by a guesser from the choices of its samples, ordered by
+    their Borda count (see 'borda_scores'). With "borda" the guesser says as many words as the
+    median sample (the lower one for an even number of samples), and with "majority" only the
+    words said by more than half of the samples, or the best ranked word if there is none.
+
+    Args:
+        choices (List[Choice]): Choices of the samples.
+        aggregation (Aggregation): How the words are chosen, "borda" or "majority".
+    Return:
+        (Tuple[Choice, float]) The choice, with the justification of the first sample that starts
+        with the same word, and the share of samples that start with that word.
+    """
+    scores = borda_scores(choices)
+    spellings: Dict[str, str] = {}
+    for choice in choices:
+        for word in choice.words:
+            spellings.setdefault(normalize(word), word)
+    # sorted is stable, so ties go to the word that appeared first
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    if aggregation == "majority":
+        counts = {word: sum(word in map(normalize, choice.words) for choice in choices) for word in ranked}
+        words = [word for word in ranked if 2 * counts[word] > len(choices)] or ranked[:1]
+    else:
+        lengths = sorted(len(choice.words) for choice in choices)
+        words = ranked[:lengths[(len(lengths) - 1) // 2]]
+
+    def first_word(choice: Choice) -> str | None:
+        return normalize(choice.words[0]) if choice.words else None
+    first = words[0] if words else None
+    agreeing = [choice for choice in choices if first_word(choice) == first]
+    choice = Choice(
+        words=[spellings[word] for word in words],
+        justification=agreeing[0].justification if agreeing else ""
+    )
+    return choice, len(agreeing) / len(choices)
+
+
+def merge_usage(usages: List[CallUsage | None]) -> CallUsage | None:
+    """
+    Usage of the samples of a turn: the tokens and durations reported by the server are added
+    up, and the latency is the one of the slowest sample, as they are sent at the same time.
+    """
+    usages = [usage for usage in usages if usage is not None]
+    if not usages:
+        return None
+
+    def total(field: str) -> int | float | None:
+        values = [getattr(usage, field) for usage in usages if getattr(usage, field) is not None]
+        return sum(values) if values else None
+    latencies = [usage.latency for usage in usages if usage.latency is not None]
+    return CallUsage(
+        prompt_tokens = total("prompt_tokens"),
+        completion_tokens = total("completion_tokens"),
+        load_duration = total("load_duration"),
+        prompt_eval_duration = total("prompt_eval_duration"),
+        eval_duration = total("eval_duration"),
+        total_duration = total("total_duration"),
+        latency = max(latencies) if latencies else None
+    )
@@ -0,0 +1,461 @@
+from typing import List, Dict, Any, Iterable, Literal
+import argparse
+import json
+import os
+
+import numpy as np
+
+from src.embeddings import Encoder
+from src.game import Board
+from src.schemas import TeamWords
+from src.words import WORDS
+
+
+TEAM_COLORS: List[Literal["red", "blue"]] = ["red", "blue"]
+
+
+class WordCorpus:
+    """
+    Word list stored as flat arrays: the UTF-8 bytes of all the words, their offsets, and the id
+    of the category and language of each word (-1 if unknown). A saved corpus is a directory
+    whose arrays are memory-mapped when loaded, so corpora of tens of thousands of words open
+    instantly and are shared by every worker process through the page cache. Normalized word
+    embeddings can be stored along with the words to score boards (see BoardPool).
+    """
+
+    categories: List[str]
+    languages: List[str]
+
+    def __init__(
+            self,
+            data: np.ndarray,
+            offsets: np.ndarray,
+            category_ids: np.ndarray,
+            language_ids: np.ndarray,
+            categories: List[str],
+            languages: List[str],
+            vectors: np.ndarray | None = None
+        ):
+        self._data: np.ndarray = data
+        self._offsets: np.ndarray = offsets
+        self.category_ids: np.ndarray = category_ids
+        self.language_ids: np.ndarray = language_ids
+        self.categories: List[str] = categories
+        self.languages: List[str] = languages
+        self.vectors: np.ndarray | None = vectors
+        self._index: Dict[str, int] | None = None
+        return
+
+    @classmethod
+    def from_words(
+            cls,
+            words: Iterable[str],
+            categories: Iterable[str | None] | None = None,
+            languages: Iterable[str | None] | None = None,
+            vectors: np.ndarray | None = None
+        ) -> "WordCorpus":
+        """
+        Builds a corpus from a word list. Words are normalized (see Board.normalize) and repeated
+        words are dropped, keeping the tags and vector of their first occurrence, so that no
+        board can have the same word twice.
+        """
+        first: Dict[str, int] = {}
+        for i, word in enumerate(words):
+            first.setdefault(Board.normalize(word), i)
+        keep = list(first.values())
+        words = list(first)
+        if categories is not None:
+            categories = list(categories)
+            categories = [categories[i] for i in keep]
+        if languages is not None:
+            languages = list(languages)
+            languages = [languages[i] for i in keep]
+        if vectors is not None:
+            vectors = vectors[keep]
+        encoded = [w.encode("utf-8") for w in words]
+        offsets = np.zeros(len(words) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(e) for e in encoded])
+        data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+        def tag_ids(tags: Iterable[str | None] | None) -> tuple[np.ndarray, List[str]]:
+            names: Dict[str, int] = {}
+            if tags is None:
+                return np.full(len(words), -1, dtype=np.int16), []
+            ids = [-1 if tag is None else names.setdefault(tag, len(names)) for tag in tags]
+            return np.asarray(ids, dtype=np.int16), list(names)
+
+        category_ids, category_names = tag_ids(categories)
+        language_ids, language_names = tag_ids(languages)
+        return cls(data, offsets, category_ids, language_ids, category_names, language_names, vectors)
+
+    @classmethod
+    def from_text(cls, path: str) -> "WordCorpus":
+        """
+        Reads a text file with one 'word[<TAB>category[<TAB>language]]' per line.
+        """
+        words, categories, languages = [], [], []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                if not fields[0].strip():
+                    continue
+                words.append(fields[0])
+                categories.append(fields[1] if len(fields) > 1 and fields[1] else None)
+                languages.append(fields[2] if len(fields) > 2 and fields[2] else None)
+        return cls.from_words(words, categories, languages)
+
+    @classmethod
+    def default(cls) -> "WordCorpus":
+        return cls.from_words(WORDS)
+
+    @classmethod
+    def load(cls, directory: str) -> "WordCorpus":
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        vectors_path = os.path.join(directory, "vectors.npy")
+        return cls(
+            data=np.memmap(os.path.join(directory, "words.bin"), dtype=np.uint8, mode="r")
+            if meta["bytes"] > 0 else np.zeros(0, dtype=np.uint8),
+            offsets=np.load(os.path.join(directory, "offsets.npy"), mmap_mode="r"),
+            category_ids=np.load(os.path.join(directory, "categories.npy"), mmap_mode="r"),
+            language_ids=np.load(os.path.join(directory, "languages.npy"), mmap_mode="r"),
+            categories=meta["categories"],
+            languages=meta["languages"],
+            vectors=np.load(vectors_path, mmap_mode="r") if os.path.exists(vectors_path) else None
+        )
+
+    def save(self, directory: str) -> None:
+        os.makedirs(directory, exist_ok=True)
+        np.asarray(self._data, dtype=np.uint8).tofile(os.path.join(directory, "words.bin"))
+        np.save(os.path.join(directory, "offsets.npy"), np.asarray(self._offsets))
+        np.save(os.path.join(directory, "categories.npy"), np.asarray(self.category_ids))
+        np.save(os.path.join(directory, "languages.npy"), np.asarray(self.language_ids))
+        if self.vectors is not None:
+            np.save(os.path.join(directory, "vectors.npy"), np.asarray(self.vectors))
+        with open(os.path.join(directory, "meta.json"), "w") as f:
+            json.dump(
+                {"bytes": int(self._offsets[-1]), "categories": self.categories, "languages": self.languages},
+                f
+            )
+        return
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return bytes(self._data[self._offsets[i]:self._offsets[i + 1]]).decode("utf-8")
+
+    def words(self, indices: Iterable[int] | None = None) -> List[str]:
+        if indices is None:
+            indices = range(len(self))
+        return [self[int(i)] for i in indices]
+
+    def index(self, word: str) -> int:
+        if self._index is None:
+            self._index = {w: i for i, w in enumerate(self.words())}
+        return self._index[word.strip().lower()]
+
+    def select(self, category: str | None = None, language: str | None = None) -> np.ndarray:
+        """
+        Returns the indices of the words of a category and/or language.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if category is not None:
+            mask &= np.asarray(self.category_ids) == self.categories.index(category)
+        if language is not None:
+            mask &= np.asarray(self.language_ids) == self.languages.index(language)
+        return np.flatnonzero(mask)
+
+    def embed(self, encoder: Encoder, batch_size: int = 1024) -> None:
+        """
+        Computes the normalized embedding of every word (e.g. with 'embeddings.fastembed_encoder').
+        """
+        batches = []
+        for start in range(0, len(self), batch_size):
+            words = self.words(range(start, min(start + batch_size, len(self))))
+            vectors = np.asarray(encoder(words), dtype=np.float32)
+            batches.append(vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12))
+        self.vectors = np.concatenate(batches) if batches else np.zeros((0, 0), dtype=np.float32)
+        return
+
+
+def sample_without_replacement(
+        rng: np.random.Generator,
+        population: int,
+        n_rows: int,
+        size: int
+    ) -> np.ndarray:
+    """
+    Draws 'n_rows' rows of 'size' distinct integers below 'population' at once.
+    """
+    if population <= 64 * size:
+        # Small populations: the first 'size' positions of random permutations
+        return np.argpartition(rng.random((n_rows, population)), size - 1, axis=1)[:, :size]
+    # Large populations: rows with repeated values, which are rare, are drawn again
+    rows = rng.integers(0, population, size=(n_rows, size))
+    while True:
+        sorted_rows = np.sort(rows, axis=1)
+        repeated = (sorted_rows[:, 1:] == sorted_rows[:, :-1]).any(axis=1)
+        if not repeated.any():
+            return rows
+        rows[repeated] = rng.integers(0, population, size=(int(repeated.sum()), size))
+
+
+def score_boards(
+        vectors: np.ndarray,
+        boards: np.ndarray,
+        layout: tuple[int, int, int],
+        black_weight: float = 2.0,
+        chunk_size: int = 1024
+    ) -> np.ndarray:
+    """
+    Difficulty of boards of word indices (in Board order: first team, second team, neutral and
+    black words) from the cosine similarity of their words. For each team it adds how close its
+    words are to the other words of the board (the most similar one of each word, on average) and
+    to the black word (the closest of its words, weighted by 'black_weight'), and subtracts how
+    close its words are to each other. The difficulty of a board is the mean of both teams'.
+    """
+    first_size, second_size, neutral_size = layout
+    size = first_size + second_size + neutral_size + 1
+    team_slices = [slice(0, first_size), slice(first_size, first_size + second_size)]
+    difficulty = np.zeros(len(boards), dtype=np.float32)
+    for start in range(0, len(boards), chunk_size):
+        embeddings = np.asarray(vectors[boards[start:start + chunk_size]], dtype=np.float32)
+        similarity = embeddings @ embeddings.transpose(0, 2, 1)
+        scores = np.zeros(len(embeddings), dtype=np.float32)
+        for team in team_slices:
+            n = team.stop - team.start
+            own = similarity[:, team, team]
+            cohesion = (own.sum(axis=(1, 2)) - np.trace(own, axis1=1, axis2=2)) / max(n * (n - 1), 1)
+            others = np.ones(size - 1, dtype=bool)
+            others[team] = False
+            confusion = similarity[:, team, :size - 1][:, :, others].max(axis=2).mean(axis=1)
+            black = similarity[:, team, size - 1].max(axis=1)
+            scores += confusion + black_weight * black - cohesion
+        difficulty[start:start + chunk_size] = scores / len(team_slices)
+    return difficulty
+
+
+class BoardPool:
+    """
+    Precomputed boards stored as a matrix of word ids (one row per board, in Board order), the
+    first team of each board and its difficulty. The pool keeps the words it uses, so its file
+    (a compressed .npz) is self-contained. Boards are drawn from the pool by index, so large
+    experiments sample reproducible boards, stratified by difficulty, with no setup cost.
+    """
+
+    vocabulary: List[str]
+    boards: np.ndarray
+    first_team: np.ndarray
+    difficulty: np.ndarray
+    layout: tuple[int, int, int]
+
+    def __init__(
+            self,
+            vocabulary: List[str],
+            boards: np.ndarray,
+            first_team: np.ndarray,
+            difficulty: np.ndarray,
+            layout: tuple[int, int, int] = (9, 8, 7)
+        ):
+        self.vocabulary: List[str] = vocabulary
+        self.boards: np.ndarray = boards
+        self.first_team: np.ndarray = first_team
+        self.difficulty: np.ndarray = difficulty
+        self.layout: tuple[int, int, int] = tuple(layout)
+        self._check_boards()
+        return
+
+    def _check_boards(self) -> None:
+        # A board with the same word twice can't be played (e.g. a pool of a corpus with duplicates)
+        if len(self.boards) == 0:
+            return
+        _, word_ids = np.unique([Board.normalize(w) for w in self.vocabulary], return_inverse=True)
+        rows = np.sort(word_ids.reshape(-1)[self.boards], axis=1)
+        repeated = int((rows[:, 1:] == rows[:, :-1]).any(axis=1).sum())
+        if repeated > 0:
+            raise ValueError(f"{repeated} boards of the pool have a repeated word")
+        return
+
+    @classmethod
+    def generate(
+            cls,
+            corpus: WordCorpus,
+            n_boards: int,
+            seed: int | None = None,
+            layout: tuple[int, int, int] = (9, 8, 7),
+            candidates: np.ndarray | None = None,
+            black_weight: float = 2.0
+        ) -> "BoardPool":
+        """
+        This method generates a pool of boards.
+
+        Args:
+            corpus (WordCorpus): Corpus the words are drawn from.
+            n_boards (int): Number of boards.
+            seed (int | None): Seed of the generator, the same seed gives the same pool.
+            layout (tuple[int, int, int]): Words of the first team, the second team and the
+                neutral group. Every board also has one black word.
+            candidates (np.ndarray | None): Indices of the corpus words that can be used (see
+                'WordCorpus.select'). All the words by default.
+            black_weight (float): Weight of the black word in the difficulty (see 'score_boards').
+        Return:
+            (BoardPool) The pool, scored if the corpus has embeddings (otherwise every board has
+            difficulty 0).
+        """
+        rng = np.random.default_rng(seed)
+        candidates = np.arange(len(corpus)) if candidates is None else np.asarray(candidates)
+        size = sum(layout) + 1
+        if len(candidates) < size:
+            raise ValueError(f"At least {size} words are needed, the corpus has {len(candidates)}")
+        boards = candidates[sample_without_replacement(rng, len(candidates), n_boards, size)]
+        first_team = rng.integers(0, 2, size=n_boards, dtype=np.uint8)
+        if corpus.vectors is not None:
+            difficulty = score_boards(corpus.vectors, boards, layout, black_weight)
+        else:
+            difficulty = np.zeros(n_boards, dtype=np.float32)
+
+        # Only the words used by the pool are kept, with ids local to the pool
+        used, local_ids = np.unique(boards, return_inverse=True)
+        return cls(
+            vocabulary=corpus.words(used),
+            boards=local_ids.reshape(boards.shape).astype(np.int32),
+            first_team=first_team,
+            difficulty=difficulty,
+            layout=layout
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "BoardPool":
+        with np.load(path) as data:
+            return cls(
+                vocabulary=data["vocabulary"].tolist(),
+                boards=data["boards"],
+                first_team=data["first_team"],
+                difficulty=data["difficulty"],
+                layout=tuple(int(n) for n in data["layout"])
+            )
+
+    def save(self, path: str) -> None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "wb") as f:
+            np.savez_compressed(
+                f,
+                vocabulary=np.asarray(self.vocabulary),
+                boards=self.boards,
+                first_team=self.first_team,
+                difficulty=self.difficulty,
+                layout=np.asarray(self.layout)
+            )
+        return
+
+    def __len__(self) -> int:
+        return len(self.boards)
+
+    def team_words(self, i: int) -> tuple[TeamWords, List[Literal["red", "blue"]]]:
+        first_size, second_size, _ = self.layout
+        words = [self.vocabulary[w] for w in self.boards[i]]
+        first_color = TEAM_COLORS[int(self.first_team[i])]
+        second_color = TEAM_COLORS[1 - int(self.first_team[i])]
+        first_words = words[:first_size]
+        second_words = words[first_size:first_size + second_size]
+        team_words = TeamWords(
+            red = first_words if first_color == "red" else second_words,
+            blue = first_words if first_color == "blue" else second_words,
+            neutral = words[first_size + second_size:-1],
+            black = words[-1]
+        )
+        return team_words, [first_color, second_color]
+
+    def board(self, i: int) -> Board:
+        return Board.from_team_words(*self.team_words(i))
+
+    def sample(
+            self,
+            n: int,
+            seed: int | None = None,
+            strata: int = 1,
+            min_difficulty: float | None = None,
+            max_difficulty: float | None = None
+        ) -> np.ndarray:
+        """
+        This method draws boards from the pool without replacement.
+
+        Args:
+            n (int): Number of boards.
+            seed (int | None): Seed of the draw.
+            strata (int): Number of difficulty quantiles the boards are drawn evenly from.
+            min_difficulty (float | None): Minimum difficulty of the boards.
+            max_difficulty (float | None): Maximum difficulty of the boards.
+        Return:
+            (np.ndarray) Indices of the boards, from the easiest stratum to the hardest.
+        """
+        if strata < 1:
+            raise ValueError(f"The number of strata must be at least 1, got {strata}")
+        rng = np.random.default_rng(seed)
+        mask = np.ones(len(self), dtype=bool)
+        if min_difficulty is not None:
+            mask &= self.difficulty >= min_difficulty
+        if max_difficulty is not None:
+            mask &= self.difficulty <= max_difficulty
+        eligible = np.flatnonzero(mask)
+        if n > len(eligible):
+            raise ValueError(f"Only {len(eligible)} boards of the pool match, {n} were requested")
+        ordered = eligible[np.argsort(self.difficulty[eligible], kind="stable")]
+        bins = np.array_split(ordered, strata)
+        counts = np.full(strata, n // strata)
+        counts[:n % strata] += 1
+        return np.concatenate([
+            rng.choice(bin_boards, count, replace=False) for bin_boards, count in zip(bins, counts)
+        ]).astype(np.int64)
+
+    def summary(self) -> Dict[str, Any]:
+        quantiles = np.quantile(self.difficulty, [0.0, 0.25, 0.5, 0.75, 1.0]) if len(self) > 0 else []
+        return {
+            "boards": len(self),
+            "words": len(self.vocabulary),
+            "layout": list(self.layout),
+            "difficulty_quantiles": [round(float(q), 4) for q in quantiles]
+        }
+
+
+def main(argv: List[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Build word corpora and pools of boards")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("corpus", help="Build a corpus from a 'word[<TAB>category[<TAB>language]]' file.")
+    build.add_argument("input")
+    build.add_argument("output", help="Corpus directory.")
+    build.add_argument("--embed", default=None, help="fastembed model used to store word embeddings.")
+    pool = commands.add_parser("pool", help="Generate a pool of scored boards.")
+    pool.add_argument("corpus", help="Corpus directory, or 'default' for the built-in words.")
+    pool.add_argument("output", help="Pool .npz file.")
+    pool.add_argument("--boards", type=int, default=10_000)
+    pool.add_argument("--seed", type=int, default=0)
+    pool.add_argument("--category", default=None)
+    pool.add_argument("--language", default=None)
+    info = commands.add_parser("info", help="Summarize a pool of boards.")
+    info.add_argument("pool")
+    args = parser.parse_args(argv)
+
+    if args.command == "corpus":
+        corpus = WordCorpus.from_text(args.input)
+        if args.embed:
+            from src.embeddings import fastembed_encoder
+            corpus.embed(fastembed_encoder(args.embed))
+        corpus.save(args.output)
+        print(f"{len(corpus)} words written to {args.output}")
+    elif args.command == "pool":
+        corpus = WordCorpus.default() if args.corpus == "default" else WordCorpus.load(args.corpus)
+        candidates = corpus.select(args.category, args.language)
+        board_pool = BoardPool.generate(corpus, args.boards, seed=args.seed, candidates=candidates)
+        board_pool.save(args.output)
+        print(json.dumps(board_pool.summary()))
+    else:
+        print(json.dumps(BoardPool.load(args.pool).summary(), indent=2))
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+from typing import List, Dict, Callable, Any
+import json
+import os
+
+import numpy as np
+
+from src.game import Captain, Guesser
+from src.schemas import Code, Choice, PlayerData, EMBEDDING_PREFIX
+from src.words import WORDS
+
+
+Encoder = Callable[[List[str]], np.ndarray]
+
+
+def fastembed_encoder(model_name: str = "BAAI/bge-small-en-v1.5", **kwargs: Any) -> Encoder:
+    """
+    Returns an encoder based on 'fastembed.TextEmbedding'.
+    """
+    from fastembed import TextEmbedding
+
+    model = TextEmbedding(model_name=model_name, **kwargs)
+
+    def encode(words: List[str]) -> np.ndarray:
+        return np.asarray(list(model.embed(words)), dtype=np.float32)
+    return encode
+
+
+class EmbeddingCache:
+    """
+    On-disk cache of normalized word embeddings. Vectors are appended to a raw float32 file that
+    is read through a memory map, and a JSON file keeps the row of each word, so every word is
+    only encoded once across games and processes. Only one process should add words at a time.
+    """
+
+    path: str
+    encoder: Encoder
+    dim: int | None
+
+    def __init__(self, path: str, encoder: Encoder):
+        self.path: str = path
+        self.encoder: Encoder = encoder
+        self._vectors_path: str = f"{path}.f32"
+        self._index_path: str = f"{path}.index.json"
+        self._index: Dict[str, int] = {}
+        self.dim: int | None = None
+        self._matrix: np.ndarray | None = None
+        if os.path.exists(self._index_path):
+            with open(self._index_path) as f:
+                data = json.load(f)
+            self._index = {word: row for row, word in enumerate(data["words"])}
+            self.dim = data["dim"]
+        return
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, word: str) -> bool:
+        return word.lower() in self._index
+
+    @property
+    def matrix(self) -> np.ndarray:
+        if self._matrix is None or self._matrix.shape[0] != len(self._index):
+            self._matrix = np.memmap(
+                self._vectors_path, dtype=np.float32, mode="r", shape=(len(self._index), self.dim)
+            )
+        return self._matrix
+
+    def _add(self, words: List[str]) -> None:
+        vectors = np.asarray(self.encoder(words), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.maximum(norms, 1e-12)
+        self.dim = vectors.shape[1]
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self._vectors_path, "ab") as f:
+            f.write(vectors.tobytes())
+        for word in words:
+            self._index[word] = len(self._index)
+        with open(self._index_path, "w") as f:
+            json.dump({"dim": self.dim, "words": list(self._index)}, f)
+        self._matrix = None
+        return
+
+    def get(self, words: List[str]) -> np.ndarray:
+        """
+        Returns the (len(words), dim) matrix of normalized embeddings, encoding the missing words.
+        """
+        words = [w.lower() for w in words]
+        missing = list(dict.fromkeys(w for w in words if w not in self._index))
+        if missing:
+            self._add(missing)
+        return np.asarray(self.matrix[[self._index[w] for w in words]])
+
+
+class EmbeddingModel:
+    """
+    Model of the embedding baseline players (EmbeddingCaptain, EmbeddingGuesser). It isn't an
+    LLMModel, as they don't chat: they rank words with the cosine similarity of their embeddings.
+    It only has the model name, temperature, tools and seed that players read from their model.
+    """
+
+    model_name: str
+    temperature: float
+    tools: List
+    seed: int | None
+    cache: EmbeddingCache
+    vocabulary: List[str]
+
+    def __init__(
+            self,
+            model_name: str,
+            cache: EmbeddingCache,
+            vocabulary: List[str] = [],
+            temperature: float = 0.0,
+            tools: List = [],
+            seed: int | None = None
+        ):
+        self.model_name: str = model_name
+        self.temperature: float = temperature
+        self.tools: List = tools
+        self.seed: int | None = seed
+        self.cache: EmbeddingCache = cache
+        self.vocabulary: List[str] = [w.lower() for w in vocabulary]
+        # Clue candidates are embedded once, when the model is created
+        self.vocabulary_matrix: np.ndarray = (
+            cache.get(self.vocabulary) if self.vocabulary else np.zeros((0, 0), dtype=np.float32)
+        )
+        return
+
+
+class EmbeddingCaptain(Captain):
+    """
+    Captain that gives as secret code the word of the model's vocabulary that is closest to
+    the largest number of its team's words while staying further from the rest of the board.
+    """
+
+    model: EmbeddingModel
+
+    def __init__(
+            self,
+            name: str,
+            model: EmbeddingModel,
+            max_number: int = 3,
+            margin: float = 0.02,
+            black_penalty: float = 0.05,
+            **kwargs: Any
+        ) -> None:
+        super().__init__(name, model, **kwargs)
+        self.max_number: int = max_number
+        self.margin: float = margin
+        self.black_penalty: float = black_penalty
+
+    @staticmethod
+    def _is_valid_clue(clue: str, board_words: List[str]) -> bool:
+        # Same rules as for the LLMs: not a board word and not sharing its root
+        return all(clue not in word and word not in clue for word in board_words)
+
+    def choose_code(
+            self,
+            own_words: List[str],
+            other_words: List[str],
+            black_word: str
+        ) -> Code:
+        if not self.model.vocabulary:
+            raise ValueError(f"Embedding captain '{self.name}' has no vocabulary to choose its clues from")
+        board_words = [w.lower() for w in own_words + other_words + [black_word]]
+        similarities = self.model.vocabulary_matrix @ self.model.cache.get(board_words).T
+        n_own = len(own_words)
+        own = -np.sort(-similarities[:, :n_own], axis=1)
+        threshold = similarities[:, n_own:].max(axis=1) + self.margin
+        threshold = np.maximum(threshold, similarities[:, -1] + self.black_penalty)
+        numbers = np.minimum((own > threshold[:, None]).sum(axis=1), self.max_number)
+        # A team without words left (its game is won, the round is finishing) gets the clue
+        # furthest from the rest of the board
+        scores = numbers + ((own[:, 0] if n_own > 0 else 0.0) - threshold)
+
+        for clue_index in np.argsort(-scores):
+            clue = self.model.vocabulary[clue_index]
+            if self._is_valid_clue(clue, board_words):
+                break
+        else:
+            raise ValueError(f"No word of the vocabulary of '{self.name}' is a valid clue for this board")
+        number = max(int(numbers[clue_index]), 1)
+        related_index = np.argsort(-similarities[clue_index, :n_own])[:number]
+        return Code(
+            word=clue,
+            number=number,
+            justification="",
+            words_related=[own_words[i] for i in related_index]
+        )
+
+    def say_secret_code(
+            self,
+            game_history,
+            red_words,
+            blue_words,
+            neutral_words,
+            black_word
+        ) -> tuple[Code, str]:
+        own_words, opponent_words = (red_words, blue_words) if self.team == "red" else (blue_words, red_words)
+        code = self.choose_code(list(own_words), list(opponent_words) + list(neutral_words), black_word)
+        return code, ""
+
+    async def asay_secret_code(
+            self,
+            game_history,
+            red_words,
+            blue_words,
+            neutral_words,
+            black_word
+        ) -> tuple[Code, str]:
+        return self.say_secret_code(game_history, red_words, blue_words, neutral_words, black_word)
+
+
+class EmbeddingGuesser(Guesser):
+    """
+    Guesser that chooses the board words closest to the secret code, most similar first.
+    """
+
+    model: EmbeddingModel
+
+    def rank_words(self, words: List[str], secret_word: str) -> List[str]:
+        similarities = self.model.cache.get(list(words)) @ self.model.cache.get([secret_word])[0]
+        return [words[i] for i in np.argsort(-similarities)]
+
+    def choose_words(self, game_history, words, secret_code: tuple) -> tuple[Choice, str]:
+        secret_word, number = secret_code
+        chosen_words = self.rank_words(list(words), secret_word)[:max(int(number), 1)]
+        return Choice(words=chosen_words, justification=""), ""
+
+    async def achoose_words(self, game_history, words, secret_code: tuple) -> tuple[Choice, str]:
+        return self.choose_words(game_history, words, secret_code)
+
+
+# Directory of the EmbeddingCache of each model used by embedding players
+EMBEDDINGS_DIR = os.path.join(".cache", "embeddings")
+
+_embedding_caches: Dict[str, EmbeddingCache] = {}
+
+
+def get_embedding_model(player: PlayerData) -> EmbeddingModel:
+    """
+    This method returns the model of an embedding player, whose model name is EMBEDDING_PREFIX
+    followed by a fastembed model. Its clues are chosen from the game's word list, and the
+    vectors are cached in EMBEDDINGS_DIR, one cache per fastembed model and process.
+
+    Args:
+        player (PlayerData): Spec of the player.
+    Return:
+        (EmbeddingModel) The model.
+    """
+    encoder_name = player.model_name[len(EMBEDDING_PREFIX):]
+    if encoder_name not in _embedding_caches:
+        path = os.path.join(EMBEDDINGS_DIR, encoder_name.replace("/", "--"))
+        # The encoder is only loaded if a word is missing from the cache
+        encoder = None
+
+        def encode(words: List[str]) -> np.ndarray:
+            nonlocal encoder
+            if encoder is None:
+                encoder = fastembed_encoder(encoder_name)
+            return encoder(words)
+        _embedding_caches[encoder_name] = EmbeddingCache(path, encode)
+    return EmbeddingModel(
+        player.model_name,
+        _embedding_caches[encoder_name],
+        vocabulary=list(dict.fromkeys(w.lower() for w in WORDS)),
+        temperature=player.temperature,
+        seed=player.seed
+    )
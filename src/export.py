@@ -0,0 +1,133 @@
+from typing import List, Dict, Any, Iterable, Iterator
+import argparse
+
+import numpy as np
+
+from src.game import Board
+from src.rules import is_repeated
+from src.results_sink import read_results
+from src.schemas import Results
+
+
+GUESS_COLUMNS = [
+    "game_id",
+    "round",
+    "team",
+    "captain_model",
+    "guesser_model",
+    "clue_word",
+    "clue_number",
+    "rank",
+    "word",
+    "outcome",
+    "winner_team"
+]
+
+
+def guess_rows(game_id: str, results: Results) -> Iterator[Dict[str, Any]]:
+    """
+    Yields one row per guessed word of a game. The outcome of each guess is recomputed from the
+    board, following the engine: 'own', 'opponent', 'neutral' or 'black' for evaluated words,
+    'invalid' for words that aren't (or are no longer) in the board, 'repeated' for words the
+    guesser already said in the turn, which the engine skips (see 'rules.is_repeated'), and
+    'unplayed' for words said after the turn was over.
+    """
+    board = Board.from_team_words(results.words, results.team_order)
+    for round_info in results.rounds_info:
+        for color in results.team_order:
+            team_data = getattr(round_info, f"{color}_team")
+            players = getattr(results.teams, color)
+            turn_over = False
+            words = team_data.guesser_choice.words
+            for rank, word in enumerate(words):
+                if turn_over:
+                    outcome = "unplayed"
+                elif is_repeated(word, words[:rank]):
+                    outcome = "repeated"
+                else:
+                    group = board.group_of(word)
+                    if group is None or board.is_revealed(word):
+                        outcome = "invalid"
+                        turn_over = True
+                    else:
+                        board.remove_guessed_word(word, group)
+                        if group == color:
+                            outcome = "own"
+                            turn_over = board.left_count(color) == 0
+                        else:
+                            outcome = "opponent" if group in ("red", "blue") else group
+                            turn_over = True
+                yield {
+                    "game_id": game_id,
+                    "round": round_info.round,
+                    "team": color,
+                    "captain_model": players.captain.model_name,
+                    "guesser_model": players.guesser.model_name,
+                    "clue_word": team_data.secret_code.word,
+                    "clue_number": team_data.secret_code.number,
+                    "rank": rank,
+                    "word": word,
+                    "outcome": outcome,
+                    "winner_team": results.winner_team
+                }
+
+
+def to_columns(games: Iterable[tuple[str, Results]]) -> Dict[str, np.ndarray]:
+    columns: Dict[str, List[Any]] = {column: [] for column in GUESS_COLUMNS}
+    for game_id, results in games:
+        for row in guess_rows(game_id, results):
+            for column in GUESS_COLUMNS:
+                columns[column].append(row[column])
+    return {
+        column: np.asarray(values, dtype=np.int32 if column in ("round", "clue_number", "rank") else str)
+        for column, values in columns.items()
+    }
+
+
+def export_guesses(input_path: str, output_path: str) -> int:
+    """
+    Compacts a ResultsSink file into a columnar table with one row per guess. The format depends
+    on the extension of 'output_path': '.parquet' (requires pyarrow) or '.npz'.
+
+    Return:
+        (int) Number of rows written.
+    """
+    columns = to_columns(read_results(input_path))
+    if output_path.endswith(".parquet"):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        pq.write_table(
+            pa.table({column: values.tolist() for column, values in columns.items()}),
+            output_path,
+            compression="zstd"
+        )
+    elif output_path.endswith(".npz"):
+        np.savez_compressed(output_path, **columns)
+    else:
+        raise ValueError(f"Unknown columnar format for '{output_path}', use .parquet or .npz")
+    return len(columns["game_id"])
+
+
+def load_guesses(path: str) -> Dict[str, np.ndarray]:
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(path)
+        return {column: table.column(column).to_numpy() for column in table.column_names}
+    with np.load(path) as data:
+        return {column: data[column] for column in data.files}
+
+
+def main(argv: List[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Export a results log to a columnar table")
+    parser.add_argument("input", help="JSON lines file written by a ResultsSink.")
+    parser.add_argument("output", help="Output .parquet or .npz file.")
+    args = parser.parse_args(argv)
+    rows = export_guesses(args.input, args.output)
+    print(f"{rows} guesses written to {args.output}")
+    return
+
+
+if __name__ == "__main__":
+    main()
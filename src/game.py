@@ -1,10 +1,17 @@
-from typing import List, Literal, Tuple
+from typing import List, Dict, Literal, Tuple, Callable
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import random
-import copy
+import json
+import os
+import time
+import uuid
 
-from src.llm_wrapper import LLMModel
+from src.llm_wrapper import LLMModel, ReplayLLMModel
 from src.schemas import (
     Results, 
+    LLMMessage,
+    CallUsage,
     Code, 
     Choice, 
     Teams, 
@@ -13,29 +20,132 @@ from src.schemas import (
     RoundTeamData,
     Round,
     TeamData,
-    PlayerData
+    PlayerData,
+    ToolCall,
+    ResponseFormat,
+    PlayerState,
+    GameCheckpoint,
+    WordRevealedEvent,
+    HistoryEvent
 )
-from src.tools import indicate_secret_code, choose_words
+from src.consistency import Aggregation, aggregate_codes, aggregate_choices, merge_usage
+from src.history import GameHistory
+from src.results_sink import ResultsSink
+from src.rules import GameState, Action, StartTurn, GiveCode, Guess, EndTurn, normalize, board_groups, is_repeated
+from src.rules import apply as apply_action
+from src.streaming import WordsStreamParser
+from src.tools import get_role_tools, secret_code_format, choice_format
 from src.prompts import (
     captain_system_prompt, 
     guesser_system_prompt, 
     captain_round_message, 
-    guesser_round_message
+    guesser_round_message,
+    captain_thread_message,
+    guesser_thread_message
 )
 from src.words import WORDS
 
 
 class Board:
 
+    __slots__ = (
+        "words",
+        "first_team_color",
+        "second_team_color",
+        "team_words",
+        "layout",
+        "_rng",
+        "_index",
+        "_positions",
+        "_revealed",
+        "_left_counts",
+        "_known",
+        "_left_team_words"
+    )
+
     words: List[str]
     first_team_color: Literal["red", "blue"]
     second_team_color: Literal["red", "blue"]
     team_words: TeamWords
-    left_team_words: LeftTeamWords
+    layout: Tuple[int, int, int]
 
-    def __init__(self, words: List[str] = [w.lower() for w in WORDS]):
+    def __init__(
+            self, 
+            words: List[str] = [w.lower() for w in WORDS],
+            rng: random.Random | None = None,
+            layout: Tuple[int, int, int] = (9, 8, 7)
+        ):
+        """
+        Args:
+            words (List[str]): Words to generate the board from.
+            rng (random.Random | None): Random generator used to set up the board.
+            layout (Tuple[int, int, int]): Number of words of the first team, the second team and
+                the neutral group. The board also has one black word.
+        """
+        # Derived from the global RNG by default so that `random.seed` keeps working
+        self._rng: random.Random = rng if rng is not None else random.Random(random.random())
+        self.layout: Tuple[int, int, int] = tuple(layout)
         self._set_up_board(words)
         return
+
+    @classmethod
+    def from_team_words(
+            cls, 
+            team_words: TeamWords, 
+            team_order: List[Literal["red", "blue"]]
+        ) -> "Board":
+        """
+        Rebuilds a board with a fixed layout, e.g. to mirror a board across games
+        or to rebuild the board of saved Results.
+        """
+        first_team_color, second_team_color = team_order
+        board = cls.__new__(cls)
+        board._rng = random.Random()
+        board.layout = (
+            len(team_words[first_team_color]),
+            len(team_words[second_team_color]),
+            len(team_words["neutral"])
+        )
+        board.words = (
+            list(team_words[first_team_color])
+            + list(team_words[second_team_color])
+            + list(team_words["neutral"])
+            + [team_words["black"]]
+        )
+        board.first_team_color = first_team_color
+        board.second_team_color = second_team_color
+        board._split_team_words()
+        return board
+
+    @classmethod
+    def restore(
+            cls,
+            team_words: TeamWords,
+            team_order: List[Literal["red", "blue"]],
+            revealed: List[str],
+            rng_state: List | None = None
+        ) -> "Board":
+        """
+        Rebuilds the board of a game in progress from its layout, the words revealed so far (in
+        the order they were guessed) and the state of its random generator.
+        """
+        board = cls.from_team_words(team_words, team_order)
+        for word in revealed:
+            board.remove_guessed_word(word, board.group_of(word))
+        if rng_state is not None:
+            version, internal_state, gauss_next = rng_state
+            board._rng.setstate((version, tuple(internal_state), gauss_next))
+        return board
+
+    @property
+    def rng_state(self) -> List:
+        return list(self._rng.getstate())
+
+    @property
+    def size(self) -> int:
+        return sum(self.layout) + 1
+
+    normalize = staticmethod(normalize)
     
     def _set_up_board(self, words: List[str]) -> None:
         self.words: List[str] = self.generate_game_words(words)
@@ -44,49 +154,95 @@ class Board:
         return
 
     def _set_teams_order(self) -> None:
-        team_order = random.sample(["red", "blue"], 2)
+        team_order = self._rng.sample(["red", "blue"], 2)
         self.first_team_color: Literal["red", "blue"] = team_order[0]
         self.second_team_color: Literal["red", "blue"] = team_order[1]
         return
     
     def generate_game_words(self, words: List[str]) -> List[str]:
-        return random.sample(words, 25)
+        return self._rng.sample(words, self.size)
     
     def _split_team_words(self):
+        first_size, second_size, neutral_size = self.layout
+        groups: List[str] = board_groups(self.layout, [self.first_team_color, self.second_team_color])
+        self._index: Dict[str, str] = {}
+        self._positions: Dict[str, int] = {}
+        for position, (word, group) in enumerate(zip(self.words, groups)):
+            self._index[self.normalize(word)] = group
+            self._positions[self.normalize(word)] = position
+        self._revealed: bytearray = bytearray(len(self.words))
+        self._left_counts: Dict[str, int] = {
+            self.first_team_color: first_size,
+            self.second_team_color: second_size,
+            "neutral": neutral_size,
+            "black": 1
+        }
+        self._known: List[str] = []
+        self._left_team_words: LeftTeamWords | None = None
 
-        if self.first_team_color == "red":
-            red_words = self.words[:9]
-            blue_words = self.words[9:17]
-        else:
-            blue_words = self.words[:9]
-            red_words = self.words[9:17]
-
-        team_words = TeamWords(
-            red = red_words,
-            blue = blue_words,
-            neutral = self.words[17:-1],
+        first_words = self.words[:first_size]
+        second_words = self.words[first_size:first_size + second_size]
+        self.team_words: TeamWords = TeamWords(
+            red = first_words if self.first_team_color == "red" else second_words,
+            blue = first_words if self.first_team_color == "blue" else second_words,
+            neutral = self.words[first_size + second_size:-1],
             black =  self.words[-1]
         )
-        self.team_words: TeamWords = copy.deepcopy(team_words)
-        self.left_team_words: LeftTeamWords = LeftTeamWords(
-            red = team_words["red"],
-            blue = team_words["blue"],
-            neutral = team_words["neutral"],
-            black = team_words["black"],
-            left_words = copy.deepcopy(self.words),
-            known = []
-        )
-        self.known_words: List[str] = []
         return
 
+    @property
+    def left_team_words(self) -> LeftTeamWords:
+        """
+        Words yet to be guessed of each group. It is rebuilt from the revealed words only after
+        a word is guessed.
+        """
+        if self._left_team_words is None:
+            left = {"red": [], "blue": [], "neutral": [], "black": []}
+            left_words = []
+            for word, revealed in zip(self.words, self._revealed):
+                if not revealed:
+                    left[self._index[self.normalize(word)]].append(word)
+                    left_words.append(word)
+            self._left_team_words = LeftTeamWords(
+                red = left["red"],
+                blue = left["blue"],
+                neutral = left["neutral"],
+                black = self.team_words["black"],
+                left_words = left_words,
+                known = list(self._known)
+            )
+        return self._left_team_words
+
+    @property
+    def known_words(self) -> List[str]:
+        return list(self._known)
+
+    def group_of(self, word: str) -> str | None:
+        """
+        Returns the group ('red', 'blue', 'neutral' or 'black') of a word, or None if the word
+        is not in the board.
+        """
+        return self._index.get(self.normalize(word))
+
+    def is_revealed(self, word: str) -> bool:
+        position = self._positions.get(self.normalize(word))
+        return position is not None and bool(self._revealed[position])
+
+    def left_count(self, group: str) -> int:
+        return self._left_counts[group]
+
     def remove_guessed_word(self, word: str, group: str) -> None:
-        self.left_team_words[group].remove(word)
-        self.left_team_words["left_words"].remove(word)
-        self.left_team_words["known"].append(word)
+        word = self.normalize(word)
+        position = self._positions[word]
+        if self._revealed[position] or self._index[word] != group:
+            raise ValueError(f"Word '{word}' can't be removed from group '{group}'")
+        self._revealed[position] = 1
+        self._left_counts[group] -= 1
+        self._known.append(self.words[position])
+        self._left_team_words = None
         return
      
 
-
 class Player:
 
     name: str
@@ -97,26 +253,168 @@ class Player:
     model: LLMModel
     team: Literal["red", "blue"]
     model_name: str
+    threaded: bool
+    structured_output: bool
+    messages: List[dict]
+    sample_models: List[LLMModel]
+    aggregation: Aggregation
 
     def __init__(
             self, 
             name: str,
             model: LLMModel,
-            tools: List,
-            role: Literal["captain", "guesser"]
+            tools: List | None,
+            role: Literal["captain", "guesser"],
+            threaded: bool = False,
+            structured_output: bool = False,
+            max_justification_length: int | None = 200,
+            sample_models: List[LLMModel] | None = None,
+            aggregation: Aggregation = "borda"
         ) -> None:
         self.name: str = name
         self.role: Literal["captain", "guesser"] = role
         self.model: LLMModel = model
         self.temperature: float = self.model.temperature
         self.seed: int | None = self.model.seed
-        self.tools: List = tools
+        self._tools: List | None = tools
         self.model_name: str = self.model.model_name
+        # In threaded mode the player keeps its conversation and each turn only appends
+        # what changed since its previous turn, so the prompt prefix stays the same
+        self.threaded: bool = threaded
+        self.messages: List[dict] = []
+        self.last_response: LLMMessage | None = None
+        self._seen_history: str = ""
+        self._seen_words: List[str] = []
+        self._pending_turn: tuple[str, List[str]] = ("", [])
+        # In structured output mode the response follows a JSON schema built for each turn
+        # (only words of the board) instead of being a free-form tool call
+        self.structured_output: bool = structured_output
+        self.max_justification_length: int | None = max_justification_length
+        # With 'sample_models' (e.g. the same model with other seeds) every turn is answered by
+        # all the models at the same time and played with the aggregate of their answers
+        self.sample_models: List[LLMModel] = list(sample_models or [])
+        self.aggregation: Aggregation = aggregation
+        self.samples: List[Code] | List[Choice] | None = None
+        self.agreement: float | None = None
         return
     
+    @property
+    def tools(self) -> List:
+        # The default tools of the role are built on first use, so that the engine doesn't
+        # need langchain for players whose model doesn't call tools
+        if self._tools is None:
+            self._tools = get_role_tools(self.role)
+        return self._tools
+
     def set_team(self, color: Literal["red", "blue"]) -> None:
         self.team = color
         return
+
+    def get_state(self) -> PlayerState:
+        return PlayerState(
+            messages=self.messages,
+            seen_history=self._seen_history,
+            seen_words=self._seen_words
+        )
+
+    def set_state(self, state: PlayerState) -> None:
+        self.messages = list(state.messages)
+        self._seen_history = state.seen_history
+        self._seen_words = list(state.seen_words)
+        return
+
+    def _history_delta(self, game_history: str) -> str | None:
+        """
+        Returns the part of the game history the player hasn't seen yet, or None when the
+        full prompt has to be sent (not threaded, first turn or a history that doesn't
+        extend the one already seen).
+        """
+        if not self.threaded or not self.messages or not game_history.startswith(self._seen_history):
+            return None
+        return game_history[len(self._seen_history):].strip("\n")
+
+    def _revealed_words(self, words: List[str]) -> List[str]:
+        current_words = set(words)
+        return [w for w in self._seen_words if w not in current_words]
+
+    @staticmethod
+    def _chat(
+            model: LLMModel,
+            messages: List[dict],
+            response_format: ResponseFormat | None
+        ) -> LLMMessage:
+        if response_format is not None:
+            return model.chat_structured(messages, response_format)
+        return model.chat(messages)
+
+    @staticmethod
+    async def _achat(
+            model: LLMModel,
+            messages: List[dict],
+            response_format: ResponseFormat | None
+        ) -> LLMMessage:
+        if response_format is not None:
+            return await model.achat_structured(messages, response_format)
+        return await model.achat(messages)
+
+    def _sample(self, messages: List[dict], response_format: ResponseFormat | None) -> List[LLMMessage]:
+        """
+        This method gets the answers of the player's model and of its 'sample_models', whose
+        calls are made in parallel threads, so a turn takes as long as its slowest sample.
+
+        Args:
+            messages (List[dict]): Messages of the turn.
+            response_format (ResponseFormat | None): Schema of the answer in structured output mode.
+        Return:
+            (List[LLMMessage]) The answers, without the calls that failed (see '_answered').
+        """
+        if not self.sample_models:
+            return [self._chat(self.model, messages, response_format)]
+        models = [self.model] + self.sample_models
+        with ThreadPoolExecutor(max_workers=len(models), thread_name_prefix="sample") as executor:
+            futures = [executor.submit(self._chat, model, messages, response_format) for model in models]
+            outcomes = [future.exception() or future.result() for future in futures]
+        return self._answered(outcomes)
+
+    async def _asample(self, messages: List[dict], response_format: ResponseFormat | None) -> List[LLMMessage]:
+        if not self.sample_models:
+            return [await self._achat(self.model, messages, response_format)]
+        models = [self.model] + self.sample_models
+        outcomes = await asyncio.gather(
+            *(self._achat(model, messages, response_format) for model in models), return_exceptions=True
+        )
+        return self._answered(outcomes)
+
+    @staticmethod
+    def _answered(outcomes: List[LLMMessage | BaseException]) -> List[LLMMessage]:
+        # A sample that failed doesn't fail the turn while another one answered
+        responses = [outcome for outcome in outcomes if isinstance(outcome, LLMMessage)]
+        if not responses:
+            raise outcomes[0]
+        return responses
+
+    def _parse_samples(self, responses: List[LLMMessage]) -> List[tuple[LLMMessage, Code | Choice]]:
+        # Samples that didn't call the tool with its arguments are left out of the vote
+        parsed = []
+        for response in responses:
+            try:
+                parsed.append((response, self._parse_response(response)))
+            except Exception:
+                continue
+        if not parsed:
+            raise Exception(f"No sample of {self.name} called its tool with valid arguments")
+        return parsed
+
+    def _record_response(self, messages: List[dict], response: LLMMessage) -> None:
+        self.last_response = response
+        if not self.threaded:
+            return
+        content = response.content or ""
+        if response.tool_call is not None:
+            content = json.dumps({"tool": response.tool_call.tool_name, "args": response.tool_call.args})
+        self.messages = messages + [dict(role="assistant", content=content)]
+        self._seen_history, self._seen_words = self._pending_turn
+        return
     
 
 class Captain(Player):
@@ -134,14 +432,24 @@ class Captain(Player):
             self, 
             name: str,
             model: LLMModel,
-            tools: List = [indicate_secret_code],
+            tools: List | None = None,
             role: Literal["captain"] = "captain",
+            threaded: bool = False,
+            structured_output: bool = False,
+            max_justification_length: int | None = 200,
+            sample_models: List[LLMModel] | None = None,
+            aggregation: Aggregation = "borda"
         ) -> None:
         super().__init__(
-            name,  
+            name,
             model,
             tools,
-            role
+            role,
+            threaded,
+            structured_output,
+            max_justification_length,
+            sample_models,
+            aggregation
         )
     
     def say_secret_code(
@@ -152,6 +460,53 @@ class Captain(Player):
             neutral_words, 
             black_word
         ) -> tuple[Code, str]:
+        messages, msg = self._build_messages(game_history, red_words, blue_words, neutral_words, black_word)
+        response_format = self._response_format(red_words, blue_words) if self.structured_output else None
+        return self._choose_code(messages, self._sample(messages, response_format)), msg
+
+    async def asay_secret_code(
+            self, 
+            game_history, 
+            red_words, 
+            blue_words, 
+            neutral_words, 
+            black_word
+        ) -> tuple[Code, str]:
+        messages, msg = self._build_messages(game_history, red_words, blue_words, neutral_words, black_word)
+        response_format = self._response_format(red_words, blue_words) if self.structured_output else None
+        return self._choose_code(messages, await self._asample(messages, response_format)), msg
+
+    def _choose_code(self, messages: List[dict], responses: List[LLMMessage]) -> Code:
+        if not self.sample_models:
+            self._record_response(messages, responses[0])
+            return self._parse_response(responses[0])
+        parsed = self._parse_samples(responses)
+        self.samples = [code for _, code in parsed]
+        code, self.agreement = aggregate_codes(self.samples)
+        response = next(response for response, sample in parsed if sample is code)
+        self._record_response(
+            messages, response.model_copy(update={"usage": merge_usage([r.usage for r in responses])})
+        )
+        return code
+
+    def _build_messages(
+            self, 
+            game_history, 
+            red_words, 
+            blue_words, 
+            neutral_words, 
+            black_word
+        ) -> tuple[List[dict], str]:
+        words = list(red_words) + list(blue_words) + list(neutral_words)
+        self._pending_turn = (game_history, words)
+        history_delta = self._history_delta(game_history)
+        if history_delta is not None:
+            msg = captain_thread_message.format(
+                game_history=history_delta,
+                revealed_words=self._revealed_words(words)
+            )
+            return self.messages + [dict(role="user", content=msg)], msg
+
         msg = captain_round_message.format(
                 team_color=self.team, 
                 game_history=game_history,
@@ -162,14 +517,20 @@ class Captain(Player):
             )
         system_prompt = dict(role="system", content=captain_system_prompt)
         round_message = dict(role="user", content=msg)
-        response = self.model.chat([system_prompt, round_message])
+        return [system_prompt, round_message], msg
+
+    def _response_format(self, red_words, blue_words) -> ResponseFormat:
+        own_words = red_words if self.team == "red" else blue_words
+        return secret_code_format(list(own_words), self.max_justification_length)
+
+    def _parse_response(self, response: LLMMessage) -> Code:
         args = response.tool_call.args
         return Code(
             word=args["word"], 
             number=args["number"], 
-            justification=args["justification"],
+            justification=args.get("justification", ""),
             words_related=args["words_related"]
-        ), msg
+        )
     
 
 class Guesser(Player):
@@ -182,22 +543,76 @@ class Guesser(Player):
     model: LLMModel
     team: Literal["red", "blue"]
     model_name: str
+    streaming: bool
 
     def __init__(
             self, 
             name: str,
             model: LLMModel,
-            tools: List = [choose_words],
-            role: Literal["guesser"] = "guesser"
+            tools: List | None = None,
+            role: Literal["guesser"] = "guesser",
+            threaded: bool = False,
+            structured_output: bool = False,
+            max_justification_length: int | None = 200,
+            streaming: bool = False,
+            sample_models: List[LLMModel] | None = None,
+            aggregation: Aggregation = "borda"
         ) -> None:
+        # Streaming guessers receive their structured answer as it is generated (see 'stream_words'),
+        # from a single sample
         super().__init__(
-            name, 
-            model, 
+            name,
+            model,
             tools,
-            role
+            role,
+            threaded,
+            structured_output or streaming,
+            max_justification_length,
+            sample_models,
+            aggregation
         )
+        self.streaming: bool = streaming
+        self.stopped_early: bool | None = None
+        return
+
 
     def choose_words(self, game_history, words, secret_code: Tuple) -> tuple[Choice, str]:
+        messages, msg = self._build_messages(game_history, words, secret_code)
+        response_format = self._response_format(words) if self.structured_output else None
+        return self._choose_words(messages, self._sample(messages, response_format)), msg
+
+    async def achoose_words(self, game_history, words, secret_code: Tuple) -> tuple[Choice, str]:
+        messages, msg = self._build_messages(game_history, words, secret_code)
+        response_format = self._response_format(words) if self.structured_output else None
+        return self._choose_words(messages, await self._asample(messages, response_format)), msg
+
+    def _choose_words(self, messages: List[dict], responses: List[LLMMessage]) -> Choice:
+        if not self.sample_models:
+            self._record_response(messages, responses[0])
+            return self._parse_response(responses[0])
+        parsed = self._parse_samples(responses)
+        self.samples = [choice for _, choice in parsed]
+        choice, self.agreement = aggregate_choices(self.samples, self.aggregation)
+        # The aggregated words are recorded as the answer of the turn
+        self._record_response(messages, LLMMessage(
+            model_name=self.model_name,
+            content=None,
+            tool_call=ToolCall(tool_name="choose_words", args=choice.model_dump()),
+            usage=merge_usage([r.usage for r in responses])
+        ))
+        return choice
+
+    def _build_messages(self, game_history, words, secret_code: Tuple) -> tuple[List[dict], str]:
+        self._pending_turn = (game_history, list(words))
+        history_delta = self._history_delta(game_history)
+        if history_delta is not None:
+            msg = guesser_thread_message.format(
+                game_history=history_delta,
+                revealed_words=self._revealed_words(words),
+                secret_code=secret_code
+            )
+            return self.messages + [dict(role="user", content=msg)], msg
+
         msg = guesser_round_message.format(
                 team_color=self.team, 
                 game_history=game_history,
@@ -206,11 +621,108 @@ class Guesser(Player):
             )
         system_prompt = dict(role="system", content=guesser_system_prompt)
         round_message = dict(role="user", content=msg)
-        response = self.model.chat([system_prompt, round_message])
+        return [system_prompt, round_message], msg
+
+    def stream_words(
+            self,
+            game_history,
+            words,
+            secret_code: Tuple,
+            on_word: Callable[[str], bool]
+        ) -> tuple[Choice, str]:
+        """
+        This method streams the guesser's answer and passes every word to 'on_word' as soon as it
+        is generated. Generation is stopped once the turn is decided: when 'on_word' returns False
+        (the turn is over) or when the list of words is complete, so the rest of the answer (e.g.
+        the justification) is not generated.
+
+        Args:
+            game_history (str): Game history rendered for the guessers.
+            words (List[str]): Words left in the board.
+            secret_code (Tuple): Secret word and number of the captain.
+            on_word (Callable[[str], bool]): Evaluates a word, returning whether the turn goes on.
+        Return:
+            (tuple[Choice, str]) The words evaluated and the message sent to the model.
+        """
+        messages, msg = self._build_messages(game_history, words, secret_code)
+        parser, chosen_words, deltas = WordsStreamParser(), [], []
+        start = time.perf_counter()
+        stream = self.model.stream_structured(messages, self._response_format(words))
+        try:
+            for delta in stream:
+                deltas.append(delta)
+                if self._feed_stream(parser, delta, chosen_words, on_word):
+                    break
+        finally:
+            stream.close()
+        return self._end_stream(messages, parser, chosen_words, deltas, start), msg
+
+    async def astream_words(
+            self,
+            game_history,
+            words,
+            secret_code: Tuple,
+            on_word: Callable[[str], bool]
+        ) -> tuple[Choice, str]:
+        messages, msg = self._build_messages(game_history, words, secret_code)
+        parser, chosen_words, deltas = WordsStreamParser(), [], []
+        start = time.perf_counter()
+        stream = self.model.astream_structured(messages, self._response_format(words))
+        try:
+            async for delta in stream:
+                deltas.append(delta)
+                if self._feed_stream(parser, delta, chosen_words, on_word):
+                    break
+        finally:
+            await stream.aclose()
+        return self._end_stream(messages, parser, chosen_words, deltas, start), msg
+
+    @staticmethod
+    def _feed_stream(
+            parser: WordsStreamParser,
+            delta: LLMMessage,
+            chosen_words: List[str],
+            on_word: Callable[[str], bool]
+        ) -> bool:
+        # Returns True once the turn is decided. A word said again is skipped
+        for word in parser.feed(delta.content or ""):
+            if is_repeated(word, chosen_words):
+                continue
+            chosen_words.append(word)
+            if not on_word(word):
+                return True
+        return parser.done
+
+    def _end_stream(
+            self,
+            messages: List[dict],
+            parser: WordsStreamParser,
+            chosen_words: List[str],
+            deltas: List[LLMMessage],
+            start: float
+        ) -> Choice:
+        # Only a stream read until the end has the usage reported by the provider
+        usage = deltas[-1].usage if deltas and deltas[-1].usage is not None else CallUsage(
+            completion_tokens=len(deltas), latency=time.perf_counter() - start
+        )
+        self.stopped_early = not deltas or deltas[-1].usage is None
+        choice = Choice(words=chosen_words, justification="")
+        self._record_response(messages, LLMMessage(
+            model_name=self.model_name,
+            content=parser.text,
+            tool_call=ToolCall(tool_name="choose_words", args=choice.model_dump()),
+            usage=usage
+        ))
+        return choice
+
+    def _response_format(self, words) -> ResponseFormat:
+        return choice_format(list(words), max_justification_length=self.max_justification_length)
+
+    def _parse_response(self, response: LLMMessage) -> Choice:
         return Choice(
             words = response.tool_call.args["words"],
-            justification = response.tool_call.args["justification"]
-        ), msg
+            justification = response.tool_call.args.get("justification", "")
+        )
 
 
 class Team:
@@ -246,29 +758,78 @@ class Team:
         return {"red": "blue", "blue": "red"}[color]
 
 
+class ReplayMismatch(Exception):
+    """
+    Raised when a replayed game doesn't end the same way as the recorded one.
+    """
+    pass
+
+
 class SecretCodeGame:
+    """
+    Game between two teams. The rules are applied by 'rules.apply': every decision of the players
+    is an action on the game 'state', and the events it produces update the board and the history
+    the players see.
+    """
 
     team_blue: Team
     team_red: Team
     board: Board
-    round: int
-    game_over: bool
-    game_history: List
-    winner_team: Literal["red", "blue"]
+    state: GameState
+    game_history: GameHistory
 
     def __init__(
             self,
             team_blue: Team,
             team_red: Team,
-            board: Board
+            board: Board,
+            sink: ResultsSink | None = None,
+            game_id: str | None = None,
+            checkpoint_path: str | None = None
     ):
         self.team_blue: Team = team_blue
         self.team_red: Team = team_red
         self.board: Board = board
-        self.round: int = 0
-        self.game_over: bool = False
-        self.game_history: List = []
+        self.state: GameState = GameState.initial(
+            board.words,
+            board.layout,
+            [board.first_team_color, board.second_team_color],
+            revealed=board.known_words
+        )
+        self.game_history: GameHistory = GameHistory()
+        self.rounds_info: List[Round] = []
+        # Optional log where every round is written as soon as it is over
+        self.sink: ResultsSink | None = sink
+        self.game_id: str = game_id if game_id is not None else uuid.uuid4().hex
+        # Optional file where the game state is saved after every team turn (see 'resume')
+        self.checkpoint_path: str | None = checkpoint_path
+        self._first_turn: RoundTeamData | None = None
+        self._resumed: bool = False
         return
+
+    @property
+    def round(self) -> int:
+        return self.state.round
+
+    @property
+    def game_over(self) -> bool:
+        return self.state.game_over
+
+    @property
+    def winner_team(self) -> Literal["red", "blue"] | None:
+        return self.state.winner
+
+    def _apply(self, action: Action) -> List[HistoryEvent]:
+        """
+        Applies an action of the team to play to the game state, and its events to the board and
+        the game history.
+        """
+        self.state, events = apply_action(self.state, action)
+        for event in events:
+            if isinstance(event, WordRevealedEvent):
+                self.board.remove_guessed_word(event.word, event.group)
+            self.game_history.append(event)
+        return events
     
     def get_teams_order(self) -> List[Team]:
         teams = {
@@ -280,123 +841,414 @@ class SecretCodeGame:
         return [first_team, second_team]
     
     def play(self) -> None:
-        total_rounds_info = []
-        while not self.game_over:
-            # print("\n\n\nGame History")
-            # print(self.game_history)
-            self.game_history.append(f"\n**Round {self.round}**")
-            first_team, second_team = self.get_teams_order()
-            first_team_round_info = self._play_round(first_team)
-            second_team_round_info = self._play_round(second_team)
-            self.round += 1
-            round_info = Round(
-                round = self.round,
-                blue_team = first_team_round_info if first_team.color == "blue" else second_team_round_info,
-                red_team = second_team_round_info if second_team.color == "red" else first_team_round_info
+        self._start_game()
+        try:
+            # A round started by the first team is always finished by the second one
+            while not self.state.finished:
+                # print("\n\n\nGame History")
+                # print(self.game_history)
+                team = self._next_team()
+                self._end_team_turn(team, self._play_round(team))
+        except Exception as e:
+            self._fail_game(e)
+            raise
+        self.save_results(self.rounds_info)
+        self._end_game()
+        return
+
+    async def aplay(self) -> None:
+        """
+        Same as 'play' but awaiting the players' models, so that many games can be played
+        concurrently in the same event loop.
+        """
+        self._start_game()
+        try:
+            while not self.state.finished:
+                team = self._next_team()
+                self._end_team_turn(team, await self._aplay_round(team))
+        except Exception as e:
+            self._fail_game(e)
+            raise
+        self.save_results(self.rounds_info)
+        self._end_game()
+        return
+
+    def _start_game(self) -> None:
+        if self.sink is None or (self._resumed and self.sink.has_started(self.game_id)):
+            return
+        self.sink.start_game(
+            self.game_id,
+            self.board.team_words,
+            [self.board.first_team_color, self.board.second_team_color],
+            self.get_teams_data()
+        )
+        # A game resumed with a new log also writes the rounds played before
+        for round_info in self.rounds_info:
+            self.sink.write_round(self.game_id, round_info)
+        return
+
+    def _end_game(self) -> None:
+        if self.sink is not None:
+            self.sink.end_game(self.game_id, self.results)
+        return
+
+    def _fail_game(self, error: Exception) -> None:
+        if self.sink is not None:
+            self.sink.fail_game(self.game_id, error)
+        return
+
+    @classmethod
+    def replay(cls, results: Results, strict: bool = True) -> "SecretCodeGame":
+        """
+        Re-executes a saved game feeding the recorded secret codes and choices back through
+        the engine, without calling any LLM.
+
+        Args:
+            results (Results): Results of the game to replay.
+            strict (bool): If True, raise ReplayMismatch when the winner or the number of rounds
+                differ from the recorded ones (e.g. after changing the game rules).
+        Return:
+            (SecretCodeGame) The replayed game, with its new 'results'.
+        """
+        teams = {}
+        for color in ["red", "blue"]:
+            team_data: TeamData = getattr(results.teams, color)
+            rounds: List[RoundTeamData] = [getattr(r, f"{color}_team") for r in results.rounds_info]
+            captain = Captain(
+                name=f"{color}_captain",
+                model=ReplayLLMModel(
+                    model_name=team_data.captain.model_name,
+                    tool_calls=[
+                        ToolCall(tool_name="indicate_secret_code", args=r.secret_code.model_dump())
+                        for r in rounds
+                    ],
+                    temperature=team_data.captain.temperature,
+                    seed=team_data.captain.seed
+                )
+            )
+            guesser = Guesser(
+                name=f"{color}_guesser",
+                model=ReplayLLMModel(
+                    model_name=team_data.guesser.model_name,
+                    tool_calls=[
+                        ToolCall(tool_name="choose_words", args=r.guesser_choice.model_dump())
+                        for r in rounds
+                    ],
+                    temperature=team_data.guesser.temperature,
+                    seed=team_data.guesser.seed
+                )
             )
-            total_rounds_info.append(round_info)
-        self.save_results(total_rounds_info)
+            teams[color] = Team(color=color, players=[captain, guesser])
+
+        game = cls(
+            team_blue=teams["blue"],
+            team_red=teams["red"],
+            board=Board.from_team_words(results.words, results.team_order)
+        )
+        try:
+            game.play()
+        except Exception as e:
+            if strict:
+                raise ReplayMismatch(f"Replay failed after {game.round} rounds: {e}") from e
+            raise
+        if strict and (game.winner_team != results.winner_team or game.round != results.num_rounds):
+            raise ReplayMismatch(
+                f"Replay finished with winner '{game.winner_team}' after {game.round} rounds, "
+                f"recorded winner '{results.winner_team}' after {results.num_rounds} rounds"
+            )
+        return game
+
+    def _next_team(self) -> Team:
+        # Starting the first team's turn starts a new round
+        self._apply(StartTurn())
+        return self.team_red if self.state.playing == "red" else self.team_blue
+
+    def _end_team_turn(self, team: Team, round_team_data: RoundTeamData) -> None:
+        self._apply(EndTurn())
+        if self._first_turn is None:
+            self._first_turn = round_team_data
+        else:
+            first_team = self.get_teams_order()[0]
+            self.rounds_info.append(self._end_round(first_team, self._first_turn, round_team_data))
+            self._first_turn = None
+        if self.checkpoint_path is not None:
+            self.save_checkpoint(self.checkpoint_path)
         return
-    
+
+    def _end_round(
+            self, 
+            first_team: Team, 
+            first_team_round_info: RoundTeamData, 
+            second_team_round_info: RoundTeamData
+        ) -> Round:
+        round_info = Round(
+            round = self.round,
+            blue_team = first_team_round_info if first_team.color == "blue" else second_team_round_info,
+            red_team = second_team_round_info if first_team.color == "blue" else first_team_round_info
+        )
+        if self.sink is not None:
+            self.sink.write_round(self.game_id, round_info)
+        return round_info
+
+    def checkpoint(self) -> GameCheckpoint:
+        """
+        This method returns the state of the game after the last completed team turn.
+
+        Return:
+            (GameCheckpoint) Serializable state from which 'resume' continues the game.
+        """
+        return GameCheckpoint(
+            game_id = self.game_id,
+            words = self.board.team_words,
+            team_order = [self.board.first_team_color, self.board.second_team_color],
+            teams = self.get_teams_data(),
+            round = self.round,
+            revealed = self.board.known_words,
+            history = list(self.game_history),
+            rounds_info = self.rounds_info,
+            first_turn = self._first_turn,
+            game_over = self.game_over,
+            winner_team = self.winner_team,
+            rng_state = self.board.rng_state,
+            players = {
+                f"{team.color}_{player.role}": player.get_state()
+                for team in [self.team_red, self.team_blue] for player in team.players
+            }
+        )
+
+    def save_checkpoint(self, path: str) -> None:
+        """
+        This method writes the checkpoint of the game to 'path'. The file is replaced atomically,
+        so a worker killed while writing leaves the previous checkpoint intact.
+
+        Args:
+            path (str): JSON file of the checkpoint.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.checkpoint().model_dump_json())
+        os.replace(tmp_path, path)
+        return
+
+    @staticmethod
+    def load_checkpoint(path: str) -> GameCheckpoint:
+        with open(path) as f:
+            return GameCheckpoint.model_validate_json(f.read())
+
+    @classmethod
+    def resume(
+            cls,
+            checkpoint: GameCheckpoint | str,
+            team_blue: Team,
+            team_red: Team,
+            sink: ResultsSink | None = None,
+            checkpoint_path: str | None = None
+        ) -> "SecretCodeGame":
+        """
+        This method rebuilds a game from a checkpoint, so that 'play' or 'aplay' continue it from
+        the last completed team turn instead of starting over.
+
+        Args:
+            checkpoint (GameCheckpoint | str): Checkpoint, or path of a file written by 'save_checkpoint'.
+            team_blue (Team): Blue team, with the players' models.
+            team_red (Team): Red team, with the players' models.
+            sink (ResultsSink | None): Log the game keeps writing its rounds to.
+            checkpoint_path (str | None): File where the game keeps saving its state. Defaults to
+                the file the checkpoint was loaded from.
+        Return:
+            (SecretCodeGame) The game, ready to be played.
+        """
+        if isinstance(checkpoint, str):
+            checkpoint_path = checkpoint_path or checkpoint
+            checkpoint = cls.load_checkpoint(checkpoint)
+        game = cls(
+            team_blue=team_blue,
+            team_red=team_red,
+            board=Board.restore(
+                checkpoint.words, checkpoint.team_order, checkpoint.revealed, checkpoint.rng_state
+            ),
+            sink=sink,
+            game_id=checkpoint.game_id,
+            checkpoint_path=checkpoint_path
+        )
+        game.state = GameState.initial(
+            game.board.words,
+            game.board.layout,
+            checkpoint.team_order,
+            revealed=checkpoint.revealed,
+            round=checkpoint.round,
+            # The second team plays if the checkpoint was saved after the first team's turn
+            team=0 if checkpoint.first_turn is None else 1,
+            game_over=checkpoint.game_over,
+            winner=checkpoint.winner_team
+        )
+        for event in checkpoint.history:
+            game.game_history.append(event)
+        game.rounds_info = list(checkpoint.rounds_info)
+        game._first_turn = checkpoint.first_turn
+        for team in [team_red, team_blue]:
+            for player in team.players:
+                state = checkpoint.players.get(f"{team.color}_{player.role}")
+                if state is not None:
+                    player.set_state(state)
+        game._resumed = True
+        return game
+
     def _play_round(self, team: Team) -> RoundTeamData:
-        secret_code, captain_prompt = team.captain.say_secret_code(
-            game_history="\n".join(self.game_history),
+        secret_code, captain_prompt = team.captain.say_secret_code(**self._captain_inputs())
+        guesser_inputs = self._guesser_inputs(secret_code)
+        if team.guesser.streaming:
+            # Words are evaluated as they are generated
+            self._give_code(team, secret_code)
+            guesser_choice, guesser_prompt = team.guesser.stream_words(
+                **guesser_inputs, on_word=lambda word: self._evaluate_word(word, team)
+            )
+            return self._turn_data(team, secret_code, guesser_choice, captain_prompt, guesser_prompt)
+        guesser_choice, guesser_prompt = team.guesser.choose_words(
+            **guesser_inputs
+        ) # TODO: chosen words validation
+        return self._end_turn(team, secret_code, guesser_choice, captain_prompt, guesser_prompt)
+
+    async def _aplay_round(self, team: Team) -> RoundTeamData:
+        secret_code, captain_prompt = await team.captain.asay_secret_code(**self._captain_inputs())
+        guesser_inputs = self._guesser_inputs(secret_code)
+        if team.guesser.streaming:
+            self._give_code(team, secret_code)
+            guesser_choice, guesser_prompt = await team.guesser.astream_words(
+                **guesser_inputs, on_word=lambda word: self._evaluate_word(word, team)
+            )
+            return self._turn_data(team, secret_code, guesser_choice, captain_prompt, guesser_prompt)
+        guesser_choice, guesser_prompt = await team.guesser.achoose_words(
+            **guesser_inputs
+        ) # TODO: chosen words validation
+        return self._end_turn(team, secret_code, guesser_choice, captain_prompt, guesser_prompt)
+
+    def _captain_inputs(self) -> dict:
+        return dict(
+            game_history=self.game_history.render("captain"),
             red_words=self.board.left_team_words["red"],
             blue_words=self.board.left_team_words["blue"],
             neutral_words=self.board.left_team_words["neutral"],
             black_word=self.board.team_words["black"]
         )
-        guesser_choice, guesser_prompt = team.guesser.choose_words(
-            game_history="\n".join(self.game_history),
+
+    def _guesser_inputs(self, secret_code: Code) -> dict:
+        return dict(
+            game_history=self.game_history.render("guesser"),
             words=self.board.left_team_words["left_words"],
             secret_code=(secret_code.word, secret_code.number)
-        ) # TODO: chosen words validation
-
-        msg = f"""Team {team.color} turn.
-            Captain said the following secret code: {secret_code.word}, {secret_code.number}."""
-        
-        self.game_history.append(
-            msg
         )
 
+    def _end_turn(
+            self, 
+            team: Team, 
+            secret_code: Code, 
+            guesser_choice: Choice, 
+            captain_prompt: str, 
+            guesser_prompt: str
+        ) -> RoundTeamData:
+        self._give_code(team, secret_code)
+
         # print("\nCode:", secret_code)
         # print("\nChoice:", guesser_choice)
 
         self._evaluate_guessed_words(guesser_choice.words, team)
+        return self._turn_data(team, secret_code, guesser_choice, captain_prompt, guesser_prompt)
+
+    def _give_code(self, team: Team, secret_code: Code) -> None:
+        self._apply(GiveCode(secret_code.word, secret_code.number))
+        return
+
+    def _turn_data(
+            self,
+            team: Team,
+            secret_code: Code,
+            guesser_choice: Choice,
+            captain_prompt: str,
+            guesser_prompt: str
+        ) -> RoundTeamData:
+        streamed = team.guesser.streaming and team.guesser.last_response is not None
         return RoundTeamData(
             secret_code = secret_code,
             guesser_choice = guesser_choice,
             captain_prompt = captain_prompt,
-            guesser_prompt = guesser_prompt
+            guesser_prompt = guesser_prompt,
+            captain_usage = self._last_usage(team.captain),
+            guesser_usage = self._last_usage(team.guesser),
+            guesser_output = team.guesser.last_response.content if streamed else None,
+            guesser_stopped_early = team.guesser.stopped_early if streamed else None,
+            captain_samples = team.captain.samples,
+            guesser_samples = team.guesser.samples,
+            captain_agreement = team.captain.agreement,
+            guesser_agreement = team.guesser.agreement
         )
+
+    @staticmethod
+    def _last_usage(player: Player) -> CallUsage | None:
+        if player.last_response is None:
+            return None
+        return player.last_response.usage
             
     def _evaluate_guessed_words(self, guessed_words: List[str], team: Team):
-        opposite_team_color: Literal["red", "blue"] = team.get_opposite_team_color(team.color)
-        for word in guessed_words:
+        # Structured outputs may not enforce 'uniqueItems', so a word said again is skipped
+        for i, word in enumerate(guessed_words):
+            if is_repeated(word, guessed_words[:i]):
+                continue
             # TODO: save chosen word if previous word was correct: valid_words.append(word)
-
-            if word.lower() in self.board.left_team_words["black"]:
-                self.game_over = True
-                self.winner_team: Literal["red", "blue"] = opposite_team_color
+            if not self._evaluate_word(word, team):
                 break
 
-            elif word.lower() in self.board.left_team_words[team.color]:
-                self.board.remove_guessed_word(word.lower(), team.color)
-                self.game_history.append(
-                    f"""{team.color} team Guesser chooses the word '{word}' which belongs to the group '{team.color}'"""
-                )
-                if len(self.board.left_team_words[team.color]) == 0:
-                    self.game_over = True
-                    self.winner_team: Literal["red", "blue"] = team.color
-                    break
+    def _evaluate_word(self, word: str, team: Team) -> bool:
+        """
+        This method reveals a word said by the team's guesser.
 
-            elif word.lower() in self.board.left_team_words[opposite_team_color]:
-                self.board.remove_guessed_word(word.lower(), opposite_team_color)
-                self.game_history.append(
-                    f"""{team.color} team Guesser chooses the word '{word}' which belongs to the group '{opposite_team_color}'"""
-                )
-                break
-            
-            elif word.lower() in self.board.left_team_words["neutral"]:
-                self.board.remove_guessed_word(word.lower(), "neutral")
-                self.game_history.append(
-                    f"""{team.color} team Guesser chooses the word '{word}' which belongs to the group 'neutral'"""
+        Args:
+            word (str): Word said by the guesser.
+            team (Team): Team whose turn it is.
+        Return:
+            (bool) Whether the guesser can go on saying words.
+        """
+        # A black word loses the game, the last word of the team wins it, and an opponent's or
+        # neutral word ends the turn
+        self._apply(Guess(word))
+        return self.state.phase == "guess"
+        
+    def get_teams_data(self) -> Teams:
+        return Teams(
+            blue = TeamData(
+                captain = PlayerData(
+                    model_name = self.team_blue.captain.model_name,
+                    temperature = self.team_blue.captain.temperature,
+                    seed = self.team_blue.captain.seed
+                ),
+                guesser = PlayerData(
+                    model_name = self.team_blue.guesser.model_name,
+                    temperature = self.team_blue.guesser.temperature,
+                    seed = self.team_blue.guesser.seed
+                ),
+            ),
+            red = TeamData(
+                captain = PlayerData(
+                    model_name = self.team_red.captain.model_name,
+                    temperature = self.team_red.captain.temperature,
+                    seed = self.team_red.captain.seed
+                ),
+                guesser = PlayerData(
+                    model_name = self.team_red.guesser.model_name,
+                    temperature = self.team_red.guesser.temperature,
+                    seed = self.team_red.guesser.seed
                 )
-                break
-
-            else:
-                raise Exception("Guessed word does not exist")
+            ),
+        )
         
     def save_results(self, rounds_info: List[Round]) -> None:
         self.results = Results(
             words = self.board.team_words,
             team_order = [self.board.first_team_color, self.board.second_team_color],
-            teams = Teams(
-                blue = TeamData(
-                    captain = PlayerData(
-                        model_name = self.team_blue.captain.model_name,
-                        temperature = self.team_blue.captain.temperature,
-                        seed = self.team_blue.captain.seed
-                    ),
-                    guesser = PlayerData(
-                        model_name = self.team_blue.guesser.model_name,
-                        temperature = self.team_blue.guesser.temperature,
-                        seed = self.team_blue.guesser.seed
-                    ),
-                ),
-                red = TeamData(
-                    captain = PlayerData(
-                        model_name = self.team_red.captain.model_name,
-                        temperature = self.team_red.captain.temperature,
-                        seed = self.team_red.captain.seed
-                    ),
-                    guesser = PlayerData(
-                        model_name = self.team_red.guesser.model_name,
-                        temperature = self.team_red.guesser.temperature,
-                        seed = self.team_red.guesser.seed
-                    )
-                ),
-            ),
+            teams = self.get_teams_data(),
             num_rounds = self.round,
             rounds_info = rounds_info,
             winner_team = self.winner_team
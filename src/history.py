@@ -0,0 +1,80 @@
+from typing import List, Dict, Callable, Iterator, Literal
+import re
+
+from src.schemas import HistoryEvent, RoundStartEvent, CodeGivenEvent, WordRevealedEvent
+
+
+HistoryView = Literal["captain", "guesser"]
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def count_tokens(text: str) -> int:
+    """
+    Cheap approximation of the number of tokens of a text (words and punctuation marks).
+    """
+    return len(_TOKEN_PATTERN.findall(text))
+
+
+class GameHistory:
+    """
+    Append-only record of the game events. Every view of the history (what the captains and
+    the guessers are shown) is rendered incrementally: each event is formatted once when it is
+    appended and the rendered text is only extended, never rebuilt. The number of tokens of each
+    view is kept up to date as well, so context budgets can be checked without re-tokenizing.
+    """
+
+    views: tuple[HistoryView, ...] = ("captain", "guesser")
+    events: List[HistoryEvent]
+
+    def __init__(self, token_counter: Callable[[str], int] = count_tokens):
+        self.token_counter: Callable[[str], int] = token_counter
+        self.events: List[HistoryEvent] = []
+        self._lines: Dict[HistoryView, List[str]] = {view: [] for view in self.views}
+        self._tokens: Dict[HistoryView, int] = {view: 0 for view in self.views}
+        self._text: Dict[HistoryView, str] = {view: "" for view in self.views}
+        self._rendered_lines: Dict[HistoryView, int] = {view: 0 for view in self.views}
+        return
+
+    @staticmethod
+    def format_event(event: HistoryEvent, view: HistoryView) -> str:
+        if isinstance(event, RoundStartEvent):
+            return f"\n**Round {event.round}**"
+        if isinstance(event, CodeGivenEvent):
+            return f"""Team {event.team} turn.
+            Captain said the following secret code: {event.word}, {event.number}."""
+        if isinstance(event, WordRevealedEvent):
+            return f"""{event.team} team Guesser chooses the word '{event.word}' which belongs to the group '{event.group}'"""
+        raise ValueError(f"Unknown history event: {event}")
+
+    def append(self, event: HistoryEvent) -> None:
+        self.events.append(event)
+        for view in self.views:
+            line = self.format_event(event, view)
+            self._lines[view].append(line)
+            self._tokens[view] += self.token_counter(line)
+        return
+
+    def render(self, view: HistoryView = "guesser") -> str:
+        lines = self._lines[view]
+        rendered_lines = self._rendered_lines[view]
+        if rendered_lines < len(lines):
+            new_text = "\n".join(lines[rendered_lines:])
+            self._text[view] = new_text if rendered_lines == 0 else self._text[view] + "\n" + new_text
+            self._rendered_lines[view] = len(lines)
+        return self._text[view]
+
+    def num_tokens(self, view: HistoryView = "guesser") -> int:
+        return self._tokens[view]
+
+    def lines(self, view: HistoryView = "guesser") -> List[str]:
+        return list(self._lines[view])
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def __iter__(self) -> Iterator[HistoryEvent]:
+        return iter(self.events)
+
+    def __str__(self) -> str:
+        return self.render()
@@ -1,7 +1,11 @@
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any
-from langchain_ollama import ChatOllama
-from src.schemas import LLMMessage, ToolCall
+from typing import List, Dict, Any, Iterator, AsyncIterator
+import asyncio
+import json
+import time
+from src import metrics
+from src.registry import ModelRegistry, get_default_registry
+from src.schemas import LLMMessage, ToolCall, CallUsage, ResponseFormat
 
 
 class LLMModel(ABC):
@@ -42,6 +46,184 @@ class LLMModel(ABC):
         """
         pass
 
+    async def achat(
+            self,
+            messages: List[Dict[str, str]]
+        ) -> LLMMessage:
+        """
+        Async version of 'chat'. By default it runs 'chat' in a worker thread, so it should be
+        overwritten by models whose provider has a native async client.
+        """
+        return await asyncio.to_thread(self.chat, messages)
+
+    def chat_batch(
+            self,
+            batch: List[List[Dict[str, str]]]
+        ) -> List[LLMMessage]:
+        """
+        Gets a response for each list of messages of the batch. By default the calls are made
+        one after the other, so it should be overwritten by models whose provider can process
+        several prompts at once.
+        """
+        return [self.chat(messages) for messages in batch]
+
+    def chat_structured(
+            self,
+            messages: List[Dict[str, str]],
+            response_format: ResponseFormat
+        ) -> LLMMessage:
+        """
+        Gets a response constrained to the JSON schema of 'response_format', returned as a call
+        to the tool 'response_format["name"]'. By default the schema is ignored and 'chat' is
+        used, so it should be overwritten by models whose provider supports structured outputs.
+        """
+        return self.chat(messages)
+
+    async def achat_structured(
+            self,
+            messages: List[Dict[str, str]],
+            response_format: ResponseFormat
+        ) -> LLMMessage:
+        """
+        Async version of 'chat_structured'.
+        """
+        return await asyncio.to_thread(self.chat_structured, messages, response_format)
+
+    @staticmethod
+    def _as_delta(response: LLMMessage) -> LLMMessage:
+        content = response.content
+        if response.tool_call is not None:
+            content = json.dumps(response.tool_call.args)
+        return LLMMessage(model_name=response.model_name, content=content, tool_call=None, usage=response.usage)
+
+    def stream_structured(
+            self,
+            messages: List[Dict[str, str]],
+            response_format: ResponseFormat
+        ) -> Iterator[LLMMessage]:
+        """
+        Streams the JSON of a 'chat_structured' response as it is generated. Each LLMMessage holds
+        the new piece of 'content', and the last one the usage of the call. Closing the iterator
+        stops the generation. By default the whole response is yielded at once, so it should be
+        overwritten by models whose provider can stream.
+        """
+        yield self._as_delta(self.chat_structured(messages, response_format))
+
+    async def astream_structured(
+            self,
+            messages: List[Dict[str, str]],
+            response_format: ResponseFormat
+        ) -> AsyncIterator[LLMMessage]:
+        """
+        Async version of 'stream_structured'.
+        """
+        yield self._as_delta(await self.achat_structured(messages, response_format))
+
+
+class LLMModelWrapper(LLMModel):
+    """
+    Base class for models that add behaviour on top of another LLMModel (caching, concurrency
+    limits...). It exposes the same model_name, temperature, tools and seed as the wrapped model.
+    """
+
+    def __init__(self, model: LLMModel):
+        self.model: LLMModel = model
+        super().__init__(model.model_name, model.temperature, model.tools, model.seed)
+
+    def build_model(self) -> Any:
+        return self.model
+
+    def chat(
+            self,
+            messages: List[Dict[str, str]]
+        ) -> LLMMessage:
+        return self.model.chat(messages)
+
+    async def achat(
+            self,
+            messages: List[Dict[str, str]]
+        ) -> LLMMessage:
+        return await self.model.achat(messages)
+
+    def chat_batch(
+            self,
+            batch: List[List[Dict[str, str]]]
+        ) -> List[LLMMessage]:
+        return self.model.chat_batch(batch)
+
+    def chat_structured(
+            self,
+            messages: List[Dict[str, str]],
+            response_format: ResponseFormat
+        ) -> LLMMessage:
+        return self.model.chat_structured(messages, response_format)
+
+    async def achat_structured(
+            self,
+            messages: List[Dict[str, str]],
+            response_format: ResponseFormat
+        ) -> LLMMessage:
+        return await self.model.achat_structured(messages, response_format)
+
+    def stream_structured(
+            self,
+            messages: List[Dict[str, str]],
+            response_format: ResponseFormat
+        ) -> Iterator[LLMMessage]:
+        return self.model.stream_structured(messages, response_format)
+
+    def astream_structured(
+            self,
+            messages: List[Dict[str, str]],
+            response_format: ResponseFormat
+        ) -> AsyncIterator[LLMMessage]:
+        return self.model.astream_structured(messages, response_format)
+
+
+class ConcurrencyLimitedLLMModel(LLMModelWrapper):
+    """
+    Limits the number of concurrent async calls sent to the wrapped model.
+    The semaphore can be shared by several wrappers pointing to the same backend. With
+    'limit_chat' False the 'achat' calls are not limited here, e.g. when the wrapped model is a
+    BatchedLLMModel, which limits its batches instead.
+    """
+
+    def __init__(self, model: LLMModel, semaphore: asyncio.Semaphore, limit_chat: bool = True):
+        super().__init__(model)
+        self.semaphore: asyncio.Semaphore = semaphore
+        self.limit_chat: bool = limit_chat
+
+    async def achat(
+            self,
+            messages: List[Dict[str, str]]
+        ) -> LLMMessage:
+        if not self.limit_chat:
+            return await self.model.achat(messages)
+        async with self.semaphore:
+            return await self.model.achat(messages)
+
+    async def achat_structured(
+            self,
+            messages: List[Dict[str, str]],
+            response_format: ResponseFormat
+        ) -> LLMMessage:
+        async with self.semaphore:
+            return await self.model.achat_structured(messages, response_format)
+
+    async def astream_structured(
+            self,
+            messages: List[Dict[str, str]],
+            response_format: ResponseFormat
+        ) -> AsyncIterator[LLMMessage]:
+        # The slot is held until the stream is exhausted or closed
+        async with self.semaphore:
+            stream = self.model.astream_structured(messages, response_format)
+            try:
+                async for delta in stream:
+                    yield delta
+            finally:
+                await stream.aclose()
+
 
 class ChatOllamaLLMModel(LLMModel):
 
@@ -50,19 +232,42 @@ class ChatOllamaLLMModel(LLMModel):
             model_name: str,
             temperature: float = 0.1,
             tools: List = [],
-            seed: int | None = None
+            seed: int | None = None,
+            base_url: str | None = None,
+            registry: ModelRegistry | None = None,
+            timeout: float | None = None
         ):
+        # Ollama server to use, None for the default host (or the OLLAMA_HOST variable)
+        self.base_url: str | None = base_url
+        # Seconds a request waits for the server before it is closed, None for no limit
+        self.timeout: float | None = timeout
+        # Clients are shared by all the models of the registry (the process' one by default)
+        self.registry: ModelRegistry = registry if registry is not None else get_default_registry()
         super().__init__(model_name, temperature, tools, seed)
+        # Same client without tools, for the calls whose output follows a JSON schema
+        self._structured_model: Any = self.registry.get_model(
+            model_name=self.model_name,
+            temperature=self.temperature,
+            tools=[],
+            seed=self.seed,
+            base_url=self.base_url,
+            timeout=self.timeout
+        )
         
     def build_model(self) -> Any:
         """
         This method should be changed to create an instance of the LLM you will use.
-        For the moment, it makes use of 'langchain_ollama.ChatOllama' class.
+        For the moment, it makes use of 'langchain_ollama.ChatOllama' class, shared through
+        a ModelRegistry.
         """
-        return ChatOllama(
-            model=self.model_name, 
-            temperature=self.temperature
-        ).bind_tools(self.tools)
+        return self.registry.get_model(
+            model_name=self.model_name, 
+            temperature=self.temperature,
+            tools=self.tools,
+            seed=self.seed,
+            base_url=self.base_url,
+            timeout=self.timeout
+        )
     
     def chat(
             self,
@@ -75,16 +280,176 @@ class ChatOllamaLLMModel(LLMModel):
 
         # The LLM call should be alligned with the provider used
         # In this case, we use .invoke() because it corresponds to ChatOllama class
+        start = time.perf_counter()
         llm_response = self._model.invoke(messages)
+        return self._to_llm_message(llm_response, time.perf_counter() - start)
 
-        ai_msg = LLMMessage(
+    async def achat(
+            self,
+            messages: List[Dict[str, str]]
+        ) -> LLMMessage:
+        """
+        Same as 'chat' but using ChatOllama's async client.
+        """
+        start = time.perf_counter()
+        llm_response = await self._model.ainvoke(messages)
+        return self._to_llm_message(llm_response, time.perf_counter() - start)
+
+    def chat_batch(
+            self,
+            batch: List[List[Dict[str, str]]]
+        ) -> List[LLMMessage]:
+        """
+        Sends the whole batch at once, so that the server can process the prompts in parallel
+        (e.g. Ollama's OLLAMA_NUM_PARALLEL slots).
+        """
+        start = time.perf_counter()
+        llm_responses = self._model.batch(batch, config={"max_concurrency": len(batch)})
+        latency = time.perf_counter() - start
+        return [self._to_llm_message(llm_response, latency) for llm_response in llm_responses]
+
+    def chat_structured(
+            self,
+            messages: List[Dict[str, str]],
+            response_format: ResponseFormat
+        ) -> LLMMessage:
+        """
+        Sends the schema as Ollama's 'format', so the model can only generate JSON that follows
+        it (e.g. only words of the board), and parses the content as the tool call.
+        """
+        start = time.perf_counter()
+        llm_response = self._structured_model.invoke(messages, format=response_format["schema"])
+        return self._to_llm_message(llm_response, time.perf_counter() - start, response_format)
+
+    async def achat_structured(
+            self,
+            messages: List[Dict[str, str]],
+            response_format: ResponseFormat
+        ) -> LLMMessage:
+        start = time.perf_counter()
+        llm_response = await self._structured_model.ainvoke(messages, format=response_format["schema"])
+        return self._to_llm_message(llm_response, time.perf_counter() - start, response_format)
+
+    def _to_delta(self, chunk: Any, start: float) -> LLMMessage:
+        # Only the last chunk of Ollama's stream ('done') carries the token counts and durations
+        done = (getattr(chunk, "response_metadata", None) or {}).get("done", False)
+        return LLMMessage(
             model_name = self.model_name,
-            content = llm_response.content if len(llm_response.content) > 0 else None,
+            content = chunk.content,
+            tool_call = None,
+            usage = self._get_usage(chunk, time.perf_counter() - start) if done else None
+        )
+
+    def _observe_stream(self, deltas: List[LLMMessage], start: float) -> None:
+        # A stream closed before the end has no usage: its chunks are counted as the tokens generated
+        usage = deltas[-1].usage if deltas and deltas[-1].usage is not None else CallUsage(
+            completion_tokens=len(deltas), latency=time.perf_counter() - start
+        )
+        metrics.observe_call(LLMMessage(
+            model_name=self.model_name,
+            content="".join(d.content or "" for d in deltas),
+            tool_call=None,
+            usage=usage
+        ))
+        return
+
+    def stream_structured(
+            self,
+            messages: List[Dict[str, str]],
+            response_format: ResponseFormat
+        ) -> Iterator[LLMMessage]:
+        start = time.perf_counter()
+        deltas: List[LLMMessage] = []
+        stream = self._structured_model.stream(messages, format=response_format["schema"])
+        try:
+            for chunk in stream:
+                deltas.append(self._to_delta(chunk, start))
+                yield deltas[-1]
+        finally:
+            # Closing the request makes the server stop generating
+            stream.close()
+            self._observe_stream(deltas, start)
+
+    async def astream_structured(
+            self,
+            messages: List[Dict[str, str]],
+            response_format: ResponseFormat
+        ) -> AsyncIterator[LLMMessage]:
+        start = time.perf_counter()
+        deltas: List[LLMMessage] = []
+        chunks: asyncio.Queue = asyncio.Queue()
+
+        async def produce() -> None:
+            # Closing langchain's async stream doesn't close the request, cancelling its task does
+            try:
+                async for chunk in self._structured_model.astream(messages, format=response_format["schema"]):
+                    chunks.put_nowait(chunk)
+            except Exception as e:
+                chunks.put_nowait(e)
+                return
+            chunks.put_nowait(None)
+
+        producer = asyncio.create_task(produce())
+        try:
+            while (chunk := await chunks.get()) is not None:
+                if isinstance(chunk, Exception):
+                    raise chunk
+                deltas.append(self._to_delta(chunk, start))
+                yield deltas[-1]
+        finally:
+            producer.cancel()
+            await asyncio.gather(producer, return_exceptions=True)
+            self._observe_stream(deltas, start)
+
+    @staticmethod
+    def _get_usage(llm_response: Any, latency: float | None) -> CallUsage:
+        # Ollama reports its durations in nanoseconds
+        metadata = getattr(llm_response, "response_metadata", None) or {}
+
+        def seconds(key: str) -> float | None:
+            return metadata[key] / 1e9 if metadata.get(key) is not None else None
+        return CallUsage(
+            prompt_tokens = metadata.get("prompt_eval_count"),
+            completion_tokens = metadata.get("eval_count"),
+            load_duration = seconds("load_duration"),
+            prompt_eval_duration = seconds("prompt_eval_duration"),
+            eval_duration = seconds("eval_duration"),
+            total_duration = seconds("total_duration"),
+            latency = latency
+        )
+
+    @staticmethod
+    def _parse_structured(content: str, response_format: ResponseFormat) -> ToolCall | None:
+        try:
+            args = json.loads(content)
+        except json.JSONDecodeError:
+            return None
+        if not isinstance(args, dict):
+            return None
+        return ToolCall(tool_name=response_format["name"], args=args)
+
+    def _to_llm_message(
+            self,
+            llm_response: Any,
+            latency: float | None = None,
+            response_format: ResponseFormat | None = None
+        ) -> LLMMessage:
+        if response_format is not None:
+            tool_call = self._parse_structured(llm_response.content, response_format)
+        elif len(llm_response.tool_calls) > 0:
             tool_call = ToolCall(
                 tool_name = llm_response.tool_calls[0]["name"],
                 args = llm_response.tool_calls[0]["args"]
-            ) if len(llm_response.tool_calls) > 0 else None
+            )
+        else:
+            tool_call = None
+        ai_msg = LLMMessage(
+            model_name = self.model_name,
+            content = llm_response.content if len(llm_response.content) > 0 else None,
+            tool_call = tool_call,
+            usage = self._get_usage(llm_response, latency)
         )
+        metrics.observe_call(ai_msg)
         return ai_msg
     
 
@@ -133,4 +498,45 @@ class HumanLLMModel(LLMModel):
                 args = args
             )
         )
-        return ai_msg
\ No newline at end of file
+        return ai_msg
+
+class ReplayLLMModel(LLMModel):
+    """
+    Model that answers with previously recorded tool calls, in order, without calling any LLM.
+    It is used to re-execute saved games (see 'SecretCodeGame.replay').
+    """
+
+    def __init__(
+            self,
+            model_name: str,
+            tool_calls: List[ToolCall],
+            temperature: float = 0.1,
+            tools: List = [],
+            seed: int | None = None
+    ):
+        self.tool_calls: List[ToolCall] = list(tool_calls)
+        self.position: int = 0
+        super().__init__(model_name, temperature, tools, seed)
+
+    def build_model(self) -> Any:
+        return None
+
+    def chat(
+            self,
+            messages: List[Dict[str, str]]
+        ) -> LLMMessage:
+        if self.position >= len(self.tool_calls):
+            raise Exception(f"No recorded tool calls left to replay for model '{self.model_name}'")
+        tool_call = self.tool_calls[self.position]
+        self.position += 1
+        return LLMMessage(
+            model_name = self.model_name,
+            content = None,
+            tool_call = tool_call
+        )
+
+    async def achat(
+            self,
+            messages: List[Dict[str, str]]
+        ) -> LLMMessage:
+        return self.chat(messages)
@@ -0,0 +1,408 @@
+from typing import List, Dict, Any, Iterator, AsyncIterator, Callable, Awaitable, Iterable
+import threading
+import time
+
+from src.llm_wrapper import LLMModel, ChatOllamaLLMModel
+from src.registry import ModelRegistry, get_default_registry
+from src.schemas import LLMMessage, ResponseFormat
+
+
+class Endpoint:
+    """
+    State and usage of one inference server of an EndpointPool.
+    """
+
+    base_url: str
+    healthy: bool
+    outstanding: int
+    loaded_models: set[str]
+
+    def __init__(self, base_url: str):
+        self.base_url: str = base_url
+        self.healthy: bool = True
+        # After a failure the endpoint is skipped until this time (time.monotonic)
+        self.retry_at: float = 0.0
+        # Requests sent and not answered yet
+        self.outstanding: int = 0
+        # Models the server has in memory, from its '/api/ps' and the calls answered
+        self.loaded_models: set[str] = set()
+        self.requests: int = 0
+        self.failures: int = 0
+        self.prompt_tokens: int = 0
+        self.completion_tokens: int = 0
+        self.load_duration: float = 0.0
+        self.busy_time: float = 0.0
+        return
+
+    def available(self, now: float) -> bool:
+        return self.healthy or now >= self.retry_at
+
+    def stats(self) -> Dict[str, Any]:
+        answered = self.requests - self.failures - self.outstanding
+        return {
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "mean_latency": self.busy_time / answered if answered > 0 else None,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "load_duration": self.load_duration,
+            "loaded_models": sorted(self.loaded_models)
+        }
+
+
+class EndpointPool:
+    """
+    Set of inference servers shared by all the LoadBalancedLLMModel of a process (see
+    'get_endpoint_pool'). Each request goes to the available server with the lowest score: its
+    outstanding requests, plus 'unloaded_penalty' if the model isn't loaded there. Servers that
+    already hold the model are preferred until they are that much busier than the others, so a
+    model spreads to more servers only when its load requires it. A server whose request fails
+    is skipped for 'retry_after' seconds; a background thread checks every 'health_interval'
+    seconds which servers answer and which models they have loaded ('/api/ps').
+    """
+
+    endpoints: List[Endpoint]
+    unloaded_penalty: float
+    retry_after: float
+    health_interval: float
+    health_timeout: float
+
+    def __init__(
+            self,
+            base_urls: Iterable[str],
+            unloaded_penalty: float = 2.0,
+            retry_after: float = 5.0,
+            health_interval: float = 10.0,
+            health_timeout: float = 2.0
+        ):
+        """
+        Args:
+            base_urls (Iterable[str]): URLs of the servers.
+            unloaded_penalty (float): Outstanding requests a server holding the model can have
+                above a server that doesn't before the latter is chosen.
+            retry_after (float): Seconds a server that failed is skipped.
+            health_interval (float): Seconds between health checks, 0 to disable them.
+            health_timeout (float): Timeout of a health check request.
+        """
+        self.endpoints: List[Endpoint] = [Endpoint(url) for url in dict.fromkeys(base_urls)]
+        if not self.endpoints:
+            raise Exception("At least one endpoint is needed")
+        self.unloaded_penalty: float = unloaded_penalty
+        self.retry_after: float = retry_after
+        self.health_interval: float = health_interval
+        self.health_timeout: float = health_timeout
+        self._lock: threading.Lock = threading.Lock()
+        self._monitor: threading.Thread | None = None
+        return
+
+    def check(self, endpoint: Endpoint) -> bool:
+        """
+        Asks the server for the models it has loaded. Return whether it answered.
+        """
+        from ollama import Client
+
+        try:
+            response = Client(host=endpoint.base_url, timeout=self.health_timeout).ps()
+            loaded = {model.get("model") or model.get("name") for model in response.get("models", [])}
+        except Exception:
+            with self._lock:
+                self._mark_failed(endpoint)
+            return False
+        with self._lock:
+            endpoint.healthy = True
+            endpoint.loaded_models = loaded
+        return True
+
+    def refresh(self) -> Dict[str, bool]:
+        return {endpoint.base_url: self.check(endpoint) for endpoint in self.endpoints}
+
+    def _monitor_loop(self) -> None:
+        while True:
+            self.refresh()
+            time.sleep(self.health_interval)
+
+    def _mark_failed(self, endpoint: Endpoint) -> None:
+        endpoint.healthy = False
+        endpoint.retry_at = time.monotonic() + self.retry_after
+        return
+
+    def acquire(self, model_name: str, exclude: Iterable[Endpoint] = ()) -> Endpoint | None:
+        """
+        This method chooses the server of a request and counts the request as outstanding there.
+
+        Args:
+            model_name (str): Model of the request.
+            exclude (Iterable[Endpoint]): Servers that already failed this request.
+        Return:
+            (Endpoint | None) The server, or None if every server was excluded. If no server is
+            available, the least busy not excluded one is returned.
+        """
+        with self._lock:
+            if self._monitor is None and self.health_interval > 0:
+                self._monitor = threading.Thread(target=self._monitor_loop, daemon=True)
+                self._monitor.start()
+            excluded = set(map(id, exclude))
+            candidates = [e for e in self.endpoints if id(e) not in excluded]
+            now = time.monotonic()
+            candidates = [e for e in candidates if e.available(now)] or candidates
+            if not candidates:
+                return None
+            endpoint = min(candidates, key=lambda e: (
+                e.outstanding + (0.0 if model_name in e.loaded_models else self.unloaded_penalty),
+                e.requests
+            ))
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+        return endpoint
+
+    def release(
+            self,
+            endpoint: Endpoint,
+            model_name: str,
+            responses: List[LLMMessage] | None,
+            latency: float
+        ) -> None:
+        """
+        Records the end of a request: its responses, or None if it failed.
+        """
+        with self._lock:
+            endpoint.outstanding -= 1
+            if responses is None:
+                endpoint.failures += 1
+                self._mark_failed(endpoint)
+                return
+            endpoint.healthy = True
+            endpoint.busy_time += latency
+            # Answering loaded the model in the server
+            endpoint.loaded_models.add(model_name)
+            for response in responses:
+                usage = response.usage
+                if usage is None:
+                    continue
+                endpoint.prompt_tokens += usage.prompt_tokens or 0
+                endpoint.completion_tokens += usage.completion_tokens or 0
+                endpoint.load_duration += usage.load_duration or 0.0
+        return
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {endpoint.base_url: endpoint.stats() for endpoint in self.endpoints}
+
+    def report(self) -> str:
+        lines = []
+        for base_url, stats in self.stats().items():
+            lines.append(
+                f"{base_url}: {'up' if stats['healthy'] else 'down'}, {stats['requests']} requests, "
+                f"{stats['failures']} failed, {stats['completion_tokens']} tokens generated"
+                + (f", {stats['mean_latency']:.3f}s mean latency" if stats["mean_latency"] is not None else "")
+            )
+        return "\n".join(lines)
+
+
+_endpoint_pools: Dict[tuple[str, ...], EndpointPool] = {}
+_endpoint_pools_lock: threading.Lock = threading.Lock()
+
+
+def get_endpoint_pool(base_urls: Iterable[str]) -> EndpointPool:
+    """
+    Returns the process' pool of these servers, so all the models using them share their counts.
+    """
+    key = tuple(dict.fromkeys(base_urls))
+    with _endpoint_pools_lock:
+        if key not in _endpoint_pools:
+            _endpoint_pools[key] = EndpointPool(key)
+        return _endpoint_pools[key]
+
+
+class LoadBalancedLLMModel(LLMModel):
+    """
+    Ollama model served by several servers. Every call is sent to the server chosen by the
+    EndpointPool, through a ChatOllamaLLMModel bound to that server. A call that fails is sent
+    to another server, up to 'max_attempts' servers. In a tournament with worker processes each
+    process balances its own requests.
+    """
+
+    pool: EndpointPool
+    max_attempts: int
+
+    def __init__(
+            self,
+            model_name: str,
+            temperature: float = 0.1,
+            tools: List = [],
+            seed: int | None = None,
+            endpoints: List[str] | EndpointPool = [],
+            registry: ModelRegistry | None = None,
+            max_attempts: int | None = None,
+            timeout: float | None = None
+        ):
+        """
+        Args:
+            endpoints (List[str] | EndpointPool): URLs of the servers, or the pool to use.
+            registry (ModelRegistry | None): Registry of the clients, the process' one by default.
+            max_attempts (int | None): Servers a call is tried on, all of them by default.
+            timeout (float | None): Seconds a request waits for a server before it fails.
+        """
+        self.pool: EndpointPool = endpoints if isinstance(endpoints, EndpointPool) else get_endpoint_pool(endpoints)
+        self.registry: ModelRegistry = registry if registry is not None else get_default_registry()
+        self.max_attempts: int = max_attempts or len(self.pool.endpoints)
+        self.timeout: float | None = timeout
+        super().__init__(model_name, temperature, tools, seed)
+
+    def build_model(self) -> Dict[str, ChatOllamaLLMModel]:
+        """
+        Models of the servers, created on their first call.
+        """
+        return {}
+
+    def _endpoint_model(self, endpoint: Endpoint) -> ChatOllamaLLMModel:
+        if endpoint.base_url not in self._model:
+            self._model[endpoint.base_url] = ChatOllamaLLMModel(
+                model_name=self.model_name,
+                temperature=self.temperature,
+                tools=self.tools,
+                seed=self.seed,
+                base_url=endpoint.base_url,
+                registry=self.registry,
+                timeout=self.timeout
+            )
+        return self._model[endpoint.base_url]
+
+    def _acquire(self, failed: List[Endpoint], error: Exception | None) -> Endpoint:
+        endpoint = self.pool.acquire(self.model_name, failed) if len(failed) < self.max_attempts else None
+        if endpoint is None:
+            raise error if error is not None else Exception("No endpoint available")
+        return endpoint
+
+    def _call(self, call: Callable[[ChatOllamaLLMModel], Any]) -> Any:
+        failed: List[Endpoint] = []
+        error: Exception | None = None
+        while True:
+            endpoint = self._acquire(failed, error)
+            start = time.perf_counter()
+            try:
+                response = call(self._endpoint_model(endpoint))
+            except Exception as e:
+                self.pool.release(endpoint, self.model_name, None, time.perf_counter() - start)
+                failed.append(endpoint)
+                error = e
+                continue
+            responses = response if isinstance(response, list) else [response]
+            self.pool.release(endpoint, self.model_name, responses, time.perf_counter() - start)
+            return response
+
+    async def _acall(self, call: Callable[[ChatOllamaLLMModel], Awaitable[LLMMessage]]) -> LLMMessage:
+        failed: List[Endpoint] = []
+        error: Exception | None = None
+        while True:
+            endpoint = self._acquire(failed, error)
+            start = time.perf_counter()
+            try:
+                response = await call(self._endpoint_model(endpoint))
+            except Exception as e:
+                self.pool.release(endpoint, self.model_name, None, time.perf_counter() - start)
+                failed.append(endpoint)
+                error = e
+                continue
+            except BaseException:
+                # Cancelled: the server didn't fail
+                self.pool.release(endpoint, self.model_name, [], time.perf_counter() - start)
+                raise
+            self.pool.release(endpoint, self.model_name, [response], time.perf_counter() - start)
+            return response
+
+    def chat(
+            self,
+            messages: List[Dict[str, str]]
+        ) -> LLMMessage:
+        return self._call(lambda model: model.chat(messages))
+
+    async def achat(
+            self,
+            messages: List[Dict[str, str]]
+        ) -> LLMMessage:
+        return await self._acall(lambda model: model.achat(messages))
+
+    def chat_batch(
+            self,
+            batch: List[List[Dict[str, str]]]
+        ) -> List[LLMMessage]:
+        return self._call(lambda model: model.chat_batch(batch))
+
+    def chat_structured(
+            self,
+            messages: List[Dict[str, str]],
+            response_format: ResponseFormat
+        ) -> LLMMessage:
+        return self._call(lambda model: model.chat_structured(messages, response_format))
+
+    async def achat_structured(
+            self,
+            messages: List[Dict[str, str]],
+            response_format: ResponseFormat
+        ) -> LLMMessage:
+        return await self._acall(lambda model: model.achat_structured(messages, response_format))
+
+    def stream_structured(
+            self,
+            messages: List[Dict[str, str]],
+            response_format: ResponseFormat
+        ) -> Iterator[LLMMessage]:
+        # Only a stream that fails before its first piece is sent to another server
+        failed: List[Endpoint] = []
+        error: Exception | None = None
+        while True:
+            endpoint = self._acquire(failed, error)
+            start = time.perf_counter()
+            deltas: List[LLMMessage] = []
+            stream = self._endpoint_model(endpoint).stream_structured(messages, response_format)
+            try:
+                for delta in stream:
+                    deltas.append(delta)
+                    yield delta
+            except Exception as e:
+                self.pool.release(endpoint, self.model_name, None, time.perf_counter() - start)
+                if deltas:
+                    raise
+                failed.append(endpoint)
+                error = e
+                continue
+            except BaseException:
+                # Closed by the caller
+                stream.close()
+                self.pool.release(endpoint, self.model_name, deltas, time.perf_counter() - start)
+                raise
+            self.pool.release(endpoint, self.model_name, deltas, time.perf_counter() - start)
+            return
+
+    async def astream_structured(
+            self,
+            messages: List[Dict[str, str]],
+            response_format: ResponseFormat
+        ) -> AsyncIterator[LLMMessage]:
+        failed: List[Endpoint] = []
+        error: Exception | None = None
+        while True:
+            endpoint = self._acquire(failed, error)
+            start = time.perf_counter()
+            deltas: List[LLMMessage] = []
+            stream = self._endpoint_model(endpoint).astream_structured(messages, response_format)
+            try:
+                async for delta in stream:
+                    deltas.append(delta)
+                    yield delta
+            except Exception as e:
+                self.pool.release(endpoint, self.model_name, None, time.perf_counter() - start)
+                if deltas:
+                    raise
+                failed.append(endpoint)
+                error = e
+                continue
+            except BaseException:
+                await stream.aclose()
+                self.pool.release(endpoint, self.model_name, deltas, time.perf_counter() - start)
+                raise
+            self.pool.release(endpoint, self.model_name, deltas, time.perf_counter() - start)
+            return
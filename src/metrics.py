@@ -0,0 +1,185 @@
+from typing import List, Dict, Tuple, Any
+import bisect
+import json
+import os
+import threading
+
+from src.schemas import LLMMessage, Results
+
+
+Labels = Tuple[Tuple[str, str], ...]
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+class Counter:
+
+    def __init__(self, name: str, help: str):
+        self.name: str = name
+        self.help: str = help
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, value: float = 1.0, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0.0) + value
+        return
+
+
+class Histogram:
+
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name: str = name
+        self.help: str = help
+        self.buckets: Tuple[float, ...] = tuple(sorted(buckets))
+        # Per labels: [count per bucket (+Inf last), sum, count]
+        self.values: Dict[Labels, List[Any]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        if key not in self.values:
+            self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        bucket_counts, _, _ = self.values[key]
+        bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.values[key][1] += value
+        self.values[key][2] += 1
+        return
+
+
+def _format_labels(labels: Labels, extra: Dict[str, str] | None = None) -> str:
+    items = list(labels) + list((extra or {}).items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+class MetricsHook:
+    """
+    Receives every LLMMessage produced by a model call (see 'set_metrics_hook').
+    """
+
+    def observe_call(self, message: LLMMessage) -> None:
+        pass
+
+
+class MetricsRegistry(MetricsHook):
+    """
+    In-process counters and histograms of the model calls, labelled by model name. They can be
+    exported in the Prometheus text format or as JSON.
+    """
+
+    def __init__(self):
+        self._lock: threading.Lock = threading.Lock()
+        self.calls = Counter("llm_calls_total", "Number of LLM calls")
+        self.prompt_tokens = Counter("llm_prompt_tokens_total", "Prompt tokens processed")
+        self.completion_tokens = Counter("llm_completion_tokens_total", "Tokens generated")
+        self.latency = Histogram("llm_call_latency_seconds", "Wall-clock latency of the LLM calls")
+        self.load_duration = Histogram("llm_load_duration_seconds", "Time spent loading the model")
+        self.prompt_eval_duration = Histogram(
+            "llm_prompt_eval_duration_seconds", "Time spent processing the prompt"
+        )
+        self.eval_duration = Histogram("llm_eval_duration_seconds", "Time spent generating")
+        self.metrics: List[Counter | Histogram] = [
+            self.calls,
+            self.prompt_tokens,
+            self.completion_tokens,
+            self.latency,
+            self.load_duration,
+            self.prompt_eval_duration,
+            self.eval_duration
+        ]
+
+    def observe_call(self, message: LLMMessage) -> None:
+        with self._lock:
+            self.calls.inc(model=message.model_name)
+            usage = message.usage
+            if usage is None:
+                return
+            for counter, value in [
+                (self.prompt_tokens, usage.prompt_tokens),
+                (self.completion_tokens, usage.completion_tokens)
+            ]:
+                if value is not None:
+                    counter.inc(value, model=message.model_name)
+            for histogram, value in [
+                (self.latency, usage.latency),
+                (self.load_duration, usage.load_duration),
+                (self.prompt_eval_duration, usage.prompt_eval_duration),
+                (self.eval_duration, usage.eval_duration)
+            ]:
+                if value is not None:
+                    histogram.observe(value, model=message.model_name)
+        return
+
+    def observe_results(self, results: Results) -> None:
+        """
+        Records the usage saved in a game's Results, for games played in other processes.
+        """
+        for round_info in results.rounds_info:
+            for team, team_data in [(results.teams.red, round_info.red_team), (results.teams.blue, round_info.blue_team)]:
+                for player, usage in [(team.captain, team_data.captain_usage), (team.guesser, team_data.guesser_usage)]:
+                    if usage is not None:
+                        self.observe_call(
+                            LLMMessage(model_name=player.model_name, content=None, tool_call=None, usage=usage)
+                        )
+        return
+
+    def to_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            for metric in self.metrics:
+                lines.append(f"# HELP {metric.name} {metric.help}")
+                if isinstance(metric, Counter):
+                    lines.append(f"# TYPE {metric.name} counter")
+                    for labels, value in metric.values.items():
+                        lines.append(f"{metric.name}{_format_labels(labels)} {value}")
+                    continue
+                lines.append(f"# TYPE {metric.name} histogram")
+                for labels, (bucket_counts, total, count) in metric.values.items():
+                    cumulative = 0
+                    for bound, bucket_count in zip(list(metric.buckets) + ["+Inf"], bucket_counts):
+                        cumulative += bucket_count
+                        bucket_labels = _format_labels(labels, {"le": str(bound)})
+                        lines.append(f"{metric.name}_bucket{bucket_labels} {cumulative}")
+                    lines.append(f"{metric.name}_sum{_format_labels(labels)} {total}")
+                    lines.append(f"{metric.name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                metric.name: [
+                    {"labels": dict(labels), "value": value} for labels, value in metric.values.items()
+                ]
+                for metric in self.metrics
+            }
+
+    def write(self, path: str) -> None:
+        """
+        Writes the metrics to a file, as JSON if it ends with '.json' or in the Prometheus text
+        format otherwise (e.g. for node_exporter's textfile collector).
+        """
+        content = json.dumps(self.to_dict(), indent=2) if path.endswith(".json") else self.to_prometheus()
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "w") as f:
+            f.write(content)
+        os.replace(temporary_path, path)
+        return
+
+
+_metrics_hook: MetricsHook | None = None
+
+
+def set_metrics_hook(hook: MetricsHook | None) -> None:
+    global _metrics_hook
+    _metrics_hook = hook
+    return
+
+
+def get_metrics_hook() -> MetricsHook | None:
+    return _metrics_hook
+
+
+def observe_call(message: LLMMessage) -> None:
+    if _metrics_hook is not None:
+        _metrics_hook.observe_call(message)
+    return
@@ -82,4 +82,35 @@ Your captain said in this round the following secret code:
 
 Now it´s your turn, let´s go, think which are your words according to your captain´s secret code!
 Note: Make use of the tools to choice your words.
-"""
\ No newline at end of file
+"""
+
+captain_thread_message = """
+New events in the game history:
+{game_history}
+
+Words revealed since your last turn (they are no longer in the board):
+{revealed_words}
+
+The rest of the words are the same as in your last turn.
+Now it´s your turn again, think of a new secret code!
+Note: Make use of the tools to indicate secret code.
+"""
+
+guesser_thread_message = """
+New events in the game history:
+{game_history}
+
+Words revealed since your last turn (they are no longer in the board):
+{revealed_words}
+
+Your captain said in this round the following secret code:
+{secret_code}
+
+Now it´s your turn again, think which are your words according to your captain´s secret code!
+Note: Make use of the tools to choice your words.
+"""
+
+invalid_tool_call_message = """
+Your answer didn´t use the tool {tool_name} with the arguments {required_args}.
+Answer again using the tool.
+"""
@@ -0,0 +1,110 @@
+from typing import List, Dict, Any, Iterable
+import threading
+import time
+
+
+class ModelRegistry:
+    """
+    Shares one ChatOllama client (and its HTTP connection pool) per (host, model) across all the
+    players and games of a process. Player specific parameters (tools, temperature, seed) are
+    bound on top of the shared client. Models are requested with a 'keep_alive' so the server
+    doesn't unload them between turns, and 'warmup' loads them before the first game starts.
+    """
+
+    keep_alive: int | str | None
+    load_times: Dict[tuple[str | None, str], Dict[str, float | None]]
+
+    def __init__(self, keep_alive: int | str | None = "30m"):
+        self.keep_alive: int | str | None = keep_alive
+        self.load_times: Dict[tuple[str | None, str], Dict[str, float | None]] = {}
+        self._clients: Dict[tuple[str | None, str, float | None], Any] = {}
+        self._bound_models: Dict[tuple, Any] = {}
+        self._lock: threading.RLock = threading.RLock()
+        return
+
+    def get_client(self, model_name: str, base_url: str | None = None, timeout: float | None = None) -> Any:
+        """
+        Returns the shared client of the model. With a 'timeout' (seconds) a request waiting longer
+        for the server is closed, which makes Ollama stop the generation.
+        """
+        from langchain_ollama import ChatOllama
+
+        key = (base_url, model_name, timeout)
+        with self._lock:
+            if key not in self._clients:
+                self._clients[key] = ChatOllama(
+                    model=model_name,
+                    base_url=base_url,
+                    keep_alive=self.keep_alive,
+                    client_kwargs={"timeout": timeout} if timeout is not None else {}
+                )
+            return self._clients[key]
+
+    def get_model(
+            self,
+            model_name: str,
+            temperature: float,
+            tools: List,
+            seed: int | None = None,
+            base_url: str | None = None,
+            timeout: float | None = None
+        ) -> Any:
+        """
+        Returns the shared client of the model bound to the given tools and sampling options.
+        """
+        tool_names = tuple(getattr(t, "name", getattr(t, "__name__", repr(t))) for t in tools)
+        key = (base_url, model_name, tool_names, temperature, seed, timeout)
+        with self._lock:
+            if key not in self._bound_models:
+                options: Dict[str, Any] = {"temperature": temperature}
+                if seed is not None:
+                    options["seed"] = seed
+                model = self.get_client(model_name, base_url, timeout)
+                if tools:
+                    model = model.bind_tools(tools)
+                self._bound_models[key] = model.bind(options=options)
+            return self._bound_models[key]
+
+    def warmup(self, model_names: Iterable[str], base_url: str | None = None) -> Dict[str, Dict[str, float | None]]:
+        """
+        Loads every model in the server (an empty generate request), so that the first turn of
+        the first game doesn't pay the model load time.
+
+        Return:
+            (Dict[str, Dict[str, float | None]]) Per model, the wall-clock time of the request and
+            the load duration reported by the server, in seconds.
+        """
+        from ollama import Client
+
+        client = Client(host=base_url)
+        times = {}
+        for model_name in dict.fromkeys(model_names):
+            start = time.perf_counter()
+            response = client.generate(model=model_name, prompt="", keep_alive=self.keep_alive)
+            load_duration = response.get("load_duration")
+            times[model_name] = {
+                "wall_time": time.perf_counter() - start,
+                "load_duration": load_duration / 1e9 if load_duration is not None else None
+            }
+            self.load_times[(base_url, model_name)] = times[model_name]
+        return times
+
+    def report(self) -> str:
+        lines = []
+        for (base_url, model_name), times in self.load_times.items():
+            load_duration = times["load_duration"]
+            lines.append(
+                f"{model_name} @ {base_url or 'default host'}: loaded in {times['wall_time']:.2f}s"
+                + (f" (server load_duration {load_duration:.2f}s)" if load_duration is not None else "")
+            )
+        return "\n".join(lines)
+
+
+_default_registry: ModelRegistry | None = None
+
+
+def get_default_registry() -> ModelRegistry:
+    global _default_registry
+    if _default_registry is None:
+        _default_registry = ModelRegistry()
+    return _default_registry
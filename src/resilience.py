@@ -0,0 +1,502 @@
+from typing import List, Dict, Any, Deque, Iterator, AsyncIterator, Callable, Awaitable
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+import asyncio
+import math
+import random
+import threading
+import time
+
+from src.llm_wrapper import LLMModel, LLMModelWrapper
+from src.load_balancer import LoadBalancedLLMModel
+from src.prompts import invalid_tool_call_message
+from src.schemas import LLMMessage, ResponseFormat
+from src.tools import REQUIRED_ARGS
+
+
+class LatencyTracker:
+    """
+    Latencies of the last 'window' answered calls of each model, which set the hedging delay of
+    the ResilientLLMModel using it, and the counts of their timeouts, retries and hedged requests.
+    One tracker is shared by all the models of a process by default (see 'get_latency_tracker').
+    """
+
+    window: int
+
+    def __init__(self, window: int = 1000):
+        self.window: int = window
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._counts: Dict[str, Dict[str, int]] = {}
+        self._lock: threading.Lock = threading.Lock()
+        return
+
+    def observe(self, model_name: str, latency: float) -> None:
+        with self._lock:
+            self._latencies.setdefault(model_name, deque(maxlen=self.window)).append(latency)
+            self._count(model_name, "calls")
+        return
+
+    def _count(self, model_name: str, event: str) -> None:
+        counts = self._counts.setdefault(model_name, {})
+        counts[event] = counts.get(event, 0) + 1
+        return
+
+    def count(self, model_name: str, event: str) -> None:
+        with self._lock:
+            self._count(model_name, event)
+        return
+
+    def get_count(self, model_name: str, event: str) -> int:
+        with self._lock:
+            return self._counts.get(model_name, {}).get(event, 0)
+
+    def percentile(self, model_name: str, q: float, min_samples: int = 1) -> float | None:
+        """
+        This method returns the 'q' percentile (0-100, nearest rank) of the recent latencies of a
+        model.
+
+        Args:
+            model_name (str): Name of the model.
+            q (float): Percentile.
+            min_samples (int): Latencies needed for the percentile to be meaningful.
+        Return:
+            (float | None) The latency in seconds, None if there are less than 'min_samples'.
+        """
+        with self._lock:
+            latencies = sorted(self._latencies.get(model_name, ()))
+        if not latencies or len(latencies) < min_samples:
+            return None
+        rank = max(math.ceil(q / 100 * len(latencies)), 1)
+        return latencies[min(rank, len(latencies)) - 1]
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            models = sorted(set(self._latencies) | set(self._counts))
+            counts = {model_name: dict(self._counts.get(model_name, {})) for model_name in models}
+        stats = {}
+        for model_name in models:
+            stats[model_name] = {
+                "calls": counts[model_name].get("calls", 0),
+                "p50": self.percentile(model_name, 50),
+                "p90": self.percentile(model_name, 90),
+                "p99": self.percentile(model_name, 99),
+                **{
+                    event: counts[model_name].get(event, 0)
+                    for event in ["timeouts", "errors", "invalid", "retries", "hedges", "hedge_wins"]
+                }
+            }
+        return stats
+
+    def report(self) -> str:
+        def seconds(value: float | None) -> str:
+            return f"{value:.2f}s" if value is not None else "-"
+
+        lines = ["Call latencies:"]
+        for model_name, stats in self.stats().items():
+            lines.append(
+                f"  {model_name}: {stats['calls']} calls, p50 {seconds(stats['p50'])}, "
+                f"p90 {seconds(stats['p90'])}, p99 {seconds(stats['p99'])}, "
+                f"{stats['timeouts']} timeouts, {stats['errors']} errors, {stats['invalid']} invalid answers, "
+                f"{stats['retries']} retries, {stats['hedges']} hedged ({stats['hedge_wins']} won by the hedge)"
+            )
+        return "\n".join(lines)
+
+
+_latency_tracker: LatencyTracker | None = None
+
+
+def get_latency_tracker() -> LatencyTracker:
+    global _latency_tracker
+    if _latency_tracker is None:
+        _latency_tracker = LatencyTracker()
+    return _latency_tracker
+
+
+class ResilientLLMModel(LLMModelWrapper):
+    """
+    Bounds the latency of the calls of the wrapped model. Every attempt of a call must be
+    answered within 'timeout' seconds, otherwise it is cancelled, and a failed attempt, or one
+    whose answer doesn't call the expected tool with its arguments, is retried up to
+    'max_attempts' times with exponential backoff. Retries of invalid answers add a message
+    asking the model to use the tool, so that a seeded model doesn't repeat the same answer.
+
+    With a 'hedge_percentile', an attempt still unanswered after that percentile of the recent
+    latencies of the model is sent again to 'hedge_model' and the first answer is kept. Without
+    a 'hedge_model' only a LoadBalancedLLMModel is hedged, to its least busy server, as sending
+    the request again to a single busy server only makes it slower. Hedging starts once
+    'min_samples' latencies were observed, and at most 'max_hedge_ratio' of the calls are hedged.
+
+    Async attempts are cancelled, which closes their requests. Sync attempts run in worker
+    threads: the caller stops waiting at the deadline, and the request itself is closed by the
+    client timeout of the model (see ChatOllamaLLMModel's 'timeout'). Streams are only bounded
+    and retried until their first piece arrives. A batch is bounded as a whole, and the items
+    it doesn't answer in time, or answers without the tool, are retried one by one.
+    """
+
+    timeout: float | None
+    max_attempts: int
+    backoff: float
+    max_backoff: float
+    hedge_percentile: float | None
+    min_samples: int
+    max_hedge_ratio: float
+    tracker: LatencyTracker
+
+    def __init__(
+            self,
+            model: LLMModel,
+            timeout: float | None = None,
+            max_attempts: int = 3,
+            backoff: float = 0.5,
+            max_backoff: float = 8.0,
+            hedge_percentile: float | None = None,
+            hedge_model: LLMModel | None = None,
+            min_samples: int = 20,
+            max_hedge_ratio: float = 0.1,
+            tracker: LatencyTracker | None = None
+        ):
+        """
+        Args:
+            model (LLMModel): Model whose calls are bounded.
+            timeout (float | None): Seconds an attempt can take, None for no limit.
+            max_attempts (int): Attempts of a call, including the first one.
+            backoff (float): Seconds waited before the first retry, doubled on each retry.
+            max_backoff (float): Maximum seconds waited before a retry.
+            hedge_percentile (float | None): Percentile (0-100) of the model latencies after which
+                an attempt is sent again, None to not hedge.
+            hedge_model (LLMModel | None): Model the hedged requests are sent to, the wrapped
+                model by default if it is a LoadBalancedLLMModel.
+            min_samples (int): Latencies observed before hedging.
+            max_hedge_ratio (float): Maximum fraction of the calls that are hedged.
+            tracker (LatencyTracker | None): Tracker of the latencies, the process' one by default.
+        """
+        super().__init__(model)
+        self.timeout: float | None = timeout
+        self.max_attempts: int = max(max_attempts, 1)
+        self.backoff: float = backoff
+        self.max_backoff: float = max_backoff
+        self.hedge_percentile: float | None = hedge_percentile
+        if hedge_model is None and isinstance(model, LoadBalancedLLMModel):
+            hedge_model = model
+        self.hedge_model: LLMModel | None = hedge_model
+        self.min_samples: int = min_samples
+        self.max_hedge_ratio: float = max_hedge_ratio
+        self.tracker: LatencyTracker = tracker if tracker is not None else get_latency_tracker()
+        self._executor: ThreadPoolExecutor | None = None
+        return
+
+    def _hedge_delay(self) -> float | None:
+        if self.hedge_percentile is None or self.hedge_model is None:
+            return None
+        calls = self.tracker.get_count(self.model_name, "calls")
+        if self.tracker.get_count(self.model_name, "hedges") >= self.max_hedge_ratio * calls:
+            return None
+        return self.tracker.percentile(self.model_name, self.hedge_percentile, self.min_samples)
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter, so that the calls failed at once aren't retried at once
+        return random.uniform(0, min(self.backoff * 2 ** (attempt - 1), self.max_backoff))
+
+    def _expected_tool(self, response_format: ResponseFormat | None) -> List[str] | None:
+        if response_format is not None:
+            return [response_format["name"]]
+        if self.tools:
+            return [getattr(t, "name", getattr(t, "__name__", repr(t))) for t in self.tools]
+        return None
+
+    def _invalid_message(self, response: LLMMessage, response_format: ResponseFormat | None) -> Dict[str, str] | None:
+        """
+        Returns the message asking the model to answer again if the response doesn't call one of
+        the tools expected with all the arguments the players read, None if the response is valid.
+        """
+        tool_names = self._expected_tool(response_format)
+        if tool_names is None:
+            return None
+        tool_call = response.tool_call
+        if (
+            tool_call is not None
+            and tool_call.tool_name in tool_names
+            and isinstance(tool_call.args, dict)
+            and all(arg in tool_call.args for arg in REQUIRED_ARGS.get(tool_call.tool_name, []))
+        ):
+            return None
+        tool_name = tool_call.tool_name if tool_call is not None and tool_call.tool_name in tool_names else tool_names[0]
+        return dict(role="user", content=invalid_tool_call_message.format(
+            tool_name=tool_name,
+            required_args=REQUIRED_ARGS.get(tool_name, [])
+        ))
+
+    def _attempt(self, call: Callable[[LLMModel], LLMMessage]) -> LLMMessage:
+        start = time.perf_counter()
+        hedge_at = self._hedge_delay()
+        if self.timeout is None and hedge_at is None:
+            response = call(self.model)
+            self.tracker.observe(self.model_name, time.perf_counter() - start)
+            return response
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="llm-call")
+        primary = self._executor.submit(call, self.model)
+        pending: set[Future] = {primary}
+        error: BaseException | None = None
+        while pending:
+            limits = [limit for limit in (self.timeout, hedge_at) if limit is not None]
+            remaining = max(min(limits) - (time.perf_counter() - start), 0.0) if limits else None
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is not primary:
+                        self.tracker.count(self.model_name, "hedge_wins")
+                    self.tracker.observe(self.model_name, time.perf_counter() - start)
+                    return future.result()
+                error = future.exception()
+            elapsed = time.perf_counter() - start
+            if self.timeout is not None and elapsed >= self.timeout and pending:
+                # The requests left are closed by the client timeout
+                for future in pending:
+                    future.cancel()
+                raise TimeoutError(f"Model '{self.model_name}' didn't answer in {self.timeout}s")
+            if hedge_at is not None and elapsed >= hedge_at and pending:
+                hedge_at = None
+                self.tracker.count(self.model_name, "hedges")
+                pending.add(self._executor.submit(call, self.hedge_model))
+        raise error
+
+    async def _aattempt(self, call: Callable[[LLMModel], Awaitable[LLMMessage]]) -> LLMMessage:
+        start = time.perf_counter()
+        hedge_at = self._hedge_delay()
+        primary = asyncio.ensure_future(call(self.model))
+        tasks = [primary]
+        try:
+            if hedge_at is not None:
+                done, _ = await asyncio.wait(tasks, timeout=hedge_at)
+                if not done:
+                    self.tracker.count(self.model_name, "hedges")
+                    tasks.append(asyncio.ensure_future(call(self.hedge_model)))
+            pending = set(tasks)
+            error: BaseException | None = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.tracker.count(self.model_name, "hedge_wins")
+                        self.tracker.observe(self.model_name, time.perf_counter() - start)
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # Cancelling the request left (or both, at the deadline) closes it
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _call(
+            self,
+            messages: List[Dict[str, str]],
+            call: Callable[[LLMModel, List[Dict[str, str]]], LLMMessage],
+            response_format: ResponseFormat | None = None
+        ) -> LLMMessage:
+        error: Exception | None = None
+        for attempt in range(self.max_attempts):
+            if attempt > 0:
+                self.tracker.count(self.model_name, "retries")
+                time.sleep(self._backoff(attempt))
+            try:
+                response = self._attempt(lambda model: call(model, messages))
+            except TimeoutError as e:
+                self.tracker.count(self.model_name, "timeouts")
+                error = e
+                continue
+            except Exception as e:
+                self.tracker.count(self.model_name, "errors")
+                error = e
+                continue
+            invalid_message = self._invalid_message(response, response_format)
+            if invalid_message is None:
+                return response
+            self.tracker.count(self.model_name, "invalid")
+            messages = messages + [invalid_message]
+            error = Exception(f"Model '{self.model_name}' didn't use its tool: {response.tool_call or response.content!r}")
+        raise error
+
+    async def _acall(
+            self,
+            messages: List[Dict[str, str]],
+            call: Callable[[LLMModel, List[Dict[str, str]]], Awaitable[LLMMessage]],
+            response_format: ResponseFormat | None = None
+        ) -> LLMMessage:
+        error: Exception | None = None
+        for attempt in range(self.max_attempts):
+            if attempt > 0:
+                self.tracker.count(self.model_name, "retries")
+                await asyncio.sleep(self._backoff(attempt))
+            try:
+                response = await asyncio.wait_for(
+                    self._aattempt(lambda model: call(model, messages)), self.timeout
+                )
+            except (TimeoutError, asyncio.TimeoutError):
+                self.tracker.count(self.model_name, "timeouts")
+                error = TimeoutError(f"Model '{self.model_name}' didn't answer in {self.timeout}s")
+                continue
+            except Exception as e:
+                self.tracker.count(self.model_name, "errors")
+                error = e
+                continue
+            invalid_message = self._invalid_message(response, response_format)
+            if invalid_message is None:
+                return response
+            self.tracker.count(self.model_name, "invalid")
+            messages = messages + [invalid_message]
+            error = Exception(f"Model '{self.model_name}' didn't use its tool: {response.tool_call or response.content!r}")
+        raise error
+
+    def chat(
+            self,
+            messages: List[Dict[str, str]]
+        ) -> LLMMessage:
+        return self._call(messages, lambda model, m: model.chat(m))
+
+    async def achat(
+            self,
+            messages: List[Dict[str, str]]
+        ) -> LLMMessage:
+        return await self._acall(messages, lambda model, m: model.achat(m))
+
+    def chat_batch(
+            self,
+            batch: List[List[Dict[str, str]]]
+        ) -> List[LLMMessage]:
+        """
+        Sends the batch at once, bounded by 'timeout' but not hedged. If the batch fails or times
+        out all its items are retried one by one with 'chat', otherwise only the invalid answers.
+        """
+        start = time.perf_counter()
+        try:
+            if self.timeout is None:
+                responses = self.model.chat_batch(batch)
+            else:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="llm-call")
+                future = self._executor.submit(self.model.chat_batch, batch)
+                done, _ = wait({future}, timeout=self.timeout)
+                if not done:
+                    # The requests left are closed by the client timeout
+                    future.cancel()
+                    raise TimeoutError(f"Model '{self.model_name}' didn't answer a batch in {self.timeout}s")
+                responses = future.result()
+            if len(responses) != len(batch):
+                raise Exception(f"Expected {len(batch)} responses from the batch, got {len(responses)}")
+        except TimeoutError:
+            self.tracker.count(self.model_name, "timeouts")
+            return [self.chat(messages) for messages in batch]
+        except Exception:
+            self.tracker.count(self.model_name, "errors")
+            return [self.chat(messages) for messages in batch]
+        latency = time.perf_counter() - start
+        for response in responses:
+            self.tracker.observe(self.model_name, latency)
+        invalid = [i for i, response in enumerate(responses) if self._invalid_message(response, None) is not None]
+        for i in invalid:
+            self.tracker.count(self.model_name, "invalid")
+            responses[i] = self.chat(batch[i])
+        return responses
+
+    def chat_structured(
+            self,
+            messages: List[Dict[str, str]],
+            response_format: ResponseFormat
+        ) -> LLMMessage:
+        return self._call(messages, lambda model, m: model.chat_structured(m, response_format), response_format)
+
+    async def achat_structured(
+            self,
+            messages: List[Dict[str, str]],
+            response_format: ResponseFormat
+        ) -> LLMMessage:
+        return await self._acall(
+            messages, lambda model, m: model.achat_structured(m, response_format), response_format
+        )
+
+    def _first_piece(self, stream: Iterator[LLMMessage]) -> LLMMessage | None:
+        """
+        Returns the first piece of a stream, None if it is empty, waiting at most 'timeout' seconds.
+        """
+        if self.timeout is None:
+            return next(stream, None)
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="llm-call")
+        future = self._executor.submit(next, stream, None)
+        done, _ = wait({future}, timeout=self.timeout)
+        if not done:
+            # A running generator can't be closed: it is closed once its request is, by the
+            # client timeout
+            future.add_done_callback(lambda _: stream.close())
+            raise TimeoutError(f"Model '{self.model_name}' didn't start answering in {self.timeout}s")
+        return future.result()
+
+    def stream_structured(
+            self,
+            messages: List[Dict[str, str]],
+            response_format: ResponseFormat
+        ) -> Iterator[LLMMessage]:
+        # Only a stream that fails before its first piece is retried
+        error: Exception | None = None
+        for attempt in range(self.max_attempts):
+            if attempt > 0:
+                self.tracker.count(self.model_name, "retries")
+                time.sleep(self._backoff(attempt))
+            stream = self.model.stream_structured(messages, response_format)
+            try:
+                first = self._first_piece(stream)
+            except TimeoutError as e:
+                self.tracker.count(self.model_name, "timeouts")
+                error = e
+                continue
+            except Exception as e:
+                self.tracker.count(self.model_name, "errors")
+                stream.close()
+                error = e
+                continue
+            if first is None:
+                return
+            try:
+                yield first
+                yield from stream
+            finally:
+                stream.close()
+            return
+        raise error
+
+    async def astream_structured(
+            self,
+            messages: List[Dict[str, str]],
+            response_format: ResponseFormat
+        ) -> AsyncIterator[LLMMessage]:
+        error: Exception | None = None
+        for attempt in range(self.max_attempts):
+            if attempt > 0:
+                self.tracker.count(self.model_name, "retries")
+                await asyncio.sleep(self._backoff(attempt))
+            stream = self.model.astream_structured(messages, response_format)
+            try:
+                first = await asyncio.wait_for(stream.__anext__(), self.timeout)
+            except StopAsyncIteration:
+                return
+            except (TimeoutError, asyncio.TimeoutError):
+                self.tracker.count(self.model_name, "timeouts")
+                await stream.aclose()
+                error = TimeoutError(f"Model '{self.model_name}' didn't start answering in {self.timeout}s")
+                continue
+            except Exception as e:
+                self.tracker.count(self.model_name, "errors")
+                await stream.aclose()
+                error = e
+                continue
+            try:
+                yield first
+                async for delta in stream:
+                    yield delta
+            finally:
+                await stream.aclose()
+            return
+        raise error
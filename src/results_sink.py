@@ -0,0 +1,155 @@
+from typing import List, Dict, Any, Iterator
+import json
+import os
+import threading
+
+from src.schemas import Results, Round, Teams, TeamWords
+
+
+class ResultsSink:
+    """
+    Append-only, line-delimited JSON log of games. Each game writes a 'game_start' record, one
+    'round' record as soon as each round is over and a final 'game_end' (or 'game_error') record,
+    so the work done by a game is kept on disk even if it crashes. Every record is written with a
+    single append, so several processes can share the same file.
+    """
+
+    path: str
+    fsync: bool
+
+    def __init__(self, path: str, fsync: bool = False):
+        self.path: str = path
+        self.fsync: bool = fsync
+        self._lock: threading.Lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        return
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Locks can't be sent to the worker processes, each one creates its own
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        return
+
+    def _write(self, record: Dict[str, Any]) -> None:
+        data = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, data)
+                if self.fsync:
+                    os.fsync(fd)
+            finally:
+                os.close(fd)
+        return
+
+    def start_game(
+            self,
+            game_id: str,
+            words: TeamWords,
+            team_order: List[str],
+            teams: Teams
+        ) -> None:
+        self._write({
+            "type": "game_start",
+            "game_id": game_id,
+            "words": dict(words),
+            "team_order": list(team_order),
+            "teams": teams.model_dump()
+        })
+        return
+
+    def has_started(self, game_id: str) -> bool:
+        """
+        Whether the log already has the 'game_start' record of a game, e.g. of a game resumed
+        from a checkpoint.
+        """
+        if not os.path.exists(self.path):
+            return False
+        return any(
+            record.get("type") == "game_start" and record.get("game_id") == game_id
+            for record in read_records(self.path)
+        )
+
+    def write_round(self, game_id: str, round_info: Round) -> None:
+        self._write({"type": "round", "game_id": game_id, "round": round_info.model_dump()})
+        return
+
+    def end_game(self, game_id: str, results: Results) -> None:
+        self._write({
+            "type": "game_end",
+            "game_id": game_id,
+            "num_rounds": results.num_rounds,
+            "winner_team": results.winner_team
+        })
+        return
+
+    def fail_game(self, game_id: str, error: BaseException) -> None:
+        self._write({"type": "game_error", "game_id": game_id, "error": repr(error)})
+        return
+
+
+def read_records(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # Last line of a file whose writer was killed
+                continue
+
+
+def read_games(path: str, include_unfinished: bool = False) -> Iterator[Dict[str, Any]]:
+    """
+    Groups the records of a ResultsSink file by game. Each game is a dict with its 'game_id',
+    'start' record, list of 'rounds' and 'end' record (None if the game didn't finish).
+    Games are yielded in the order they finished (unfinished games at the end). A game that
+    failed and was resumed keeps its records under the same game_id.
+    """
+    games: Dict[str, Dict[str, Any]] = {}
+    for record in read_records(path):
+        game = games.setdefault(
+            record["game_id"],
+            {"game_id": record["game_id"], "start": None, "rounds": [], "end": None, "error": None}
+        )
+        if record["type"] == "game_start":
+            game["start"] = record
+        elif record["type"] == "round":
+            # A game resumed from a checkpoint may write the same round again
+            number = record["round"]["round"]
+            game["rounds"] = [r for r in game["rounds"] if r["round"] != number] + [record["round"]]
+        elif record["type"] == "game_error":
+            game["error"] = record["error"]
+            if include_unfinished:
+                yield games.pop(record["game_id"])
+        elif record["type"] == "game_end":
+            game["end"] = record
+            yield games.pop(record["game_id"])
+    if include_unfinished:
+        yield from games.values()
+
+
+def read_results(path: str) -> Iterator[tuple[str, Results]]:
+    """
+    Yields the (game_id, Results) of every finished game of a ResultsSink file.
+    """
+    for game in read_games(path):
+        if game["start"] is None:
+            continue
+        yield game["game_id"], Results(
+            words = game["start"]["words"],
+            team_order = game["start"]["team_order"],
+            teams = game["start"]["teams"],
+            num_rounds = game["end"]["num_rounds"],
+            rounds_info = game["rounds"],
+            winner_team = game["end"]["winner_team"]
+        )
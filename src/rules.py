@@ -0,0 +1,275 @@
+from typing import List, Dict, Literal, Tuple, Iterable
+
+from src.schemas import HistoryEvent, RoundStartEvent, CodeGivenEvent, WordRevealedEvent
+
+# The rules of the game as a pure transition function, 'apply(state, action) -> (state, events)'.
+# States are never modified: every action returns a new one, and the events it produced (the
+# same ones written to the game history). SecretCodeGame drives its players with it, and the
+# batched simulator (src.simulation) implements the same rules over arrays of boards.
+
+
+Group = Literal["red", "blue", "neutral", "black"]
+
+# 'start': the team to play hasn't started its turn yet. 'code': its captain has to give a
+# secret code. 'guess': its guesser can reveal words. 'done': its guesser can't go on.
+Phase = Literal["start", "code", "guess", "done"]
+
+
+def normalize(word: str) -> str:
+    return word.strip().lower()
+
+
+def is_repeated(word: str, said: Iterable[str]) -> bool:
+    """
+    Whether a guesser already said the word in its turn. A word said again is skipped: it
+    neither reveals anything nor ends the turn.
+    """
+    return normalize(word) in map(normalize, said)
+
+
+def board_groups(layout: Tuple[int, int, int], team_order: Iterable[str]) -> List[str]:
+    """
+    Group of every position of a board whose words are ordered as the layout: the first team's
+    words, the second team's, the neutral ones and the black word.
+    """
+    first_team_color, second_team_color = team_order
+    first_size, second_size, neutral_size = layout
+    return (
+        [first_team_color] * first_size
+        + [second_team_color] * second_size
+        + ["neutral"] * neutral_size
+        + ["black"]
+    )
+
+
+class StartTurn:
+    """
+    The next team starts its turn. Starting the turn of the first team starts a new round.
+    """
+
+    __slots__ = ()
+
+
+class GiveCode:
+
+    __slots__ = ("word", "number")
+
+    word: str
+    number: int
+
+    def __init__(self, word: str, number: int):
+        self.word: str = word
+        self.number: int = number
+
+
+class Guess:
+    """
+    The guesser of the team to play says a word of the board.
+    """
+
+    __slots__ = ("word",)
+
+    word: str
+
+    def __init__(self, word: str):
+        self.word: str = word
+
+
+class EndTurn:
+
+    __slots__ = ()
+
+
+Action = StartTurn | GiveCode | Guess | EndTurn
+
+
+class GameState:
+    """
+    State of a game between two teams on a board: the words revealed, the team to play and the
+    phase of its turn, the rounds completed and the winner. It is immutable, 'apply' returns
+    the state after each action.
+
+    A round started by the first team is always finished by the second one, so a game is only
+    'finished' once the round in which it was won is over.
+    """
+
+    __slots__ = (
+        "words",
+        "groups",
+        "team_order",
+        "revealed",
+        "left",
+        "round",
+        "team",
+        "phase",
+        "game_over",
+        "winner",
+        "_index"
+    )
+
+    words: Tuple[str, ...]
+    groups: Tuple[str, ...]
+    team_order: Tuple[str, str]
+    revealed: Tuple[bool, ...]
+    left: Dict[str, int]
+    round: int
+    team: int
+    phase: Phase
+    game_over: bool
+    winner: str | None
+
+    @classmethod
+    def initial(
+            cls,
+            words: List[str],
+            layout: Tuple[int, int, int],
+            team_order: List[Literal["red", "blue"]],
+            revealed: Iterable[str] = (),
+            round: int = 0,
+            team: int = 0,
+            game_over: bool = False,
+            winner: str | None = None
+        ) -> "GameState":
+        """
+        This method returns the state of a game at the start of a team turn.
+
+        Args:
+            words (List[str]): Words of the board, ordered as the layout (see 'board_groups').
+            layout (Tuple[int, int, int]): Number of words of the first team, the second team and
+                the neutral group.
+            team_order (List[Literal["red", "blue"]]): Color of the first and the second team.
+            revealed (Iterable[str]): Words already revealed, to resume a game.
+            round (int): Rounds completed.
+            team (int): Team to play, 0 for the first team and 1 for the second.
+            game_over (bool): Whether the game was already won.
+            winner (str | None): Winner of the game, if it is over.
+        Return:
+            (GameState) The state.
+        """
+        state = cls.__new__(cls)
+        state.words = tuple(words)
+        state.groups = tuple(board_groups(layout, team_order))
+        state.team_order = tuple(team_order)
+        state._index = {normalize(word): position for position, word in enumerate(state.words)}
+        flags = [False] * len(state.words)
+        left = {team_order[0]: layout[0], team_order[1]: layout[1], "neutral": layout[2], "black": 1}
+        for word in revealed:
+            position = state._index[normalize(word)]
+            flags[position] = True
+            left[state.groups[position]] -= 1
+        state.revealed = tuple(flags)
+        state.left = left
+        state.round = round
+        state.team = team
+        state.phase = "start"
+        state.game_over = game_over
+        state.winner = winner
+        return state
+
+    def _replace(self, **changes) -> "GameState":
+        state = GameState.__new__(GameState)
+        state.words = self.words
+        state.groups = self.groups
+        state.team_order = self.team_order
+        state.revealed = self.revealed
+        state.left = self.left
+        state.round = self.round
+        state.team = self.team
+        state.phase = self.phase
+        state.game_over = self.game_over
+        state.winner = self.winner
+        state._index = self._index
+        for name, value in changes.items():
+            setattr(state, name, value)
+        return state
+
+    @property
+    def playing(self) -> str:
+        """
+        Color of the team whose turn it is.
+        """
+        return self.team_order[self.team]
+
+    @property
+    def opponent(self) -> str:
+        return self.team_order[1 - self.team]
+
+    @property
+    def finished(self) -> bool:
+        return self.game_over and self.team == 0 and self.phase == "start"
+
+    def group_of(self, word: str) -> str | None:
+        position = self._index.get(normalize(word))
+        return self.groups[position] if position is not None else None
+
+    def is_revealed(self, word: str) -> bool:
+        position = self._index.get(normalize(word))
+        return position is not None and self.revealed[position]
+
+    def left_words(self, group: str | None = None) -> List[str]:
+        """
+        Words not revealed yet, of a group or of the whole board.
+        """
+        return [
+            word for word, word_group, revealed in zip(self.words, self.groups, self.revealed)
+            if not revealed and (group is None or word_group == group)
+        ]
+
+
+def _expect_phase(state: GameState, action: Action, phases: Tuple[str, ...]) -> None:
+    if state.phase not in phases:
+        raise Exception(f"{type(action).__name__} can't be applied in phase '{state.phase}'")
+    return
+
+
+def apply(state: GameState, action: Action) -> Tuple[GameState, List[HistoryEvent]]:
+    """
+    This method applies an action to a game.
+
+    Args:
+        state (GameState): State of the game.
+        action (Action): Action of the team to play.
+    Return:
+        (Tuple[GameState, List[HistoryEvent]]) The new state and the events of the action.
+    """
+    if isinstance(action, Guess):
+        _expect_phase(state, action, ("guess",))
+        position = state._index.get(normalize(action.word))
+        if position is None or state.revealed[position]:
+            raise Exception("Guessed word does not exist")
+        group = state.groups[position]
+        revealed = list(state.revealed)
+        revealed[position] = True
+        left = dict(state.left)
+        left[group] -= 1
+        team = state.playing
+        changes = {"revealed": tuple(revealed), "left": left, "phase": "done"}
+        if group == "black":
+            changes.update(game_over=True, winner=state.opponent)
+        elif group == team:
+            if left[team] == 0:
+                changes.update(game_over=True, winner=team)
+            else:
+                changes["phase"] = "guess"
+        # An opponent's or neutral word ends the turn
+        return state._replace(**changes), [WordRevealedEvent(team=team, word=action.word, group=group)]
+
+    if isinstance(action, StartTurn):
+        _expect_phase(state, action, ("start",))
+        if state.finished:
+            raise Exception("The game is over")
+        events = [RoundStartEvent(round=state.round)] if state.team == 0 else []
+        return state._replace(phase="code"), events
+
+    if isinstance(action, GiveCode):
+        _expect_phase(state, action, ("code",))
+        event = CodeGivenEvent(team=state.playing, word=action.word, number=action.number)
+        return state._replace(phase="guess"), [event]
+
+    if isinstance(action, EndTurn):
+        _expect_phase(state, action, ("guess", "done"))
+        if state.team == 0:
+            return state._replace(team=1, phase="start"), []
+        return state._replace(team=0, phase="start", round=state.round + 1), []
+
+    raise Exception(f"Unknown action {action!r}")
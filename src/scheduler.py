@@ -0,0 +1,227 @@
+from typing import List, Dict, Any, Deque, AsyncIterator, Literal
+from collections import OrderedDict, deque
+import asyncio
+import time
+
+from src.llm_wrapper import LLMModel, LLMModelWrapper
+from src.schemas import LLMMessage, ResponseFormat
+
+
+SwapPolicy = Literal["longest_queue", "oldest_request"]
+
+
+class ModelAffinityScheduler:
+    """
+    Orders the async calls of many concurrent games so that a server which can only hold
+    'max_loaded_models' models in memory doesn't unload and reload them constantly. Calls are
+    only admitted for the models currently considered loaded ("active"); calls for other models
+    wait. An active model stops being admitted once 'max_burst' calls were admitted since it was
+    activated, or once a call for another model has waited 'max_wait' seconds, and only if
+    other models are waiting. When its admitted calls are over, it is replaced by the waiting
+    model chosen by 'policy': the one with the most waiting calls, or the one with the oldest.
+
+    Stats compare the model activations ('loads') with the loads the same calls would cause
+    in arrival order (a least recently used cache of 'max_loaded_models' models), and estimate
+    the load time saved from the mean 'load_duration' reported per load.
+    """
+
+    max_burst: int
+    max_wait: float
+    policy: SwapPolicy
+    max_loaded_models: int
+
+    def __init__(
+            self,
+            max_burst: int = 32,
+            max_wait: float = 30.0,
+            policy: SwapPolicy = "longest_queue",
+            max_loaded_models: int = 1
+        ):
+        """
+        Args:
+            max_burst (int): Calls admitted for a model before switching to a waiting one.
+            max_wait (float): Seconds a call can wait before the active models stop being admitted.
+            policy (SwapPolicy): Which waiting model is activated next, "longest_queue" or
+                "oldest_request".
+            max_loaded_models (int): Models that are active at the same time.
+        """
+        if policy not in ("longest_queue", "oldest_request"):
+            raise Exception(f"Unknown swap policy {policy!r}")
+        self.max_burst: int = max_burst
+        self.max_wait: float = max_wait
+        self.policy: SwapPolicy = policy
+        self.max_loaded_models: int = max_loaded_models
+        # Per model, the arrival time and future of its waiting calls
+        self._waiting: Dict[str, Deque[tuple[float, asyncio.Future]]] = {}
+        # Per active model, its calls in flight and the calls admitted since it was activated
+        self._active: Dict[str, Dict[str, int]] = {}
+        # Models loaded if the calls were sent in arrival order, least recently used first
+        self._arrival_cache: OrderedDict[str, None] = OrderedDict()
+        self.requests: int = 0
+        self.loads: int = 0
+        self.arrival_order_loads: int = 0
+        self.load_duration: float = 0.0
+        self.max_waiting_time: float = 0.0
+        return
+
+    def _record_arrival(self, model_name: str) -> None:
+        self.requests += 1
+        if model_name in self._arrival_cache:
+            self._arrival_cache.move_to_end(model_name)
+            return
+        self.arrival_order_loads += 1
+        self._arrival_cache[model_name] = None
+        if len(self._arrival_cache) > self.max_loaded_models:
+            self._arrival_cache.popitem(last=False)
+        return
+
+    def _others_waiting(self) -> List[str]:
+        return [m for m, waiting in self._waiting.items() if waiting and m not in self._active]
+
+    def _closing(self, model_name: str, others: List[str], now: float) -> bool:
+        """
+        Whether the active model stops being admitted so that a waiting one can be loaded.
+        """
+        if not others:
+            return False
+        if self._active[model_name]["admitted"] >= self.max_burst:
+            return True
+        oldest = min(self._waiting[m][0][0] for m in others)
+        return now - oldest >= self.max_wait
+
+    def _next_model(self, others: List[str]) -> str:
+        if self.policy == "longest_queue":
+            return max(others, key=lambda m: (len(self._waiting[m]), -self._waiting[m][0][0]))
+        return min(others, key=lambda m: self._waiting[m][0][0])
+
+    def _dispatch(self) -> None:
+        now = time.monotonic()
+        others = self._others_waiting()
+        # Drained models give their place to the waiting ones
+        for model_name, active in list(self._active.items()):
+            if others and active["in_flight"] == 0 and (
+                not self._waiting.get(model_name) or self._closing(model_name, others, now)
+            ):
+                del self._active[model_name]
+        while len(self._active) < self.max_loaded_models and (others := self._others_waiting()):
+            model_name = self._next_model(others)
+            self._active[model_name] = {"in_flight": 0, "admitted": 0}
+            self.loads += 1
+        others = self._others_waiting()
+        for model_name, active in self._active.items():
+            waiting = self._waiting.get(model_name)
+            while waiting and not self._closing(model_name, others, now):
+                arrival, future = waiting.popleft()
+                if future.done():
+                    continue
+                active["in_flight"] += 1
+                active["admitted"] += 1
+                self.max_waiting_time = max(self.max_waiting_time, now - arrival)
+                future.set_result(None)
+        return
+
+    async def acquire(self, model_name: str) -> None:
+        """
+        Waits until a call to the model can be sent. Every 'acquire' must be followed by a
+        'release' once the call is over.
+        """
+        self._record_arrival(model_name)
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(model_name, deque()).append((time.monotonic(), future))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.cancelled():
+                waiting = self._waiting[model_name]
+                for entry in waiting:
+                    if entry[1] is future:
+                        waiting.remove(entry)
+                        break
+                self._dispatch()
+            else:
+                # Admitted just before being cancelled
+                self.release(model_name)
+            raise
+        return
+
+    def release(self, model_name: str, response: LLMMessage | None = None) -> None:
+        if response is not None and response.usage is not None:
+            self.load_duration += response.usage.load_duration or 0.0
+        self._active[model_name]["in_flight"] -= 1
+        self._dispatch()
+        return
+
+    def stats(self) -> Dict[str, Any]:
+        swaps_avoided = self.arrival_order_loads - self.loads
+        mean_load = self.load_duration / self.loads if self.loads > 0 else 0.0
+        return {
+            "requests": self.requests,
+            "loads": self.loads,
+            "arrival_order_loads": self.arrival_order_loads,
+            "swaps_avoided": swaps_avoided,
+            "load_duration": self.load_duration,
+            "estimated_load_duration_saved": swaps_avoided * mean_load,
+            "max_waiting_time": self.max_waiting_time
+        }
+
+    def report(self) -> str:
+        stats = self.stats()
+        return (
+            f"Model affinity: {stats['loads']} model loads for {stats['requests']} requests "
+            f"({stats['arrival_order_loads']} in arrival order), {stats['swaps_avoided']} swaps avoided, "
+            f"~{stats['estimated_load_duration_saved']:.1f}s of load time saved, "
+            f"longest wait {stats['max_waiting_time']:.2f}s"
+        )
+
+
+class ScheduledLLMModel(LLMModelWrapper):
+    """
+    Sends the async calls of the wrapped model through a ModelAffinityScheduler shared by all
+    the models of a server. Sync calls are not scheduled.
+    """
+
+    def __init__(self, model: LLMModel, scheduler: ModelAffinityScheduler):
+        super().__init__(model)
+        self.scheduler: ModelAffinityScheduler = scheduler
+
+    async def achat(
+            self,
+            messages: List[Dict[str, str]]
+        ) -> LLMMessage:
+        await self.scheduler.acquire(self.model_name)
+        response = None
+        try:
+            response = await self.model.achat(messages)
+            return response
+        finally:
+            self.scheduler.release(self.model_name, response)
+
+    async def achat_structured(
+            self,
+            messages: List[Dict[str, str]],
+            response_format: ResponseFormat
+        ) -> LLMMessage:
+        await self.scheduler.acquire(self.model_name)
+        response = None
+        try:
+            response = await self.model.achat_structured(messages, response_format)
+            return response
+        finally:
+            self.scheduler.release(self.model_name, response)
+
+    async def astream_structured(
+            self,
+            messages: List[Dict[str, str]],
+            response_format: ResponseFormat
+        ) -> AsyncIterator[LLMMessage]:
+        # The model stays admitted until the stream is exhausted or closed
+        await self.scheduler.acquire(self.model_name)
+        delta = None
+        stream = self.model.astream_structured(messages, response_format)
+        try:
+            async for delta in stream:
+                yield delta
+        finally:
+            await stream.aclose()
+            self.scheduler.release(self.model_name, delta)
@@ -1,5 +1,5 @@
-from typing import List, TypedDict, Literal, Dict, Any, Optional
-from pydantic import BaseModel
+from typing import List, TypedDict, Literal, Dict, Any, Optional, Union, Annotated
+from pydantic import BaseModel, Field
 
 
 class TeamWords(TypedDict):
@@ -18,6 +18,12 @@ class LeftTeamWords(TypedDict):
     known: List[str]
 
 
+class ResponseFormat(TypedDict):
+    # JSON schema the response must follow and name of the tool whose arguments it holds
+    name: str
+    schema: Dict[str, Any]
+
+
 class Code(BaseModel):
     word: str
     number: int
@@ -36,6 +42,11 @@ class PlayerData(BaseModel):
     seed: int | None
 
 
+# Players whose model name starts with this prefix are embedding baselines (see src.embeddings),
+# named after the fastembed model they use, e.g. "embedding:BAAI/bge-small-en-v1.5"
+EMBEDDING_PREFIX = "embedding:"
+
+
 class TeamData(BaseModel):
     captain: PlayerData
     guesser: PlayerData
@@ -46,11 +57,45 @@ class Teams(BaseModel):
     red: TeamData
 
 
+class Matchup(BaseModel):
+    red: TeamData
+    blue: TeamData
+
+
+class GameJob(BaseModel):
+    game_id: int
+    matchup: Matchup
+    words: TeamWords
+    team_order: List[Literal["red", "blue"]]
+
+
+class CallUsage(BaseModel):
+    # Durations in seconds, as reported by the provider when available
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    load_duration: Optional[float] = None
+    prompt_eval_duration: Optional[float] = None
+    eval_duration: Optional[float] = None
+    total_duration: Optional[float] = None
+    # Wall-clock time of the call measured by the client
+    latency: Optional[float] = None
+
+
 class RoundTeamData(BaseModel):
     secret_code: Code
     guesser_choice: Choice
     captain_prompt: Optional[str]
     guesser_prompt: Optional[str]
+    captain_usage: Optional[CallUsage] = None
+    guesser_usage: Optional[CallUsage] = None
+    # Streaming guessers: text generated before the turn was decided and whether it was cut short
+    guesser_output: Optional[str] = None
+    guesser_stopped_early: Optional[bool] = None
+    # Players sampled several times per turn: every sample and the share agreeing with the one played
+    captain_samples: Optional[List[Code]] = None
+    guesser_samples: Optional[List[Choice]] = None
+    captain_agreement: Optional[float] = None
+    guesser_agreement: Optional[float] = None
 
 
 class Round(BaseModel):
@@ -76,4 +121,100 @@ class ToolCall(BaseModel):
 class LLMMessage(BaseModel):
     model_name: str
     content: Optional[str]
-    tool_call: Optional[ToolCall]
\ No newline at end of file
+    tool_call: Optional[ToolCall]
+    usage: Optional[CallUsage] = None
+
+
+class RoundStartEvent(BaseModel):
+    kind: Literal["round_start"] = "round_start"
+    round: int
+
+
+class CodeGivenEvent(BaseModel):
+    kind: Literal["code_given"] = "code_given"
+    team: Literal["red", "blue"]
+    word: str
+    number: int
+
+
+class WordRevealedEvent(BaseModel):
+    kind: Literal["word_revealed"] = "word_revealed"
+    team: Literal["red", "blue"]
+    word: str
+    group: Literal["red", "blue", "neutral", "black"]
+
+
+HistoryEvent = Annotated[
+    Union[RoundStartEvent, CodeGivenEvent, WordRevealedEvent],
+    Field(discriminator="kind")
+]
+
+
+class PlayerState(BaseModel):
+    # Conversation of a threaded player
+    messages: List[Dict[str, Any]] = []
+    seen_history: str = ""
+    seen_words: List[str] = []
+
+
+class GameCheckpoint(BaseModel):
+    game_id: str
+    words: TeamWords
+    team_order: List[Literal["red", "blue"]]
+    teams: Teams
+    round: int
+    # Revealed words, in the order they were guessed
+    revealed: List[str]
+    history: List[HistoryEvent]
+    rounds_info: List[Round]
+    # Turn already played by the first team of the round in progress
+    first_turn: Optional[RoundTeamData] = None
+    game_over: bool = False
+    winner_team: Optional[Literal["red", "blue"]] = None
+    rng_state: Optional[List[Any]] = None
+    players: Dict[str, PlayerState] = {}
+
+
+class PromptRef(BaseModel):
+    # Prompt template (see compact.PROMPT_TEMPLATES) and the game events [start, end) it shows
+    template: Literal["captain_round", "captain_thread", "guesser_round", "guesser_thread"]
+    history: List[int]
+
+
+class CompactRoundTeamData(BaseModel):
+    # Words of the board are stored as their index in CompactResults.board
+    code_word: str
+    code_number: int
+    code_justification: str
+    words_related: List[Union[int, str]]
+    guesses: List[Union[int, str]]
+    guess_justification: str
+    # A reference, the text (zlib + base64 if CompactResults.prompts is 'zlib') or None if dropped
+    captain_prompt: Union[PromptRef, str, None] = None
+    guesser_prompt: Union[PromptRef, str, None] = None
+    captain_usage: Optional[CallUsage] = None
+    guesser_usage: Optional[CallUsage] = None
+    guesser_output: Optional[str] = None
+    guesser_stopped_early: Optional[bool] = None
+    captain_samples: Optional[List[Code]] = None
+    guesser_samples: Optional[List[Choice]] = None
+    captain_agreement: Optional[float] = None
+    guesser_agreement: Optional[float] = None
+
+
+class CompactRound(BaseModel):
+    round: int
+    blue_team: CompactRoundTeamData
+    red_team: CompactRoundTeamData
+
+
+class CompactResults(BaseModel):
+    # Words in Board order: first team, second team, neutral and black words
+    board: List[str]
+    layout: List[int]
+    team_order: List[Literal["red", "blue"]]
+    teams: Teams
+    num_rounds: int
+    rounds: List[CompactRound]
+    winner_team: Literal["red", "blue"]
+    prompts: Literal["refs", "zlib", "drop"] = "refs"
@@ -0,0 +1,340 @@
+from typing import List, Dict, Any, Callable, Literal
+import argparse
+import json
+import time
+
+import numpy as np
+
+# Batched version of the rules of src.rules: thousands of games are arrays, one row per board,
+# and each team turn is evaluated for all of them at once. Words are positions of the board in
+# Board order, and their groups are relative to the team order: 0 for the first team's words,
+# 1 for the second team's, 2 for the neutral ones and 3 for the black word.
+
+FIRST, SECOND, NEUTRAL, BLACK = 0, 1, 2, 3
+
+# How a team turn ends, per board
+TURN_GUESSES_USED = 0
+TURN_OPPONENT = 1
+TURN_NEUTRAL = 2
+TURN_BLACK = 3
+TURN_WIN = 4
+
+# Number of the clue (words the guesser will say) of each board, from the words left of the team
+# to play and of its opponent
+ClueSizePolicy = Callable[[np.ndarray, np.ndarray], np.ndarray]
+Ordering = Literal["confident_first", "shuffled"]
+
+
+def board_groups(n_boards: int, layout: tuple[int, int, int]) -> np.ndarray:
+    first_size, second_size, neutral_size = layout
+    row = np.array(
+        [FIRST] * first_size + [SECOND] * second_size + [NEUTRAL] * neutral_size + [BLACK], dtype=np.int8
+    )
+    return np.broadcast_to(row, (n_boards, len(row))).copy()
+
+
+def evaluate_guesses(
+        groups: np.ndarray,
+        revealed: np.ndarray,
+        left: np.ndarray,
+        team: np.ndarray,
+        guesses: np.ndarray,
+        validate: bool = True
+    ) -> Dict[str, np.ndarray]:
+    """
+    This method plays a guesser turn on every board: the words of each row of 'guesses' are
+    revealed in order until the turn ends, as 'rules.apply' does for a single game. An opponent's
+    or neutral word ends the turn, the black word loses the game and the last word of the team
+    wins it. 'revealed' and 'left' are updated in place.
+
+    Args:
+        groups (np.ndarray): Group of every word, (n_boards, board_size) int8.
+        revealed (np.ndarray): Words already revealed, (n_boards, board_size) bool.
+        left (np.ndarray): Words left of each group, (n_boards, 4) int.
+        team (np.ndarray): Team to play on each board, 0 (first) or 1 (second).
+        guesses (np.ndarray): Positions said by the guessers, (n_boards, max_guesses), padded with
+            -1 after the last word of each row.
+        validate (bool): Whether to check that no word is said twice or was already revealed.
+    Return:
+        (Dict[str, np.ndarray]) Per board, the words revealed ("n_revealed"), how the turn ended
+        ("outcome", a TURN_* code) and the winner if the game was decided (0, 1, or -1).
+    """
+    n_boards, max_guesses = guesses.shape
+    rows = np.arange(n_boards)
+    valid = guesses >= 0
+    positions = np.where(valid, guesses, 0)
+    guessed_groups = np.take_along_axis(groups, positions, axis=1)
+    if validate and np.any(np.take_along_axis(revealed, positions, axis=1) & valid):
+        raise Exception("Guessed word does not exist")
+    own = guessed_groups == team[:, None]
+    own_left = left[rows, team]
+    ends = valid & (~own | (np.cumsum(own, axis=1) >= own_left[:, None]))
+    has_end = ends.any(axis=1)
+    last = np.argmax(ends, axis=1)
+    n_revealed = np.where(has_end, last + 1, valid.sum(axis=1))
+    taken = np.arange(max_guesses)[None, :] < n_revealed[:, None]
+
+    taken_rows, taken_columns = np.nonzero(taken)
+    taken_positions = guesses[taken_rows, taken_columns]
+    if validate and len(np.unique(taken_rows * groups.shape[1] + taken_positions)) != len(taken_positions):
+        raise Exception("Guessed word does not exist")
+    revealed[taken_rows, taken_positions] = True
+    for group in (FIRST, SECOND, NEUTRAL, BLACK):
+        left[:, group] -= ((guessed_groups == group) & taken).sum(axis=1)
+
+    last_group = guessed_groups[rows, last]
+    outcome = np.full(n_boards, TURN_GUESSES_USED, dtype=np.int8)
+    outcome[has_end & (last_group == NEUTRAL)] = TURN_NEUTRAL
+    outcome[has_end & (last_group == 1 - team)] = TURN_OPPONENT
+    outcome[has_end & (last_group == BLACK)] = TURN_BLACK
+    outcome[has_end & (last_group == team)] = TURN_WIN
+    winner = np.full(n_boards, -1, dtype=np.int8)
+    winner[outcome == TURN_BLACK] = 1 - team[outcome == TURN_BLACK]
+    winner[outcome == TURN_WIN] = team[outcome == TURN_WIN]
+    return {"n_revealed": n_revealed, "outcome": outcome, "winner": winner}
+
+
+def fixed_clue(size: int) -> ClueSizePolicy:
+    def policy(own_left: np.ndarray, opponent_left: np.ndarray) -> np.ndarray:
+        return np.minimum(own_left, size)
+    return policy
+
+
+def catch_up_clue(ahead_size: int, behind_size: int) -> ClueSizePolicy:
+    """
+    Clues of 'ahead_size' words while the team has no more words left than its opponent, and of
+    'behind_size' words when it is behind.
+    """
+    def policy(own_left: np.ndarray, opponent_left: np.ndarray) -> np.ndarray:
+        return np.minimum(own_left, np.where(own_left > opponent_left, behind_size, ahead_size))
+    return policy
+
+
+def parse_clue_policy(spec: str) -> ClueSizePolicy:
+    """
+    Clue size policy from its spec: 'fixed:K', 'all' (every word left) or 'catchup:AHEAD:BEHIND'.
+    """
+    name, *values = spec.split(":")
+    if name == "fixed" and len(values) == 1:
+        return fixed_clue(int(values[0]))
+    if name == "all" and not values:
+        return lambda own_left, opponent_left: own_left.copy()
+    if name == "catchup" and len(values) == 2:
+        return catch_up_clue(int(values[0]), int(values[1]))
+    raise argparse.ArgumentTypeError(f"Unknown clue size policy {spec!r}")
+
+
+class TeamPolicy:
+    """
+    Simulated team: its captain gives clues of the size chosen by 'clue_size', and its guesser
+    says as many words as the clue. The mean chance of each word being one of the team's is
+    'accuracy', minus 'clue_penalty' per word of the clue after the first (larger clues are
+    vaguer), and the chances of the words of a clue are spread 'spread' apart. With
+    "confident_first" ordering the guesser says the likeliest words first, with "shuffled" in a
+    random order. A wrong word is any other word left, so it is the black word as often as any other.
+    """
+
+    clue_size: ClueSizePolicy
+    accuracy: float
+    clue_penalty: float
+    spread: float
+    ordering: Ordering
+
+    def __init__(
+            self,
+            clue_size: ClueSizePolicy | str = "fixed:2",
+            accuracy: float = 0.8,
+            clue_penalty: float = 0.05,
+            spread: float = 0.2,
+            ordering: Ordering = "confident_first"
+        ):
+        self.clue_size: ClueSizePolicy = parse_clue_policy(clue_size) if isinstance(clue_size, str) else clue_size
+        self.accuracy: float = accuracy
+        self.clue_penalty: float = clue_penalty
+        self.spread: float = spread
+        self.ordering: Ordering = ordering
+        return
+
+    def word_chances(self, clue_sizes: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+        """
+        Chance of each word said being right, (n_boards, max clue size), in the order they are said.
+        """
+        max_size = max(int(clue_sizes.max()), 1)
+        order = np.arange(max_size)[None, :]
+        sizes = np.maximum(clue_sizes, 1)[:, None]
+        mean = self.accuracy - self.clue_penalty * (sizes - 1)
+        # Linear from the likeliest word to the least likely one, centered on the mean
+        offsets = self.spread * ((sizes - 1) / 2 - order) / np.maximum(sizes - 1, 1)
+        chances = np.clip(mean + offsets, 0.0, 1.0)
+        if self.ordering == "shuffled":
+            keys = np.where(order < clue_sizes[:, None], rng.random(chances.shape), np.inf)
+            chances = np.take_along_axis(chances, np.argsort(keys, axis=1), axis=1)
+        return chances
+
+    def guesses(
+            self,
+            own_order: np.ndarray,
+            other_order: np.ndarray,
+            revealed: np.ndarray,
+            left: np.ndarray,
+            team: np.ndarray,
+            rng: np.random.Generator
+        ) -> np.ndarray:
+        """
+        This method returns the words said by the guessers of a turn, padded with -1 (see
+        'evaluate_guesses'). Right words are the team's words left, in the order of 'own_order',
+        and the wrong word the first one left of 'other_order'. With these orders drawn at random
+        when the game starts, every word said is a random word left of its kind. A turn ends at
+        the first wrong word, so the words after it are not drawn.
+
+        Args:
+            own_order (np.ndarray): Positions of the team's words, (n_boards, team size).
+            other_order (np.ndarray): Positions of the rest of the words.
+            revealed (np.ndarray): Words already revealed, (n_boards, board_size) bool.
+            left (np.ndarray): Words left of each group, (n_boards, 4) int.
+            team (np.ndarray): Team to play on each board, 0 (first) or 1 (second).
+            rng (np.random.Generator): Random generator of the simulation.
+        Return:
+            (np.ndarray) The positions said, (n_boards, max clue size).
+        """
+        rows = np.arange(len(revealed))
+        own_left = left[rows, team]
+        clue_sizes = self.clue_size(own_left, left[rows, 1 - team])
+        chances = self.word_chances(clue_sizes, rng)
+        order = np.arange(chances.shape[1])[None, :]
+        right = (rng.random(chances.shape) < chances) & (order < own_left[:, None])
+        said_right = np.minimum(np.cumprod(right, axis=1).sum(axis=1), clue_sizes)
+
+        guesses = np.full(chances.shape, -1, dtype=np.int64)
+        unrevealed = ~np.take_along_axis(revealed, own_order, axis=1)
+        rank = np.cumsum(unrevealed, axis=1)
+        for i in range(chances.shape[1]):
+            said = i < said_right
+            nth_left = np.argmax(unrevealed & (rank == i + 1), axis=1)
+            guesses[said, i] = own_order[rows[said], nth_left[said]]
+        other_unrevealed = ~np.take_along_axis(revealed, other_order, axis=1)
+        first_left = np.argmax(other_unrevealed, axis=1)
+        wrong = (said_right < clue_sizes) & other_unrevealed[rows, first_left]
+        guesses[rows[wrong], said_right[wrong]] = other_order[rows[wrong], first_left[wrong]]
+        return guesses
+
+
+def self_play(
+        n_games: int,
+        first: TeamPolicy,
+        second: TeamPolicy,
+        layout: tuple[int, int, int] = (9, 8, 7),
+        seed: int | None = None,
+        max_rounds: int = 50
+    ) -> Dict[str, Any]:
+    """
+    This method plays 'n_games' games between two simulated teams, all at once, with the rules of
+    the game engine: teams alternate turns, the first team starting every round, and a round
+    started by the first team is always finished by the second one. Games still going after
+    'max_rounds' rounds have no winner.
+
+    Args:
+        n_games (int): Number of games.
+        first (TeamPolicy): Team that starts, with the first group of 'layout'.
+        second (TeamPolicy): Second team.
+        layout (tuple[int, int, int]): Words of the first team, the second team and neutral.
+        seed (int | None): Seed of the simulation.
+        max_rounds (int): Rounds played at most.
+    Return:
+        (Dict[str, Any]) The winner (0, 1 or -1), rounds and whether the black word decided the
+        game, per game, and the turns played.
+    """
+    rng = np.random.default_rng(seed)
+    policies = [first, second]
+    # Every board has its words in Board order, so they all have the same groups
+    groups = board_groups(n_games, layout)
+    winner = np.full(n_games, -1, dtype=np.int8)
+    black = np.zeros(n_games, dtype=bool)
+    rounds = np.zeros(n_games, dtype=np.int32)
+    # State of the games being played, dropped when their round ends with a winner
+    playing = np.arange(n_games)
+    revealed = np.zeros(groups.shape, dtype=bool)
+    left = np.tile(np.array([layout[0], layout[1], layout[2], 1], dtype=np.int64), (n_games, 1))
+    # Per team, the order in which its guessers say their right and wrong words
+    orders = []
+    for team_index in range(len(policies)):
+        own = groups[0] == team_index
+        orders.append([
+            np.flatnonzero(columns)[np.argsort(rng.random((n_games, columns.sum())), axis=1)]
+            for columns in [own, ~own]
+        ])
+    turns = 0
+    for round_number in range(max_rounds):
+        if len(playing) == 0:
+            break
+        game_over = np.zeros(len(playing), dtype=bool)
+        for team_index, policy in enumerate(policies):
+            team = np.full(len(playing), team_index, dtype=np.int64)
+            own_order, other_order = orders[team_index]
+            guesses = policy.guesses(own_order, other_order, revealed, left, team, rng)
+            # The guesses of the policies are always words left, said once
+            turn = evaluate_guesses(groups[:len(playing)], revealed, left, team, guesses, validate=False)
+            decided = turn["winner"] >= 0
+            # The last decisive word of the round sets the winner
+            winner[playing[decided]] = turn["winner"][decided]
+            black[playing[decided]] = turn["outcome"][decided] == TURN_BLACK
+            game_over |= decided
+            turns += len(playing)
+        rounds[playing] = round_number + 1
+        going = ~game_over
+        playing, revealed, left = playing[going], revealed[going], left[going]
+        orders = [[order[going] for order in team_orders] for team_orders in orders]
+    return {"winner": winner, "rounds": rounds, "black": black, "turns": turns}
+
+
+def summarize(games: Dict[str, Any]) -> Dict[str, float]:
+    winner = games["winner"]
+    decided = winner >= 0
+    return {
+        "games": len(winner),
+        "first_team_win_rate": float((winner == 0).mean()),
+        "second_team_win_rate": float((winner == 1).mean()),
+        "undecided_rate": float((~decided).mean()),
+        "black_word_rate": float(games["black"].mean()),
+        "mean_rounds": float(games["rounds"][decided].mean()) if decided.any() else 0.0,
+        "turns": int(games["turns"])
+    }
+
+
+def main(argv: List[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Monte Carlo estimate of the win rate of clue size and guess ordering policies"
+    )
+    parser.add_argument("--games", type=int, default=100_000, help="Games played with each team starting.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--policy-a", type=parse_clue_policy, default="fixed:2", help="Clue size of team A: 'fixed:K', 'all' or 'catchup:AHEAD:BEHIND'.")
+    parser.add_argument("--policy-b", type=parse_clue_policy, default="fixed:3", help="Clue size of team B.")
+    parser.add_argument("--ordering-a", choices=["confident_first", "shuffled"], default="confident_first")
+    parser.add_argument("--ordering-b", choices=["confident_first", "shuffled"], default="confident_first")
+    parser.add_argument("--accuracy", type=float, default=0.8, help="Mean chance of a guessed word being right.")
+    parser.add_argument("--clue-penalty", type=float, default=0.05, help="Accuracy lost per extra word of a clue.")
+    parser.add_argument("--spread", type=float, default=0.2, help="Accuracy gap between the words of a clue.")
+    args = parser.parse_args(argv)
+
+    team_a, team_b = [
+        TeamPolicy(policy, args.accuracy, args.clue_penalty, args.spread, ordering)
+        for policy, ordering in [(args.policy_a, args.ordering_a), (args.policy_b, args.ordering_b)]
+    ]
+    start = time.perf_counter()
+    # Every policy plays the same number of games as the first team (mirrored seats)
+    a_first = summarize(self_play(args.games, team_a, team_b, seed=args.seed))
+    b_first = summarize(self_play(args.games, team_b, team_a, seed=args.seed + 1))
+    elapsed = time.perf_counter() - start
+    turns = a_first["turns"] + b_first["turns"]
+    print(json.dumps({
+        "a_win_rate": (a_first["first_team_win_rate"] + b_first["second_team_win_rate"]) / 2,
+        "b_win_rate": (b_first["first_team_win_rate"] + a_first["second_team_win_rate"]) / 2,
+        "a_starting": a_first,
+        "b_starting": b_first,
+        "turns_per_second": turns / elapsed
+    }, indent=2))
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+from typing import List
+import json
+import re
+
+
+class WordsStreamParser:
+    """
+    Incremental parser of the list of words of a JSON object that is received in pieces, such as
+    a streamed '{"words": ["a", "b"], "justification": "..."}'. Every time a piece is fed it
+    returns the words of the list completed by it, so they can be used before the rest of the
+    object is generated.
+    """
+
+    key: str
+    words: List[str]
+    done: bool
+    complete: bool
+
+    def __init__(self, key: str = "words"):
+        self.key: str = key
+        self.words: List[str] = []
+        # True once the list is closed, and 'complete' if it was closed by its ']' (not by a
+        # value that isn't a string)
+        self.done: bool = False
+        self.complete: bool = False
+        self._text: str = ""
+        self._position: int | None = None
+        self._key_pattern: re.Pattern = re.compile(r'"' + re.escape(key) + r'"\s*:\s*\[')
+        return
+
+    @property
+    def text(self) -> str:
+        return self._text
+
+    def feed(self, piece: str) -> List[str]:
+        """
+        This method adds a piece of the JSON text.
+
+        Args:
+            piece (str): Next piece of the text.
+        Return:
+            (List[str]) Words of the list completed by this piece.
+        """
+        self._text += piece
+        if self.done:
+            return []
+        if self._position is None:
+            match = self._key_pattern.search(self._text)
+            if match is None:
+                return []
+            self._position = match.end()
+
+        new_words = []
+        text = self._text
+        while self._position < len(text):
+            char = text[self._position]
+            if char in " \t\r\n,":
+                self._position += 1
+            elif char == "]":
+                self.done = True
+                self.complete = True
+                self._position += 1
+                break
+            elif char == '"':
+                try:
+                    word, end = json.decoder.scanstring(text, self._position + 1)
+                except ValueError:
+                    # The string is not complete yet
+                    break
+                new_words.append(word)
+                self._position = end
+            else:
+                # Not a list of strings
+                self.done = True
+                break
+        self.words += new_words
+        return new_words
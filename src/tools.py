@@ -1,8 +1,13 @@
-from typing import List, Dict, Tuple, Any
-from langchain_core.tools import tool
+from typing import List, Dict, Any
 
-@tool
-def indicate_secret_code(
+from src.schemas import ResponseFormat
+
+# The tools are plain functions wrapped as langchain tools the first time they are used
+# ('from src.tools import choose_words' or 'get_tool'), so that importing this module
+# (and the game engine) doesn't import langchain.
+
+
+def _indicate_secret_code(
         word: str, 
         number: int, 
         justification: str, 
@@ -23,8 +28,8 @@ def indicate_secret_code(
     """
     return {"word": word, "number": number, "justification": justification, "words_related": words_related}
 
-@tool
-def choose_words(words: List[str], justification: str) -> Dict[str, List[str] | str]:
+
+def _choose_words(words: List[str], justification: str) -> Dict[str, List[str] | str]:
     """
     Used to indicate the words chosen by the guesser player
 
@@ -36,4 +41,98 @@ def choose_words(words: List[str], justification: str) -> Dict[str, List[str] |
     Returns:
     A python list containing the chosen words
     """
-    return {"words": words, "justification": justification}
\ No newline at end of file
+    return {"words": words, "justification": justification}
+
+
+_TOOL_FUNCTIONS = {
+    "indicate_secret_code": _indicate_secret_code,
+    "choose_words": _choose_words
+}
+
+# Langchain tools already built, by name
+_tools: Dict[str, Any] = {}
+
+ROLE_TOOLS = {
+    "captain": ["indicate_secret_code"],
+    "guesser": ["choose_words"]
+}
+
+# Arguments the players read from each tool call (the justification is optional)
+REQUIRED_ARGS = {
+    "indicate_secret_code": ["word", "number", "words_related"],
+    "choose_words": ["words"]
+}
+
+
+def _justification_schema(max_length: int | None) -> Dict[str, Any]:
+    schema: Dict[str, Any] = {"type": "string"}
+    if max_length is not None:
+        schema["maxLength"] = max_length
+    return schema
+
+
+def secret_code_format(own_words: List[str], max_justification_length: int | None = 200) -> ResponseFormat:
+    """
+    Schema of the 'indicate_secret_code' arguments for one turn: the related words can only be
+    the team's words left in the board. With 'max_justification_length' 0 there is no justification.
+    """
+    properties: Dict[str, Any] = {
+        "word": {"type": "string"},
+        "number": {"type": "integer", "minimum": 1, "maximum": max(len(own_words), 1)},
+        "words_related": {
+            "type": "array",
+            "items": {"type": "string", "enum": list(own_words)},
+            "minItems": 1,
+            "maxItems": max(len(own_words), 1)
+        }
+    }
+    if max_justification_length != 0:
+        properties["justification"] = _justification_schema(max_justification_length)
+    return ResponseFormat(
+        name="indicate_secret_code",
+        schema={"type": "object", "properties": properties, "required": list(properties)}
+    )
+
+
+def choice_format(
+        left_words: List[str],
+        max_words: int | None = None,
+        max_justification_length: int | None = 200
+    ) -> ResponseFormat:
+    """
+    Schema of the 'choose_words' arguments for one turn: the words can only be the ones left in
+    the board, each one once, at most 'max_words' of them.
+    """
+    properties: Dict[str, Any] = {
+        "words": {
+            "type": "array",
+            "items": {"type": "string", "enum": list(left_words)},
+            "uniqueItems": True,
+            "minItems": 1,
+            "maxItems": min(max_words or len(left_words), len(left_words))
+        }
+    }
+    if max_justification_length != 0:
+        properties["justification"] = _justification_schema(max_justification_length)
+    return ResponseFormat(
+        name="choose_words",
+        schema={"type": "object", "properties": properties, "required": list(properties)}
+    )
+
+
+def get_tool(name: str) -> Any:
+    if name not in _tools:
+        from langchain_core.tools import tool
+
+        _tools[name] = tool(name)(_TOOL_FUNCTIONS[name])
+    return _tools[name]
+
+
+def get_role_tools(role: str) -> List[Any]:
+    return [get_tool(name) for name in ROLE_TOOLS[role]]
+
+
+def __getattr__(name: str) -> Any:
+    if name in _TOOL_FUNCTIONS:
+        return get_tool(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
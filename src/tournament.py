@@ -0,0 +1,779 @@
+from typing import List, Dict, Any, Iterator, AsyncIterator, Callable, Type, Literal, TYPE_CHECKING
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import threading
+import time
+
+from src.batching import BatchedLLMModel
+from src.cache import ResponseCache, CachedLLMModel
+from src.compact import compact_results
+from src.consistency import Aggregation, sample_players
+from src.game import Board, Captain, Guesser, Team, SecretCodeGame
+from src.llm_wrapper import LLMModel, ChatOllamaLLMModel, ConcurrencyLimitedLLMModel
+from src.load_balancer import LoadBalancedLLMModel, get_endpoint_pool
+from src.metrics import MetricsRegistry, set_metrics_hook
+from src.registry import get_default_registry
+from src.resilience import ResilientLLMModel, get_latency_tracker
+from src.results_sink import ResultsSink
+from src.scheduler import ModelAffinityScheduler, ScheduledLLMModel
+from src.schemas import (
+    Results, PlayerData, TeamData, Teams, Matchup, GameJob, GameCheckpoint, TeamWords, EMBEDDING_PREFIX
+)
+from src.tools import get_role_tools
+from src.words import WORDS
+
+if TYPE_CHECKING:
+    # numpy is only imported when a pool of boards is used
+    from src.corpus import BoardPool
+
+
+def build_team(
+        color: str,
+        team_data: TeamData,
+        get_model: Callable[[PlayerData, List], LLMModel],
+        threaded: bool = False,
+        structured_output: bool = False,
+        stream_guesses: bool = False,
+        samples: int = 1,
+        aggregation: Aggregation = "borda"
+    ) -> Team:
+    """
+    Builds a team from its TeamData. 'get_model' receives a player spec and the tools its
+    model must be bound to, and returns the LLMModel of that player. With several 'samples' the
+    players also get a model per extra sample, with its own seed (see consistency.sample_players).
+    Streaming guessers take a single sample. Embedding players (see EMBEDDING_PREFIX) don't use
+    'get_model' nor any of the LLM options.
+    """
+    def get_models(player: PlayerData, role: str, samples: int) -> List[LLMModel]:
+        return [get_model(spec, get_role_tools(role)) for spec in sample_players(player, samples)]
+
+    if is_embedding_player(team_data.captain):
+        from src.embeddings import EmbeddingCaptain, get_embedding_model
+
+        captain = EmbeddingCaptain(name=f"{color}_captain", model=get_embedding_model(team_data.captain), tools=[])
+    else:
+        captain_model, *captain_samples = get_models(team_data.captain, "captain", samples)
+        captain = Captain(
+            name=f"{color}_captain",
+            model=captain_model,
+            threaded=threaded,
+            structured_output=structured_output,
+            sample_models=captain_samples,
+            aggregation=aggregation
+        )
+    if is_embedding_player(team_data.guesser):
+        from src.embeddings import EmbeddingGuesser, get_embedding_model
+
+        guesser = EmbeddingGuesser(name=f"{color}_guesser", model=get_embedding_model(team_data.guesser), tools=[])
+    else:
+        guesser_model, *guesser_samples = get_models(
+            team_data.guesser, "guesser", 1 if stream_guesses else samples
+        )
+        guesser = Guesser(
+            name=f"{color}_guesser",
+            model=guesser_model,
+            threaded=threaded,
+            structured_output=structured_output,
+            streaming=stream_guesses,
+            sample_models=guesser_samples,
+            aggregation=aggregation
+        )
+    return Team(color=color, players=[captain, guesser])
+
+
+def is_embedding_player(player: PlayerData) -> bool:
+    return player.model_name.startswith(EMBEDDING_PREFIX)
+
+
+def build_model(
+        player: PlayerData,
+        tools: List,
+        model_cls: Type[LLMModel],
+        model_kwargs: Dict[str, Any],
+        cache: ResponseCache | None = None,
+        resilience: Dict[str, Any] | None = None,
+        wrap: Callable[[LLMModel], LLMModel] | None = None
+    ) -> LLMModel:
+    """
+    Builds the model of a player: the backend, bounded by the 'resilience' settings, then wrapped
+    by 'wrap' (e.g. batching and concurrency limits) and finally by the 'cache', so that cached
+    answers don't wait for anything.
+    """
+    model = model_cls(
+        model_name=player.model_name,
+        temperature=player.temperature,
+        tools=tools,
+        seed=player.seed,
+        **model_kwargs
+    )
+    if resilience is not None:
+        model = ResilientLLMModel(model, **resilience)
+    if wrap is not None:
+        model = wrap(model)
+    if cache is not None:
+        model = CachedLLMModel(model, cache)
+    return model
+
+
+def checkpoint_file(checkpoint_dir: str | None, job: GameJob) -> str | None:
+    if checkpoint_dir is None:
+        return None
+    return os.path.join(checkpoint_dir, f"game-{job.game_id}.json")
+
+
+def checkpoint_matches(checkpoint: GameCheckpoint, job: GameJob) -> bool:
+    """
+    Whether a checkpoint was saved by the game of a job: same board, team order and players.
+    """
+    return (
+        dict(checkpoint.words) == dict(job.words)
+        and list(checkpoint.team_order) == list(job.team_order)
+        and checkpoint.teams == Teams(red=job.matchup.red, blue=job.matchup.blue)
+    )
+
+
+def new_game(
+        job: GameJob,
+        get_model: Callable[[PlayerData, List], LLMModel],
+        threaded: bool = False,
+        sink: ResultsSink | None = None,
+        checkpoint_path: str | None = None,
+        structured_output: bool = False,
+        stream_guesses: bool = False,
+        samples: int = 1,
+        aggregation: Aggregation = "borda"
+    ) -> SecretCodeGame:
+    """
+    Builds the game of a GameJob, resuming it if a checkpoint of the game was saved.
+    """
+    team_blue, team_red = [
+        build_team(
+            color, team_data, get_model, threaded, structured_output, stream_guesses, samples, aggregation
+        )
+        for color, team_data in [("blue", job.matchup.blue), ("red", job.matchup.red)]
+    ]
+    if checkpoint_path is not None and os.path.exists(checkpoint_path):
+        checkpoint = SecretCodeGame.load_checkpoint(checkpoint_path)
+        # Game ids restart in every tournament: a checkpoint of another game is overwritten
+        if checkpoint_matches(checkpoint, job):
+            return SecretCodeGame.resume(
+                checkpoint, team_blue=team_blue, team_red=team_red, sink=sink, checkpoint_path=checkpoint_path
+            )
+    return SecretCodeGame(
+        team_blue=team_blue,
+        team_red=team_red,
+        board=Board.from_team_words(job.words, job.team_order),
+        sink=sink,
+        checkpoint_path=checkpoint_path
+    )
+
+
+def play_game(
+        job: GameJob,
+        model_cls: Type[LLMModel],
+        model_kwargs: Dict[str, Any],
+        cache: ResponseCache | None = None,
+        threaded: bool = False,
+        sink: ResultsSink | None = None,
+        checkpoint_dir: str | None = None,
+        retries: int = 0,
+        structured_output: bool = False,
+        stream_guesses: bool = False,
+        resilience: Dict[str, Any] | None = None,
+        samples: int = 1,
+        aggregation: Aggregation = "borda"
+    ) -> Results:
+    """
+    Plays a single game described by a GameJob. It is executed inside the worker processes,
+    so everything it receives must be picklable. With a 'checkpoint_dir' a failed game is
+    retried from its last completed turn, and a game left unfinished by a killed worker is
+    resumed the next time its job is played.
+    """
+    def get_model(player: PlayerData, tools: List) -> LLMModel:
+        return build_model(player, tools, model_cls, model_kwargs, cache, resilience)
+
+    checkpoint_path = checkpoint_file(checkpoint_dir, job)
+    for attempt in range(retries + 1):
+        game = new_game(
+            job, get_model, threaded, sink, checkpoint_path, structured_output, stream_guesses, samples, aggregation
+        )
+        try:
+            game.play()
+            break
+        except Exception:
+            if attempt == retries:
+                raise
+    if checkpoint_path is not None and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return game.results
+
+
+class Tournament:
+
+    players: List[PlayerData]
+    games_per_matchup: int
+    mixed_teams: bool
+    model_cls: Type[LLMModel]
+    model_kwargs: Dict[str, Any]
+    words: List[str]
+    max_workers: int | None
+    cache: ResponseCache | None
+    threaded: bool
+    sink: ResultsSink | None
+    checkpoint_dir: str | None
+    retries: int
+    structured_output: bool
+    stream_guesses: bool
+    board_pool: "BoardPool | None"
+    difficulty_strata: int
+    resilience: Dict[str, Any] | None
+    samples: int
+    aggregation: Aggregation
+    completed: int
+    failed: int
+
+    def __init__(
+            self,
+            players: List[PlayerData],
+            games_per_matchup: int = 1,
+            mixed_teams: bool = False,
+            model_cls: Type[LLMModel] = ChatOllamaLLMModel,
+            model_kwargs: Dict[str, Any] | None = None,
+            words: List[str] = [w.lower() for w in WORDS],
+            seed: int | None = None,
+            max_workers: int | None = None,
+            cache: ResponseCache | None = None,
+            threaded: bool = False,
+            sink: ResultsSink | None = None,
+            checkpoint_dir: str | None = None,
+            retries: int = 0,
+            structured_output: bool = False,
+            stream_guesses: bool = False,
+            board_pool: "BoardPool | None" = None,
+            difficulty_strata: int = 1,
+            resilience: Dict[str, Any] | None = None,
+            samples: int = 1,
+            aggregation: Aggregation = "borda"
+        ) -> None:
+        """
+        Round-robin tournament between model specs.
+
+        Args:
+            players (List[PlayerData]): Model specs taking part in the tournament.
+            games_per_matchup (int): Boards played by each pair of teams. Every board is played
+                twice, once with each team on each color (mirrored boards).
+            mixed_teams (bool): If False, each spec plays as both captain and guesser of its team.
+                If True, every (captain, guesser) combination of specs is a team.
+            model_cls (Type[LLMModel]): LLMModel subclass used to build the players' models.
+            model_kwargs (Dict[str, Any]): Extra keyword arguments for 'model_cls'.
+            words (List[str]): Words used to generate the boards.
+            seed (int | None): Seed for the boards generation.
+            max_workers (int | None): Number of worker processes.
+            cache (ResponseCache | None): Cache shared by all the players' models.
+            threaded (bool): Whether players keep their conversation between turns.
+            sink (ResultsSink | None): Log where every game writes its rounds as they finish.
+            checkpoint_dir (str | None): Directory where every game saves its state after each
+                turn. Games left unfinished there are resumed when the tournament is run again.
+            retries (int): Times a failed game is resumed from its last checkpoint.
+            structured_output (bool): Whether players answer with JSON constrained to the board
+                words (see Player) instead of tool calls.
+            stream_guesses (bool): Whether guessers stream their answer and stop generating once
+                the turn is decided (see Guesser.stream_words). Implies structured outputs.
+            board_pool (BoardPool | None): Precomputed boards (see corpus.BoardPool) the boards
+                are drawn from, seeded by 'seed', instead of generating them from 'words'.
+            difficulty_strata (int): Number of difficulty quantiles of 'board_pool' the boards of
+                each pair of teams are drawn evenly from.
+            resilience (Dict[str, Any] | None): Keyword arguments of the ResilientLLMModel that
+                bounds the calls of every player (timeouts, retries, hedging), None to not use it.
+            samples (int): Answers sampled in parallel for every turn of a player, each with its
+                own seed. The turn is played with their aggregate (see src.consistency).
+            aggregation (Aggregation): How the words of the guessers' samples are aggregated,
+                "borda" or "majority". Secret codes are always chosen by majority vote.
+        """
+        self.players: List[PlayerData] = players
+        self.games_per_matchup: int = games_per_matchup
+        self.mixed_teams: bool = mixed_teams
+        self.model_cls: Type[LLMModel] = model_cls
+        self.model_kwargs: Dict[str, Any] = model_kwargs or {}
+        self.words: List[str] = words
+        self.max_workers: int | None = max_workers
+        self.cache: ResponseCache | None = cache
+        self.threaded: bool = threaded
+        self.sink: ResultsSink | None = sink
+        self.checkpoint_dir: str | None = checkpoint_dir
+        self.retries: int = retries
+        self.structured_output: bool = structured_output
+        self.stream_guesses: bool = stream_guesses
+        self.board_pool: "BoardPool | None" = board_pool
+        self.difficulty_strata: int = difficulty_strata
+        self.resilience: Dict[str, Any] | None = resilience
+        self.samples: int = samples
+        self.aggregation: Aggregation = aggregation
+        self._rng: random.Random = random.Random(seed)
+        self.completed: int = 0
+        self.failed: int = 0
+        self._start_time: float | None = None
+        return
+
+    def teams(self) -> List[TeamData]:
+        if self.mixed_teams:
+            return [
+                TeamData(captain=captain, guesser=guesser)
+                for captain, guesser in itertools.product(self.players, repeat=2)
+            ]
+        return [TeamData(captain=player, guesser=player) for player in self.players]
+
+    def boards(self) -> Iterator[tuple[TeamWords, List[Literal["red", "blue"]]]]:
+        """
+        Yields the team words and team order of the boards played by a pair of teams.
+        """
+        if self.board_pool is None:
+            for _ in range(self.games_per_matchup):
+                board = Board(self.words, rng=self._rng)
+                yield board.team_words, [board.first_team_color, board.second_team_color]
+            return
+        indices = self.board_pool.sample(
+            self.games_per_matchup, seed=self._rng.getrandbits(64), strata=self.difficulty_strata
+        )
+        for i in indices:
+            yield self.board_pool.team_words(int(i))
+        return
+
+    def jobs(self) -> Iterator[GameJob]:
+        """
+        Yields the games of the tournament: every pair of teams plays each of its boards twice,
+        once with each team as red, so that no team is favoured by the board.
+        """
+        game_id = 0
+        for team_a, team_b in itertools.combinations(self.teams(), 2):
+            for team_words, team_order in self.boards():
+                for red, blue in [(team_a, team_b), (team_b, team_a)]:
+                    yield GameJob(
+                        game_id=game_id,
+                        matchup=Matchup(red=red, blue=blue),
+                        words=team_words,
+                        team_order=team_order
+                    )
+                    game_id += 1
+
+    def warmup(self) -> Dict[str, Dict[str, float | None]]:
+        """
+        Loads every model of the tournament in the Ollama server before playing, so that no game
+        pays the model load time. Only applies to ChatOllamaLLMModel players. With several
+        servers (LoadBalancedLLMModel) it only checks which ones answer and what they have loaded,
+        the models are loaded where the requests are sent.
+        """
+        if issubclass(self.model_cls, LoadBalancedLLMModel):
+            get_endpoint_pool(self.model_kwargs["endpoints"]).refresh()
+            return {}
+        if not issubclass(self.model_cls, ChatOllamaLLMModel):
+            return {}
+        return get_default_registry().warmup(
+            [player.model_name for player in self.players if not is_embedding_player(player)],
+            base_url=self.model_kwargs.get("base_url")
+        )
+
+    def prepare_embeddings(self, jobs: List[GameJob]) -> None:
+        """
+        Embeds the clue vocabulary of the embedding players and the words of every board in this
+        process, before the games start, as only one process can add words to an EmbeddingCache.
+        The worker processes then only read it.
+        """
+        players = {player.model_name: player for player in self.players if is_embedding_player(player)}
+        if not players:
+            return
+        from src.embeddings import get_embedding_model
+
+        words = list(dict.fromkeys(
+            word
+            for job in jobs
+            for word in job.words["red"] + job.words["blue"] + job.words["neutral"] + [job.words["black"]]
+        ))
+        for player in players.values():
+            get_embedding_model(player).cache.get(words)
+        return
+
+    @property
+    def games_per_second(self) -> float:
+        if self._start_time is None:
+            return 0.0
+        elapsed = time.perf_counter() - self._start_time
+        return self.completed / elapsed if elapsed > 0 else 0.0
+
+    def run(self) -> Iterator[Results]:
+        """
+        Plays every game of the tournament in a pool of worker processes, yielding each
+        Results object as soon as its game is over (not in submission order).
+        """
+        jobs = list(self.jobs())
+        self.prepare_embeddings(jobs)
+        self._start_time = time.perf_counter()
+        self.completed = 0
+        self.failed = 0
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {
+                executor.submit(
+                    play_game, job, self.model_cls, self.model_kwargs, self.cache, self.threaded, self.sink,
+                    self.checkpoint_dir, self.retries, self.structured_output, self.stream_guesses,
+                    self.resilience, self.samples, self.aggregation
+                ): job
+                for job in jobs
+            }
+            for future in as_completed(futures):
+                try:
+                    results = future.result()
+                except Exception as e:
+                    self.failed += 1
+                    print(f"Game {futures[future].game_id} failed: {e!r}")
+                    continue
+                self.completed += 1
+                yield results
+
+
+class AsyncTournament(Tournament):
+    """
+    Tournament played in a single event loop. Games await their models instead of blocking,
+    so hundreds of games can be in flight at once without a thread or process per game.
+    Models are shared between games and each backend (model name) gets its own limit of
+    concurrent requests. If 'max_batch_size' is set, the requests to each model are grouped
+    in batches (see BatchedLLMModel), and the limit applies to the batches in flight. If a 'scheduler' is given, the calls of all the games are
+    grouped by model so that the server doesn't swap models constantly (see
+    ModelAffinityScheduler). Cached answers are served before any of these, so they never wait.
+    """
+
+    max_concurrent_games: int
+    max_concurrency_per_model: int
+    max_batch_size: int | None
+    max_batch_wait: float
+    scheduler: ModelAffinityScheduler | None
+
+    def __init__(
+            self,
+            players: List[PlayerData],
+            max_concurrent_games: int = 256,
+            max_concurrency_per_model: int = 8,
+            max_batch_size: int | None = None,
+            max_batch_wait: float = 0.01,
+            scheduler: ModelAffinityScheduler | None = None,
+            **kwargs: Any
+        ) -> None:
+        super().__init__(players, **kwargs)
+        self.max_concurrent_games: int = max_concurrent_games
+        self.max_concurrency_per_model: int = max_concurrency_per_model
+        self.max_batch_size: int | None = max_batch_size
+        self.max_batch_wait: float = max_batch_wait
+        self.scheduler: ModelAffinityScheduler | None = scheduler
+        self._models: Dict[tuple, LLMModel] = {}
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._batch_semaphores: Dict[str, threading.Semaphore] = {}
+        self._batchers: List[BatchedLLMModel] = []
+        return
+
+    def get_model(self, player: PlayerData, tools: List) -> LLMModel:
+        key = (player.model_name, player.temperature, player.seed, tuple(id(t) for t in tools))
+        if key not in self._models:
+            semaphore = self._semaphores.setdefault(
+                player.model_name, asyncio.Semaphore(self.max_concurrency_per_model)
+            )
+
+            def wrap(model: LLMModel) -> LLMModel:
+                # Cache hits are answered before any of these, so they don't take a slot
+                if self.max_batch_size is not None:
+                    # The batches are limited, not their requests, so a batch can be filled
+                    batch_semaphore = self._batch_semaphores.setdefault(
+                        player.model_name, threading.Semaphore(self.max_concurrency_per_model)
+                    )
+                    model = BatchedLLMModel(
+                        model, self.max_batch_size, self.max_batch_wait, semaphore=batch_semaphore
+                    )
+                    self._batchers.append(model)
+                model = ConcurrencyLimitedLLMModel(model, semaphore, limit_chat=self.max_batch_size is None)
+                if self.scheduler is not None:
+                    model = ScheduledLLMModel(model, self.scheduler)
+                return model
+            model = build_model(
+                player, tools, self.model_cls, self.model_kwargs, self.cache, self.resilience, wrap
+            )
+            self._models[key] = model
+        return self._models[key]
+
+    async def _play_job(self, job: GameJob, game_slots: asyncio.Semaphore) -> Results:
+        async with game_slots:
+            checkpoint_path = checkpoint_file(self.checkpoint_dir, job)
+            for attempt in range(self.retries + 1):
+                game = new_game(
+                    job, self.get_model, self.threaded, self.sink, checkpoint_path,
+                    self.structured_output, self.stream_guesses, self.samples, self.aggregation
+                )
+                try:
+                    await game.aplay()
+                    break
+                except Exception:
+                    if attempt == self.retries:
+                        raise
+            if checkpoint_path is not None and os.path.exists(checkpoint_path):
+                os.remove(checkpoint_path)
+            return game.results
+
+    async def arun(self) -> AsyncIterator[Results]:
+        """
+        Plays every game of the tournament concurrently, yielding each Results object as
+        soon as its game is over.
+        """
+        self._start_time = time.perf_counter()
+        self.completed = 0
+        self.failed = 0
+        # Semaphores must be created inside the running event loop
+        self._models = {}
+        self._semaphores = {}
+        game_slots = asyncio.Semaphore(self.max_concurrent_games)
+        tasks = [asyncio.create_task(self._play_job(job, game_slots)) for job in self.jobs()]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                try:
+                    results = await next_done
+                except Exception as e:
+                    self.failed += 1
+                    print(f"Game failed: {e!r}")
+                    continue
+                self.completed += 1
+                yield results
+        finally:
+            for batcher in self._batchers:
+                batcher.close()
+            self._batchers = []
+
+    def run(self) -> Iterator[Results]:
+        """
+        Synchronous access to 'arun'. All the results are collected before being returned.
+        """
+        async def collect() -> List[Results]:
+            return [results async for results in self.arun()]
+        return iter(asyncio.run(collect()))
+
+
+def parse_player(spec: str) -> PlayerData:
+    """
+    Parses a 'model_name[,temperature[,seed]]' command line spec.
+    """
+    model_name, _, rest = spec.partition(",")
+    temperature, _, seed = rest.partition(",")
+    return PlayerData(
+        model_name=model_name,
+        temperature=float(temperature) if temperature else 0.1,
+        seed=int(seed) if seed else None
+    )
+
+
+def build_parser(parser: argparse.ArgumentParser | None = None) -> argparse.ArgumentParser:
+    parser = parser or argparse.ArgumentParser(description="Run a Secret Code tournament")
+    parser.add_argument("--model", action="append", default=[], type=parse_player,
+                        help="Player spec 'model_name[,temperature[,seed]]'. Can be repeated. "
+                             "'embedding:<fastembed model>' plays the embedding baseline.")
+    parser.add_argument("--players", help="JSON file with a list of PlayerData objects.")
+    parser.add_argument("--games", type=int, default=1, help="Boards per matchup.")
+    parser.add_argument("--mixed-teams", action="store_true",
+                        help="Play every captain/guesser combination of models.")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes.")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for the boards.")
+    parser.add_argument("--board-pool", default=None,
+                        help="Pool of boards (see 'python -m src boards pool') to draw the boards from.")
+    parser.add_argument("--difficulty-strata", type=int, default=1,
+                        help="Difficulty quantiles of the pool the boards of each matchup are drawn evenly from.")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="Play all the games in a single event loop instead of worker processes.")
+    parser.add_argument("--max-concurrent-games", type=int, default=256,
+                        help="Games in flight at once when using --async.")
+    parser.add_argument("--max-concurrency-per-model", type=int, default=8,
+                        help="Concurrent requests (batches with --max-batch-size) per model when using --async.")
+    parser.add_argument("--max-batch-size", type=int, default=None,
+                        help="Group the requests to each model in batches when using --async.")
+    parser.add_argument("--max-batch-wait", type=float, default=0.01,
+                        help="Seconds a request waits for its batch to be filled.")
+    parser.add_argument("--model-affinity", action="store_true",
+                        help="Group the calls of the games by model to avoid model swaps in the server (--async).")
+    parser.add_argument("--affinity-burst", type=int, default=32,
+                        help="Calls sent to a model before switching to another waiting one.")
+    parser.add_argument("--affinity-max-wait", type=float, default=30.0,
+                        help="Seconds a call can wait for its model before the others stop being sent.")
+    parser.add_argument("--affinity-policy", choices=["longest_queue", "oldest_request"], default="longest_queue",
+                        help="Waiting model loaded next.")
+    parser.add_argument("--affinity-loaded-models", type=int, default=1,
+                        help="Models the server can hold in memory at once.")
+    parser.add_argument("--threaded", action="store_true",
+                        help="Players keep their conversation and only receive what changed each turn.")
+    parser.add_argument("--structured-output", action="store_true",
+                        help="Players answer with JSON restricted to the board words instead of tool calls.")
+    parser.add_argument("--stream-guesses", action="store_true",
+                        help="Guessers stream their answer and stop generating once the turn is decided.")
+    parser.add_argument("--endpoint", action="append", default=[],
+                        help="Ollama server URL. Can be repeated to balance the requests across several servers.")
+    parser.add_argument("--call-timeout", type=float, default=None,
+                        help="Seconds a model call can take before it is cancelled and retried.")
+    parser.add_argument("--call-retries", type=int, default=0,
+                        help="Times a failed, timed out or invalid (no tool call) model call is retried.")
+    parser.add_argument("--hedge-percentile", type=float, default=None,
+                        help="Send a call again to another --endpoint once it is slower than this percentile "
+                             "of the model latencies. Needs several --endpoint.")
+    parser.add_argument("--hedge-min-samples", type=int, default=20,
+                        help="Calls of a model observed before hedging its calls.")
+    parser.add_argument("--samples", type=int, default=1,
+                        help="Answers sampled in parallel (one seed each) for every turn, played by their aggregate.")
+    parser.add_argument("--aggregation", choices=["borda", "majority"], default="borda",
+                        help="How the guessers' samples are aggregated: Borda count or majority of the samples.")
+    parser.add_argument("--no-warmup", dest="warmup", action="store_false",
+                        help="Don't load the models in the server before playing.")
+    parser.add_argument("--cache", default=None,
+                        help="SQLite file used to cache the LLM responses. Streamed guesses are cached once "
+                             "their list of words is complete, not when the guesser stopped within it.")
+    parser.add_argument("--cache-max-entries", type=int, default=100_000,
+                        help="Maximum number of cached responses.")
+    parser.add_argument("--output", default=None, help="JSON lines file to write the Results to.")
+    parser.add_argument("--prompts", choices=["full", "refs", "zlib", "drop"], default="full",
+                        help="How the prompts are written to --output: as text, as references to the "
+                             "game events they show, compressed, or not at all (see src.compact).")
+    parser.add_argument("--metrics", default=None,
+                        help="File to write the LLM call metrics to (Prometheus text, or JSON if it ends with .json).")
+    parser.add_argument("--log", default=None,
+                        help="JSON lines file where every round is written as soon as it is over.")
+    parser.add_argument("--checkpoint-dir", default=None,
+                        help="Directory where games save their state after every turn, to be resumed.")
+    parser.add_argument("--retries", type=int, default=0,
+                        help="Times a failed game is resumed from its last completed turn.")
+    return parser
+
+
+def main(argv: List[str] | None = None) -> None:
+    args = build_parser().parse_args(argv)
+    run_from_args(args)
+    return
+
+
+def run_from_args(args: argparse.Namespace) -> None:
+    players = list(args.model)
+    if args.players:
+        with open(args.players) as f:
+            players += [PlayerData(**player) for player in json.load(f)]
+    tournament_kwargs = dict(
+        games_per_matchup=args.games,
+        mixed_teams=args.mixed_teams,
+        seed=args.seed,
+        max_workers=args.workers,
+        cache=ResponseCache(args.cache, max_entries=args.cache_max_entries) if args.cache else None,
+        threaded=args.threaded,
+        sink=ResultsSink(args.log) if args.log else None,
+        checkpoint_dir=args.checkpoint_dir,
+        retries=args.retries,
+        structured_output=args.structured_output,
+        stream_guesses=args.stream_guesses,
+        difficulty_strata=args.difficulty_strata,
+        samples=args.samples,
+        aggregation=args.aggregation
+    )
+    if len(args.endpoint) == 1:
+        tournament_kwargs["model_kwargs"] = {"base_url": args.endpoint[0]}
+    elif len(args.endpoint) > 1:
+        tournament_kwargs["model_cls"] = LoadBalancedLLMModel
+        tournament_kwargs["model_kwargs"] = {"endpoints": args.endpoint}
+    if args.call_timeout is not None:
+        # Requests still open at the deadline are closed by the client
+        tournament_kwargs.setdefault("model_kwargs", {})["timeout"] = args.call_timeout
+    if args.hedge_percentile is not None and len(args.endpoint) < 2:
+        # Sending a slow request again to the same server only adds to its load
+        raise SystemExit("--hedge-percentile needs several --endpoint servers")
+    if args.call_timeout is not None or args.call_retries > 0 or args.hedge_percentile is not None:
+        tournament_kwargs["resilience"] = dict(
+            timeout=args.call_timeout,
+            max_attempts=args.call_retries + 1,
+            hedge_percentile=args.hedge_percentile,
+            min_samples=args.hedge_min_samples
+        )
+    if args.board_pool:
+        from src.corpus import BoardPool
+        tournament_kwargs["board_pool"] = BoardPool.load(args.board_pool)
+    if args.use_async:
+        tournament = AsyncTournament(
+            players,
+            max_concurrent_games=args.max_concurrent_games,
+            max_concurrency_per_model=args.max_concurrency_per_model,
+            max_batch_size=args.max_batch_size,
+            max_batch_wait=args.max_batch_wait,
+            scheduler=ModelAffinityScheduler(
+                max_burst=args.affinity_burst,
+                max_wait=args.affinity_max_wait,
+                policy=args.affinity_policy,
+                max_loaded_models=args.affinity_loaded_models
+            ) if args.model_affinity else None,
+            **tournament_kwargs
+        )
+    else:
+        tournament = Tournament(players, **tournament_kwargs)
+    if len(tournament.teams()) < 2:
+        raise SystemExit("At least two teams are needed for a tournament")
+    if tournament.samples < 1:
+        raise SystemExit("--samples must be at least 1")
+    if args.warmup:
+        tournament.warmup()
+        print(get_default_registry().report())
+    output = open(args.output, "a") if args.output else None
+    registry = MetricsRegistry() if args.metrics else None
+    if registry is not None and args.use_async:
+        set_metrics_hook(registry)
+
+    def report(results: Results) -> None:
+        if registry is not None:
+            if not args.use_async:
+                # Games played in worker processes: their usage comes with the Results
+                registry.observe_results(results)
+            registry.write(args.metrics)
+        if output is not None:
+            if args.prompts == "full":
+                output.write(results.model_dump_json() + "\n")
+            else:
+                output.write(compact_results(results, args.prompts).model_dump_json(exclude_defaults=True) + "\n")
+            output.flush()
+        print(
+            f"[{tournament.completed} games] winner: {results.winner_team}, "
+            f"rounds: {results.num_rounds}, {tournament.games_per_second:.3f} games/sec"
+        )
+
+    async def consume() -> None:
+        async for results in tournament.arun():
+            report(results)
+
+    try:
+        if args.use_async:
+            asyncio.run(consume())
+        else:
+            for results in tournament.run():
+                report(results)
+    finally:
+        if output is not None:
+            output.close()
+    print(f"Finished: {tournament.completed} games, {tournament.failed} failed, "
+          f"{tournament.games_per_second:.3f} games/sec")
+    if args.use_async and tournament.scheduler is not None:
+        print(tournament.scheduler.report())
+    if len(args.endpoint) > 1 and args.use_async:
+        print(get_endpoint_pool(args.endpoint).report())
+    elif len(args.endpoint) > 1:
+        # Each worker process balances and counts its own requests, which aren't sent back
+        print("Endpoints: requests were balanced by each worker process on its own, "
+              "use --async for the requests, failures and tokens of every server")
+    if tournament.resilience is not None and args.use_async:
+        print(get_latency_tracker().report())
+    if tournament.cache is not None and not args.use_async:
+        # Hits and misses are counted inside the worker processes
+        print(f"Cache: {tournament.cache.stats()['entries']} entries")
+    elif tournament.cache is not None:
+        print(f"Cache: {tournament.cache.stats()}")
+    return
+
+
+if __name__ == "__main__":
+    main()